@@ -0,0 +1,301 @@
+import argparse
+import copy
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import cv2
+
+from package.cli import DEFAULT_CONCENTRATION, parse_concentration, summarize_calibration, summarize_mixture, to_builtin
+from package.image_processing import parameter
+from package.image_processing.image_processing import PreprocessingContext, read_image, preprocessing_calibration, preprocessing_mixture, segment_mask_streamed, run_stage
+from package.image_processing.util import groupBoundingBox
+from package.tlc_class.calibration import Calibration, PeakInfo
+from package.tlc_class.mixture import Mixture
+from package.tlc_class.mixture_hack import MixtureHack
+from package.tlc_class.solver import CalibrationSolver
+from package.tlc_class.uncertainty import DRAW_COUNT
+from benchmarks.synthetic_plate import synthetic_dataset, compound_absorbance, mixture_lane_plate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_CALIBRATION = ['Input/Calibration/*']
+SAMPLE_MIXTURE = ['Input/Mixture/*', 'input/Mixture/*']
+REFERENCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference.json')
+SYNTHETIC_SIZE = (2400, 1500)
+
+SCALE = [0.5, 1, 2]
+BOX_COUNT = [100, 1000, 10000]
+LANE_COUNT = [1, 5, 10]
+# Tall scan (width, height) and threshold blocks up to the mixture block, which is the whole height
+THRESHOLD_SIZE = (1000, 6000)
+THRESHOLD_BLOCK = [31, 545, 2001, 6001]
+COMPOUND_COUNT = [1, 2, 3, 4]
+MIXTURE_COUNT = [10, 100, 1000]
+GROUND_TRUTH_SEED = [0, 1, 2, 3]
+# Largest relative error of a solved concentration against the drawn one
+GROUND_TRUTH_TOLERANCE = 0.2
+# Relative tolerance when comparing outputs against reference.json
+REFERENCE_RTOL = 1e-6
+
+def time_call(function, *args, repeat: int = 3) -> tuple[dict, object]:
+    """ Median and best wall time of function(*args) over repeat runs, plus the last result. """
+    list_seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        list_seconds.append(time.perf_counter() - start)
+    return {'median_ms': statistics.median(list_seconds) * 1000, 'min_ms': min(list_seconds) * 1000}, result
+
+def sample_paths(list_pattern: list[str]) -> list[str]:
+    list_path = []
+    for pattern in list_pattern:
+        list_path += sorted(glob.glob(os.path.join(ROOT, pattern)))
+    return list_path
+
+def relative_path(path: str) -> str:
+    return os.path.relpath(path, ROOT).replace(os.sep, '/')
+
+def record(benchmark: str, input_name: str, size: int, timing: dict) -> dict:
+    return {'benchmark': benchmark, 'input': input_name, 'size': size, **timing}
+
+def benchmark_sample(concentration: list[float], repeat: int) -> tuple[list[dict], dict]:
+    """ Time every hot path on the sample plates and collect their outputs for the reference check. """
+    list_record = []
+    output = {}
+    list_calibration = []
+    for path in sample_paths(SAMPLE_CALIBRATION):
+        name = relative_path(path)
+        image = read_image(path)
+        timing, (list_cropped, _) = time_call(preprocessing_calibration, image, repeat=repeat)
+        list_record.append(record('preprocessing_calibration', name, image.size, timing))
+        timing, _ = time_call(lambda: [PeakInfo(cropped, concentration) for cropped in list_cropped], repeat=repeat)
+        list_record.append(record('PeakInfo', name, sum(cropped.size for cropped in list_cropped), timing))
+        calibration = Calibration(os.path.basename(path), image, concentration)
+        list_calibration.append(calibration)
+        output[name] = summarize_calibration(calibration)
+    for path in sample_paths(SAMPLE_MIXTURE):
+        name = relative_path(path)
+        image = read_image(path)
+        timing, _ = time_call(preprocessing_mixture, image, repeat=repeat)
+        list_record.append(record('preprocessing_mixture', name, image.size, timing))
+        timing, mixture = time_call(Mixture, os.path.basename(path), image, repeat=repeat)
+        list_record.append(record('Mixture', name, image.size, timing))
+        output[name] = summarize_mixture(mixture)
+        if list_calibration:
+            mixture_hack = MixtureHack(mixture, list_calibration)
+            timing, _ = time_call(lambda: [mixture_hack.solve_equation(color) for color in 'RGB'], repeat=repeat)
+            list_record.append(record('MixtureHack.solve_equation', name, len(list_calibration), timing))
+            output[name]['solution'] = mixture_hack.solution
+    return list_record, output
+
+def benchmark_scaling(list_scale: list[float], repeat: int) -> list[dict]:
+    """ Time the image paths on synthetic plates whose sides grow by each scale. """
+    list_record = []
+    for scale in list_scale:
+        size = (int(SYNTHETIC_SIZE[0] * scale), int(SYNTHETIC_SIZE[1] * scale))
+        dataset = synthetic_dataset(size=size)
+        image_calibration = dataset['calibration']['compound_1']
+        image_mixture = dataset['mixture']
+        name = f'synthetic {size[0]}x{size[1]}'
+        timing, (list_cropped, _) = time_call(preprocessing_calibration, image_calibration, repeat=repeat)
+        list_record.append(record('preprocessing_calibration', name, image_calibration.size, timing))
+        timing, _ = time_call(segment_mask_streamed, image_calibration, 'Calibration', 1.0, parameter.STREAM_STRIP_TILE_ROWS, repeat=repeat)
+        list_record.append(record('segment_mask_streamed', name, image_calibration.size, timing))
+        timing, _ = time_call(lambda: [PeakInfo(cropped, dataset['concentration']) for cropped in list_cropped], repeat=repeat)
+        list_record.append(record('PeakInfo', name, sum(cropped.size for cropped in list_cropped), timing))
+        timing, _ = time_call(preprocessing_mixture, image_mixture, repeat=repeat)
+        list_record.append(record('preprocessing_mixture', name, image_mixture.size, timing))
+        context = PreprocessingContext()
+        preprocessing_mixture(image_mixture, context=context)
+        timing, _ = time_call(preprocessing_mixture, image_mixture, False, context, repeat=repeat)
+        list_record.append(record('preprocessing_context', name, image_mixture.size, timing))
+        timing, _ = time_call(Mixture, 'mixture', image_mixture, repeat=repeat)
+        list_record.append(record('Mixture', name, image_mixture.size, timing))
+    return list_record
+
+def benchmark_group_bounding_box(list_count: list[int], repeat: int) -> list[dict]:
+    """ Time groupBoundingBox on full-width rows (the calibration case) and on scattered boxes. """
+    list_record = []
+    rng = np.random.default_rng(0)
+    for count in list_count:
+        box_row = np.column_stack([np.zeros(count), rng.integers(0, 40 * count, count), np.full(count, 2400), rng.integers(5, 80, count)]).astype(int)
+        timing, _ = time_call(groupBoundingBox, box_row, repeat=repeat)
+        list_record.append(record('groupBoundingBox', 'rows', count, timing))
+        box_scattered = np.column_stack([rng.integers(0, 40 * count, (count, 2)), rng.integers(5, 80, (count, 2))])
+        timing, _ = time_call(groupBoundingBox, box_scattered, repeat=repeat)
+        list_record.append(record('groupBoundingBox', 'scattered', count, timing))
+    return list_record
+
+def benchmark_lanes(list_lane_count: list[int], repeat: int) -> list[dict]:
+    """ Time Mixture.from_plate on multi-lane plates of the same size as the lane count grows. """
+    list_record = []
+    absorbance = compound_absorbance(2, 4)
+    rng = np.random.default_rng(0)
+    for lane_count in list_lane_count:
+        image = mixture_lane_plate(absorbance, rng.uniform(10, 45, size=(lane_count, 2)), SYNTHETIC_SIZE)
+        timing, _ = time_call(Mixture.from_plate, 'plate', image, repeat=repeat)
+        list_record.append(record('Mixture.from_plate', f'{lane_count} lanes {SYNTHETIC_SIZE[0]}x{SYNTHETIC_SIZE[1]}', image.size, timing))
+    return list_record
+
+def benchmark_threshold(list_block_size: list[int], repeat: int) -> list[dict]:
+    """ Time the adaptive threshold of a tall mixture scan as the block grows to the full height. """
+    list_record = []
+    image = cv2.resize(run_stage('grayscale', synthetic_dataset(size=SYNTHETIC_SIZE)['mixture']), THRESHOLD_SIZE, interpolation=cv2.INTER_LINEAR)
+    for block_size in list_block_size:
+        timing, _ = time_call(lambda: run_stage('threshold', image, block_size=block_size), repeat=repeat)
+        list_record.append(record('threshold', f'block {block_size} {THRESHOLD_SIZE[0]}x{THRESHOLD_SIZE[1]}', image.size, timing))
+    return list_record
+
+def benchmark_solve(list_compound_count: list[int], repeat: int) -> list[dict]:
+    """ Time MixtureHack.solve_equation for R, G and B as the number of compounds grows. """
+    list_record = []
+    size = (SYNTHETIC_SIZE[0] // 2, SYNTHETIC_SIZE[1] // 2)
+    for compound_count in list_compound_count:
+        dataset = synthetic_dataset(compound_count, compound_count + 2, size=size)
+        list_calibration = [Calibration(name, image, dataset['concentration']) for name, image in dataset['calibration'].items()]
+        mixture_hack = MixtureHack(Mixture('mixture', dataset['mixture']), list_calibration)
+        timing, _ = time_call(lambda: [mixture_hack.solve_equation(color) for color in 'RGB'], repeat=repeat)
+        list_record.append(record('MixtureHack.solve_equation', f'{compound_count} compounds', compound_count, timing))
+    return list_record
+
+def benchmark_solve_batch(list_mixture_count: list[int], repeat: int) -> list[dict]:
+    """ Time solving many mixtures against three calibrations, one MixtureHack each against one CalibrationSolver call, and their error bars. """
+    list_record = []
+    size = (SYNTHETIC_SIZE[0] // 2, SYNTHETIC_SIZE[1] // 2)
+    dataset = synthetic_dataset(3, 5, size=size)
+    list_calibration = [Calibration(name, image, dataset['concentration']) for name, image in dataset['calibration'].items()]
+    mixture = Mixture('mixture', dataset['mixture'])
+    rng = np.random.default_rng(0)
+    for mixture_count in list_mixture_count:
+        # Same plate with every peak area scaled independently
+        scale = rng.uniform(0.5, 1.5, (mixture_count, 3, len(mixture.peak_area['R'])))
+        peak_area = {color: np.asarray(mixture.peak_area[color], dtype=np.float64) * scale[:, i] for i, color in enumerate('RGB')}
+        list_mixture = []
+        for j in range(mixture_count):
+            mixture_copy = copy.copy(mixture)
+            mixture_copy.peak_area = {color: peak_area[color][j] for color in 'RGB'}
+            list_mixture.append(mixture_copy)
+        timing, _ = time_call(lambda: [MixtureHack(mixture_copy, list_calibration).solve_all() for mixture_copy in list_mixture], repeat=repeat)
+        list_record.append(record('MixtureHack.solve_all', f'{mixture_count} mixtures', mixture_count, timing))
+        timing, _ = time_call(lambda: CalibrationSolver(list_calibration).solve(peak_area), repeat=repeat)
+        list_record.append(record('CalibrationSolver.solve', f'{mixture_count} mixtures', mixture_count, timing))
+        timing, _ = time_call(lambda: CalibrationSolver(list_calibration).estimate_uncertainty(peak_area), repeat=repeat)
+        list_record.append(record('estimate_uncertainty', f'{mixture_count} mixtures, {DRAW_COUNT} draws', mixture_count, timing))
+    return list_record
+
+def solve_synthetic(dataset: dict) -> tuple[Mixture, list[Calibration], MixtureHack]:
+    list_calibration = [Calibration(name, image, dataset['concentration']) for name, image in dataset['calibration'].items()]
+    mixture = Mixture('mixture', dataset['mixture'])
+    mixture_hack = MixtureHack(mixture, list_calibration)
+    mixture_hack.solve_all(stacked=True)
+    return mixture, list_calibration, mixture_hack
+
+def check_ground_truth(list_seed: list[int], tolerance: float) -> tuple[list[dict], list[str]]:
+    """ Solve synthetic mixtures and compare peak counts, calibration R² and concentrations with what was drawn. """
+    list_record = []
+    list_failure = []
+    for seed in list_seed:
+        for compound_count, peak_count in [(1, 3), (2, 4), (3, 5)]:
+            case = f'seed {seed}, {compound_count} compounds, {peak_count} peaks'
+            dataset = synthetic_dataset(compound_count, peak_count, seed=seed)
+            mixture, list_calibration, mixture_hack = solve_synthetic(dataset)
+            count_peak = [len(calibration.peaks) for calibration in list_calibration] + [len(mixture.peak_area['R'])]
+            min_r2 = min(peak.r2[color] for calibration in list_calibration for peak in calibration.peaks for color in 'RGB')
+            truth = dataset['mixture_concentration']
+            error = max(abs(mixture_hack.solution['RGB'][name] - value) / value for name, value in truth.items())
+            list_record.append({'case': case, 'peak_count': count_peak, 'min_r2': min_r2, 'max_relative_error': error})
+            if any(count != peak_count for count in count_peak):
+                list_failure.append(f'{case}: found {count_peak} peaks, drew {peak_count}')
+            if min_r2 < 0.99:
+                list_failure.append(f'{case}: calibration r² {min_r2} below 0.99')
+            if error > tolerance:
+                list_failure.append(f'{case}: concentration error {error:.1%} above {tolerance:.0%}')
+    return list_record, list_failure
+
+def synthetic_output() -> dict:
+    """ Outputs for the default synthetic dataset, kept in the reference next to the sample plates. """
+    mixture, list_calibration, mixture_hack = solve_synthetic(synthetic_dataset())
+    output = {f'synthetic/{calibration.name}': summarize_calibration(calibration) for calibration in list_calibration}
+    output['synthetic/mixture'] = {**summarize_mixture(mixture), 'solution': mixture_hack.solution}
+    return output
+
+def compare(actual, expected, path: str = '') -> list[str]:
+    """ Every difference between two JSON values, with floats compared to REFERENCE_RTOL. """
+    if isinstance(expected, dict):
+        if not isinstance(actual, dict) or set(actual) != set(expected):
+            return [f'{path}: keys {sorted(actual) if isinstance(actual, dict) else actual} != {sorted(expected)}']
+        return [difference for key in expected for difference in compare(actual[key], expected[key], f'{path}/{key}')]
+    if isinstance(expected, list):
+        if not isinstance(actual, list) or len(actual) != len(expected):
+            return [f'{path}: {actual} != {expected}']
+        return [difference for i, (a, e) in enumerate(zip(actual, expected)) for difference in compare(a, e, f'{path}[{i}]')]
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        if np.isclose(actual, expected, rtol=REFERENCE_RTOL, atol=1e-9, equal_nan=True):
+            return []
+    elif actual == expected:
+        return []
+    return [f'{path}: {actual} != {expected}']
+
+def format_table(list_record: list[dict]) -> str:
+    lines = [f"{'Benchmark':<28}{'Input':<46}{'Size':>12}{'median ms':>12}{'min ms':>10}"]
+    for entry in list_record:
+        lines.append(f"{entry['benchmark']:<28}{entry['input']:<46}{entry['size']:>12}{entry['median_ms']:>12.2f}{entry['min_ms']:>10.2f}")
+    return '\n'.join(lines)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run_benchmark', description='Time the TLC hot paths and check their answers against ground truth.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per measurement, the median is reported')
+    parser.add_argument('--quick', action='store_true', help='Smaller sizes and one ground-truth seed')
+    parser.add_argument('-o', '--output', default=None, help='Write timings and checks as JSON to this file')
+    parser.add_argument('--tolerance', type=float, default=GROUND_TRUTH_TOLERANCE, help='Largest relative concentration error on synthetic plates')
+    parser.add_argument('--update-reference', action='store_true', help='Store the current outputs as the new reference.json')
+    parser.add_argument('-c', '--concentration', default=DEFAULT_CONCENTRATION, help='Space separated concentrations of the sample calibrations')
+    return parser
+
+def main(argv: list[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    list_scale = SCALE[:2] if args.quick else SCALE
+    list_count = BOX_COUNT[:2] if args.quick else BOX_COUNT
+    list_compound_count = COMPOUND_COUNT[:2] if args.quick else COMPOUND_COUNT
+    list_mixture_count = MIXTURE_COUNT[:2] if args.quick else MIXTURE_COUNT
+    list_lane_count = LANE_COUNT[::2] if args.quick else LANE_COUNT
+    list_block_size = THRESHOLD_BLOCK[::3] if args.quick else THRESHOLD_BLOCK
+    list_seed = GROUND_TRUTH_SEED[:1] if args.quick else GROUND_TRUTH_SEED
+
+    list_record, output = benchmark_sample(parse_concentration(args.concentration), args.repeat)
+    list_record += benchmark_scaling(list_scale, args.repeat)
+    list_record += benchmark_group_bounding_box(list_count, args.repeat)
+    list_record += benchmark_lanes(list_lane_count, args.repeat)
+    list_record += benchmark_threshold(list_block_size, args.repeat)
+    list_record += benchmark_solve(list_compound_count, args.repeat)
+    list_record += benchmark_solve_batch(list_mixture_count, args.repeat)
+    print(format_table(list_record))
+
+    ground_truth, list_failure = check_ground_truth(list_seed, args.tolerance)
+    print(f"\nGround truth: {len(ground_truth)} synthetic cases, largest concentration error {max(entry['max_relative_error'] for entry in ground_truth):.1%}")
+
+    output.update(synthetic_output())
+    output = json.loads(json.dumps(output, default=to_builtin))
+    if args.update_reference:
+        with open(REFERENCE_PATH, 'w') as file:
+            json.dump(output, file, indent=1)
+        print(f"Reference written to {relative_path(REFERENCE_PATH)}")
+    elif os.path.exists(REFERENCE_PATH):
+        with open(REFERENCE_PATH) as file:
+            list_failure += compare(output, json.load(file), 'reference')
+    else:
+        print("No reference.json yet, run with --update-reference to create it")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'timing': list_record, 'ground_truth': ground_truth, 'failure': list_failure}, file, indent=1, default=to_builtin)
+    for failure in list_failure:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if list_failure else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
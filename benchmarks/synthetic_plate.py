@@ -0,0 +1,108 @@
+import numpy as np
+
+DEFAULT_CONCENTRATION = [20, 40, 60, 80, 100]
+# Darkness of a spot per unit concentration at absorbance 1, so 100 units darken a channel by 200
+DARKNESS_PER_CONCENTRATION = 2.0
+
+def compound_absorbance(compound_count: int, peak_count: int, seed: int = 0) -> np.ndarray:
+    """ Random absorbance in [0.5, 1) for every compound, peak and channel, shaped (compound, peak, 3) in R, G, B order. """
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0.5, 1.0, size=(compound_count, peak_count, 3))
+
+def spot_radius(size: tuple[int, int], peak_count: int, lane_count: int) -> int:
+    """ Spot radius that keeps neighbouring spots and bands apart on a plate of size (width, height).
+
+    Spots also stay narrower than the calibration threshold block (a 1/11 of the height),
+    otherwise their centres fall below the local mean and split.
+    """
+    width, height = size
+    return max(14, int(min(0.3 * width / (lane_count + 1), 0.3 * height / (peak_count + 1), 0.4 * height / 11)))
+
+def calibration_plate(absorbance: np.ndarray, concentration: list[float], size: tuple[int, int] = (2400, 1500), noise: float = 2.0, seed: int = 0) -> np.ndarray:
+    """ BGR calibration plate of one compound: a band per peak, bottom band first, holding one spot per concentration lane.
+
+    absorbance is one compound's (peak, 3) slice of compound_absorbance. Every spot is a disc
+    whose peak darkness per channel is concentration * absorbance * DARKNESS_PER_CONCENTRATION.
+    """
+    return lane_plate([[lane_concentration * peak_absorbance for peak_absorbance in absorbance] for lane_concentration in concentration], size, noise, seed)
+
+def lane_plate(color: np.ndarray, size: tuple[int, int] = (2400, 1500), noise: float = 2.0, seed: int = 0) -> np.ndarray:
+    """ BGR plate of vertical lanes, left lane first, each with one spot per peak band, bottom band first.
+
+    color is the RGB darkness of every spot shaped (lane, peak, 3) and scaled by
+    DARKNESS_PER_CONCENTRATION. A calibration plate is a lane plate with one lane per
+    concentration; a multi-lane mixture plate sums concentration * absorbance over the compounds.
+    """
+    width, height = size
+    lane_count, peak_count = len(color), len(color[0])
+    radius = spot_radius(size, peak_count, lane_count)
+    darkness = np.zeros((height, width, 3), dtype=np.float32)
+    for peak_index in range(peak_count):
+        y = int(height - (peak_index + 1) * height / (peak_count + 1))
+        for lane_index in range(lane_count):
+            x = int((lane_index + 1) * width / (lane_count + 1))
+            __draw_spot(darkness, (x, y), radius, color[lane_index][peak_index])
+    return __render(darkness, noise, seed)
+
+def mixture_lane_plate(absorbance: np.ndarray, list_mixture_concentration: list[list[float]], size: tuple[int, int] = (2400, 1500), noise: float = 2.0, seed: int = 0) -> np.ndarray:
+    """ Multi-lane mixture plate with one lane per entry of list_mixture_concentration, see lane_plate. """
+    return lane_plate([np.tensordot(mixture_concentration, absorbance, axes=1) for mixture_concentration in list_mixture_concentration], size, noise, seed)
+
+def mixture_plate(absorbance: np.ndarray, mixture_concentration: list[float], size: tuple[int, int] = (1500, 300), radius: int = None, noise: float = 2.0, seed: int = 0) -> np.ndarray:
+    """ BGR single-lane mixture plate with peak 1 on the left.
+
+    Each spot darkens by the sum of concentration * absorbance over the compounds, so its
+    area is the sum of the matching calibration lines. Pass the calibration spot radius so
+    both plates share spot widths.
+    """
+    width, height = size
+    peak_count = absorbance.shape[1]
+    radius = radius or spot_radius(size, peak_count, 1)
+    darkness = np.zeros((height, width, 3), dtype=np.float32)
+    for peak_index in range(peak_count):
+        x = int((peak_index + 1) * width / (peak_count + 1))
+        color = np.tensordot(mixture_concentration, absorbance[:, peak_index], axes=1)
+        __draw_spot(darkness, (x, height // 2), radius, color)
+    return __render(darkness, noise, seed)
+
+def synthetic_dataset(compound_count: int = 2, peak_count: int = 4, concentration: list[float] = None, size: tuple[int, int] = (2400, 1500), noise: float = 2.0, seed: int = 0) -> dict:
+    """ Calibration plates for every compound plus one mixture plate, with the ground truth used to draw them.
+
+    The mixture lane is as wide as the calibration plate and one band tall. Mixture
+    concentrations are drawn from the calibration range so the answer is interpolated.
+    """
+    concentration = concentration or DEFAULT_CONCENTRATION
+    rng = np.random.default_rng(seed)
+    absorbance = compound_absorbance(compound_count, peak_count, seed)
+    mixture_concentration = rng.uniform(0.3, 0.9, size=compound_count) * max(concentration) / compound_count
+    radius = spot_radius(size, peak_count, len(concentration))
+    mixture_size = (size[0], max(6 * radius, size[1] // (peak_count + 1)))
+    return {
+        'calibration': {f'compound_{i+1}': calibration_plate(absorbance[i], concentration, size, noise, seed + i + 1) for i in range(compound_count)},
+        'mixture': mixture_plate(absorbance, mixture_concentration, mixture_size, radius, noise, seed),
+        'concentration': list(concentration),
+        'mixture_concentration': {f'compound_{i+1}': float(value) for i, value in enumerate(mixture_concentration)},
+        'absorbance': absorbance,
+    }
+
+def __draw_spot(darkness: np.ndarray, center: tuple[int, int], radius: int, color: np.ndarray):
+    """ Disc of RGB darkness color with a Gaussian centre, written into the BGR darkness image.
+
+    The centre gives each spot one sharp maximum, so quantisation noise on the flat top of
+    the column profile is not picked up as a minimum. The disc keeps half depth at the rim
+    and stops there, so the segmented area does not change with concentration.
+    """
+    x, y = center
+    offset = np.arange(-radius, radius + 1, dtype=np.float32)
+    distance = (offset[:, None] ** 2 + offset[None, :] ** 2) / radius ** 2
+    dome = np.where(distance <= 1, 0.5 + 0.5 * np.exp(-4.5 * distance), 0).astype(np.float32)
+    bgr = np.asarray(color[::-1], dtype=np.float32) * DARKNESS_PER_CONCENTRATION
+    darkness[y-radius:y+radius+1, x-radius:x+radius+1] += dome[:, :, None] * bgr
+
+def __render(darkness: np.ndarray, noise: float, seed: int) -> np.ndarray:
+    """ White plate minus darkness plus Gaussian noise, as uint8 BGR. """
+    rng = np.random.default_rng(seed)
+    image = 255 - darkness
+    if noise > 0:
+        image += rng.normal(0, noise, size=image.shape).astype(np.float32)
+    return np.clip(np.rint(image), 0, 255).astype(np.uint8)
@@ -0,0 +1,381 @@
+import argparse
+import contextlib
+import functools
+import glob
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from package.image_processing.image_processing import PreprocessingContext, read_image, preview_calibration, preview_mixture
+from package.image_processing.cache import PreprocessingCache
+from package.image_processing.instrument import StageRecorder
+from package.tlc_class.calibration import Calibration, MODEL_EXTENSION
+from package.tlc_class.fitting import FIT_METHOD, fit_calibration
+from package.tlc_class.mixture import Mixture
+from package.tlc_class.mixture_hack import MixtureHack
+from package.tlc_class.solver import CalibrationSolver
+from package.tlc_class.uncertainty import CONFIDENCE, DRAW_COUNT
+from package.tlc_class.parameter_sweep import ParameterSweep
+from package import watch
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+DEFAULT_CONCENTRATION = '5 8.33 16.67 33.33 50 66.67 83.33 100'
+
+# Worker state set once per process by the pool initializer
+_worker_list_calibration = []
+_worker_profile = False
+_worker_context = None
+_worker_solver = {}
+
+def collect_image_paths(list_pattern: list[str], extensions: tuple[str] = IMAGE_EXTENSIONS) -> list[str]:
+    """ Expand directories and glob patterns into a sorted list of image (or other extensions) paths. """
+    list_path = []
+    for pattern in list_pattern:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+        for path in candidates:
+            if os.path.isfile(path) and path.lower().endswith(extensions) and path not in list_path:
+                list_path.append(path)
+    return sorted(list_path)
+
+def image_name(path: str) -> str:
+    return os.path.basename(path)
+
+def summarize_calibration(calibration: Calibration) -> dict:
+    return {
+        'name': calibration.name,
+        'concentration': calibration.concentration,
+        'peaks': [
+            {
+                'peak': i + 1,
+                'minima': peak.minima,
+                'peak_area': peak.peak_area,
+                'best_fit_line': peak.best_fit_line,
+                'r2': peak.r2,
+            }
+            for i, peak in enumerate(calibration.peaks)
+        ],
+    }
+
+def summarize_mixture(mixture: Mixture) -> dict:
+    record = {
+        'name': mixture.name,
+        'minima': mixture.minima,
+        'peak_area': mixture.peak_area,
+    }
+    if mixture.lane_box is not None:
+        record['lane_box'] = mixture.lane_box
+    return record
+
+def open_cache(cache_directory: str) -> PreprocessingCache:
+    return PreprocessingCache(cache_directory) if cache_directory else None
+
+def build_calibration(path: str, concentration: list[float], cache_directory: str = None) -> Calibration:
+    return Calibration(image_name(path), read_image(path), concentration, cache=open_cache(cache_directory), compact=True, source_path=path, context=_worker_context)
+
+def build_mixture(path: str, cache_directory: str = None, lanes: bool = False) -> list[Mixture]:
+    """ The mixture of a single-lane plate, or one mixture per lane with lanes=True. """
+    if lanes:
+        return Mixture.from_plate(image_name(path), read_image(path), cache=open_cache(cache_directory), compact=True, source_path=path, context=_worker_context)
+    return [Mixture(image_name(path), read_image(path), cache=open_cache(cache_directory), compact=True, source_path=path, context=_worker_context)]
+
+def init_worker(profile: bool, list_calibration: list[Calibration] = None):
+    global _worker_list_calibration, _worker_profile, _worker_context, _worker_solver
+    _worker_profile = profile
+    _worker_list_calibration = list_calibration or []
+    _worker_solver = {}
+    # Each worker process handles its plates one after another, so one context serves them all
+    _worker_context = PreprocessingContext()
+
+def worker_solver(method: str, stacked: bool) -> CalibrationSolver:
+    """ Solver over the worker's calibrations, so its systems are factored once for all plates of the worker. """
+    if (method, stacked) not in _worker_solver:
+        _worker_solver[(method, stacked)] = CalibrationSolver(_worker_list_calibration, method, stacked)
+    return _worker_solver[(method, stacked)]
+
+def worker_recorder():
+    """ StageRecorder when --profile is set, otherwise a no-op context yielding None. """
+    return StageRecorder() if _worker_profile else contextlib.nullcontext()
+
+def add_stage_report(record: dict, recorder: StageRecorder):
+    if recorder is not None:
+        record['stage_report'] = recorder.report()
+        record['stage_summary'] = recorder.summary()
+
+def model_path(path: str, model_directory: str) -> str:
+    return os.path.join(model_directory, os.path.splitext(image_name(path))[0] + MODEL_EXTENSION)
+
+def run_calibration(path: str, concentration: list[float], cache_directory: str = None, model_directory: str = None, fit_method: str = 'least_squares', through_origin: bool = False) -> dict:
+    """ Worker: calibrate a single plate, optionally save its model file, and return a JSON-friendly record. """
+    with worker_recorder() as recorder:
+        try:
+            calibration = build_calibration(path, concentration, cache_directory)
+            if fit_method != 'least_squares' or through_origin:
+                calibration.fit(through_origin=through_origin, method=fit_method)
+            record = summarize_calibration(calibration)
+            if model_directory:
+                record['model'] = model_path(path, model_directory)
+                calibration.save(record['model'])
+        except Exception as error:
+            record = {'name': image_name(path), 'error': repr(error)}
+    record['path'] = path
+    add_stage_report(record, recorder)
+    return record
+
+def run_mixture(path: str, cache_directory: str = None, lanes: bool = False) -> list[dict]:
+    """ Worker: process a mixture plate and return a JSON-friendly record per lane. """
+    with worker_recorder() as recorder:
+        try:
+            list_record = [summarize_mixture(mixture) for mixture in build_mixture(path, cache_directory, lanes)]
+        except Exception as error:
+            list_record = [{'name': image_name(path), 'error': repr(error)}]
+    for record in list_record:
+        record['path'] = path
+        add_stage_report(record, recorder)
+    return list_record
+
+def run_solve(path: str, r2_threshold: float, method: str, stacked: bool, cache_directory: str = None, lanes: bool = False, draw_count: int = 0, confidence: float = CONFIDENCE) -> list[dict]:
+    """ Worker: process a mixture plate and solve every lane against the shared calibrations. """
+    with worker_recorder() as recorder:
+        try:
+            list_record = []
+            list_mixture = build_mixture(path, cache_directory, lanes)
+            for mixture, (mixture_hack, log) in zip(list_mixture, MixtureHack.solve_batch(list_mixture, worker_solver(method, stacked), r2_threshold, draw_count, confidence)):
+                record = summarize_mixture(mixture)
+                record['selected_peak_index'] = mixture_hack.dict_selected_peak_index
+                record['solution'] = mixture_hack.solution
+                record['residual'] = mixture_hack.residual
+                record['condition_number'] = mixture_hack.condition_number
+                if draw_count > 0:
+                    record['uncertainty'] = mixture_hack.uncertainty
+                    record['confidence'] = confidence
+                record['log'] = log
+                list_record.append(record)
+        except Exception as error:
+            list_record = [{'name': image_name(path), 'error': repr(error)}]
+    for record in list_record:
+        record['path'] = path
+        add_stage_report(record, recorder)
+    return list_record
+
+def run_preview(path: str, mode: str, reduce: int, max_width: int, output_directory: str = None) -> dict:
+    """ Worker: run the downscaled preview pipeline and optionally save the preview image. """
+    record = {'name': image_name(path), 'path': path}
+    try:
+        start = time.perf_counter()
+        image = read_image(path, reduce)
+        if mode == 'calibration':
+            list_cropped, image_preview, scale = preview_calibration(image, max_width, 1 / reduce)
+            record['peak_count'] = len(list_cropped)
+        else:
+            image_preview, scale = preview_mixture(image, max_width, 1 / reduce)
+        record['scale'] = scale
+        record['seconds'] = time.perf_counter() - start
+        if output_directory:
+            os.makedirs(output_directory, exist_ok=True)
+            cv2.imwrite(os.path.join(output_directory, f'preview_{os.path.splitext(image_name(path))[0]}.png'), image_preview)
+    except Exception as error:
+        record['error'] = repr(error)
+    return record
+
+def to_builtin(value):
+    """ json.dump fallback for NumPy and SymPy values. """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+def to_json(value):
+    """ value with NumPy and SymPy values converted and non-finite floats (missing R², empty means) as None, so the output is strict JSON. """
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if value is None or isinstance(value, (str, int)):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    return to_json(to_builtin(value))
+
+def write_result(result: list[dict], output: str):
+    if output == '-':
+        json.dump(to_json(result), sys.stdout, indent=2, allow_nan=False)
+        sys.stdout.write('\n')
+        return
+    with open(output, 'w') as file:
+        json.dump(to_json(result), file, indent=2, allow_nan=False)
+
+def parse_concentration(text: str) -> list[float]:
+    return [float(c) for c in text.split()]
+
+def command_calibrate(args) -> list[dict]:
+    list_path = collect_image_paths(args.input)
+    concentration = parse_concentration(args.concentration)
+    if args.save_model:
+        os.makedirs(args.save_model, exist_ok=True)
+    n = len(list_path)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.profile,)) as executor:
+        return list(executor.map(run_calibration, list_path, [concentration] * n, [args.cache] * n, [args.save_model] * n, [args.fit] * n, [args.through_origin] * n))
+
+def command_mixture(args) -> list[dict]:
+    list_path = collect_image_paths(args.input)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.profile,)) as executor:
+        n = len(list_path)
+        return [record for list_record in executor.map(run_mixture, list_path, [args.cache] * n, [args.lanes] * n) for record in list_record]
+
+def load_calibration(args) -> list[Calibration]:
+    """ Calibrations from the images and .npz models of args.calibration, refitted as args.fit asks. """
+    list_calibration_path = collect_image_paths(args.calibration)
+    list_model_path = collect_image_paths(args.calibration, (MODEL_EXTENSION,))
+    concentration = parse_concentration(args.concentration)
+    list_calibration = [Calibration.load(path) for path in list_model_path]
+    if list_calibration_path:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(False,)) as executor:
+            n = len(list_calibration_path)
+            list_calibration += list(executor.map(build_calibration, list_calibration_path, [concentration] * n, [args.cache] * n))
+    if args.fit != 'least_squares' or args.through_origin:
+        fit_calibration(list_calibration, through_origin=args.through_origin, method=args.fit)
+    return list_calibration
+
+def command_solve(args) -> list[dict]:
+    list_calibration = load_calibration(args)
+    list_mixture_path = collect_image_paths(args.input)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.profile, list_calibration)) as executor:
+        n = len(list_mixture_path)
+        list_result = executor.map(run_solve, list_mixture_path, [args.r2_threshold] * n, [args.method] * n, [args.stacked] * n, [args.cache] * n, [args.lanes] * n, [args.uncertainty] * n, [args.confidence] * n)
+        return [record for list_record in list_result for record in list_record]
+
+def command_watch(args) -> int:
+    """ Process every plate written into args.directory until interrupted, streaming the records as JSON lines. """
+    list_calibration = load_calibration(args) if args.calibration else []
+    if list_calibration:
+        process = functools.partial(run_solve, r2_threshold=args.r2_threshold, method=args.method, stacked=args.stacked, cache_directory=args.cache, lanes=args.lanes, draw_count=args.uncertainty, confidence=args.confidence)
+    else:
+        process = functools.partial(run_mixture, cache_directory=args.cache, lanes=args.lanes)
+    concurrency = args.workers or os.cpu_count() or 1
+    store = watch.JsonLinesStore(args.output, to_json)
+    settler = watch.FileSettler(args.directory, IMAGE_EXTENSIONS, args.settle, store.processed_paths())
+    try:
+        with ProcessPoolExecutor(max_workers=concurrency, initializer=init_worker, initargs=(args.profile, list_calibration)) as executor:
+            error_count = watch.run(settler, process, store, executor, concurrency, args.queue_size, args.poll, args.once)
+    finally:
+        store.close()
+    return 1 if error_count else 0
+
+def command_preview(args) -> list[dict]:
+    list_path = collect_image_paths(args.input)
+    n = len(list_path)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        return list(executor.map(run_preview, list_path, [args.mode] * n, [args.reduce] * n, [args.max_width] * n, [args.image_output] * n))
+
+def parse_grid(list_text: list[str]) -> dict[str, list]:
+    """ Parse NAME=v1,v2 options; *_SIZE values are kernel or grid sizes written 11 or 11x15. """
+    grid = {}
+    for text in list_text:
+        name, values = text.split('=', 1)
+        if name.endswith('_SIZE'):
+            grid[name] = [tuple(int(v) for v in (value.split('x') * 2)[:2]) for value in values.split(',')]
+        else:
+            grid[name] = [float(value) for value in values.split(',')]
+    return grid
+
+def command_sweep(args) -> list[dict]:
+    list_image = [read_image(path, args.reduce) for path in collect_image_paths(args.input)]
+    sweep = ParameterSweep(list_image, parse_concentration(args.concentration), parse_grid(args.grid), 1 / args.reduce)
+    result = sweep.run()
+    return sorted(result, key=lambda record: -np.nan_to_num(record['mean_r2'], nan=-np.inf))
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m package.cli', description='Headless batch processing of TLC plates.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    # Each subcommand only takes the options it uses
+    io_common = argparse.ArgumentParser(add_help=False)
+    io_common.add_argument('input', nargs='+', help='Image files, directories or glob patterns')
+    io_common.add_argument('-o', '--output', default='-', help='JSON output file (default: stdout)')
+
+    pool_common = argparse.ArgumentParser(add_help=False)
+    pool_common.add_argument('-w', '--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
+
+    worker_common = argparse.ArgumentParser(add_help=False, parents=[pool_common])
+    worker_common.add_argument('--cache', default=None, help='Preprocessing cache directory (default: no cache)')
+    worker_common.add_argument('--clear-cache', action='store_true', help='Invalidate the cache before processing')
+    worker_common.add_argument('--profile', action='store_true', help='Add per-stage timing and memory reports to every record')
+
+    common = argparse.ArgumentParser(add_help=False, parents=[io_common, worker_common])
+
+    solve_common = argparse.ArgumentParser(add_help=False)
+    solve_common.add_argument('-c', '--concentration', default=DEFAULT_CONCENTRATION, help='Space separated concentrations')
+    solve_common.add_argument('--fit', choices=FIT_METHOD, default='least_squares', help='Calibration line fit, robust to outlying spots with huber or ransac')
+    solve_common.add_argument('--through-origin', action='store_true', help='Fit calibration lines without an intercept')
+    solve_common.add_argument('--r2-threshold', type=float, default=0.9)
+    solve_common.add_argument('--method', choices=['lstsq', 'nnls'], default='lstsq', help='Least squares or non-negative least squares')
+    solve_common.add_argument('--stacked', action='store_true', help='Solve R, G and B together as one system')
+    solve_common.add_argument('--lanes', action='store_true', help='Solve every vertical lane of multi-lane mixture plates')
+    solve_common.add_argument('--uncertainty', type=int, default=0, metavar='DRAWS', help=f'Monte Carlo draws for concentration confidence intervals, e.g. {DRAW_COUNT}; 0 skips them')
+    solve_common.add_argument('--confidence', type=float, default=CONFIDENCE, help='Coverage of the confidence intervals')
+
+    parser_calibrate = subparsers.add_parser('calibrate', parents=[common], help='Calibrate reference plates')
+    parser_calibrate.add_argument('-c', '--concentration', default=DEFAULT_CONCENTRATION, help='Space separated concentrations')
+    parser_calibrate.add_argument('--save-model', default=None, help='Directory to write a .npz calibration model per plate')
+    parser_calibrate.add_argument('--fit', choices=FIT_METHOD, default='least_squares', help='Calibration line fit, robust to outlying spots with huber or ransac')
+    parser_calibrate.add_argument('--through-origin', action='store_true', help='Fit calibration lines without an intercept')
+    parser_calibrate.set_defaults(func=command_calibrate)
+
+    parser_mixture = subparsers.add_parser('mixture', parents=[common], help='Measure peak areas of mixture plates')
+    parser_mixture.add_argument('--lanes', action='store_true', help='Measure every vertical lane of multi-lane plates')
+    parser_mixture.set_defaults(func=command_mixture)
+
+    parser_solve = subparsers.add_parser('solve', parents=[common, solve_common], help='Solve mixture plates against calibration plates')
+    parser_solve.add_argument('--calibration', nargs='+', required=True, help='Calibration images or .npz model files, directories or glob patterns')
+    parser_solve.set_defaults(func=command_solve)
+
+    parser_watch = subparsers.add_parser('watch', parents=[worker_common, solve_common], help='Process mixture plates as they are written into a directory')
+    parser_watch.add_argument('directory', help='Directory the scanner writes plate images into')
+    parser_watch.add_argument('-o', '--output', default='-', help='JSON lines file the records are appended to, plates already in it are skipped (default: stdout)')
+    parser_watch.add_argument('--calibration', nargs='+', default=None, help='Calibration images or .npz model files to solve against (default: only measure the plates)')
+    parser_watch.add_argument('--queue-size', type=int, default=None, help='Settled plates waiting for a worker before polling pauses (default: --workers)')
+    parser_watch.add_argument('--poll', type=float, default=watch.POLL_SECONDS, help='Seconds between directory scans')
+    parser_watch.add_argument('--settle', type=float, default=watch.SETTLE_SECONDS, help='Seconds a file must stay unchanged before it is processed')
+    parser_watch.add_argument('--once', action='store_true', help='Exit once every plate in the directory is processed')
+    parser_watch.set_defaults(func=command_watch)
+
+    parser_preview = subparsers.add_parser('preview', parents=[io_common, pool_common], help='Fast downscaled preprocessing for parameter tuning')
+    parser_preview.add_argument('--mode', choices=['calibration', 'mixture'], default='calibration')
+    parser_preview.add_argument('--reduce', type=int, choices=[1, 2, 4, 8], default=1, help='Decode the image at 1/reduce size')
+    parser_preview.add_argument('--max-width', type=int, default=None, help='Preview width in pixels (default: parameter.PREVIEW_MAX_WIDTH)')
+    parser_preview.add_argument('--image-output', default=None, help='Directory for the annotated preview images')
+    parser_preview.set_defaults(func=command_preview)
+
+    parser_sweep = subparsers.add_parser('sweep', parents=[io_common], help='Evaluate calibration plates over a grid of preprocessing parameters')
+    parser_sweep.add_argument('-g', '--grid', action='append', default=[], help='NAME=v1,v2,... for a constant of package.image_processing.parameter, repeatable')
+    parser_sweep.add_argument('-c', '--concentration', default=DEFAULT_CONCENTRATION, help='Space separated concentrations')
+    parser_sweep.add_argument('--reduce', type=int, choices=[1, 2, 4, 8], default=1, help='Decode the images at 1/reduce size')
+    parser_sweep.set_defaults(func=command_sweep)
+    return parser
+
+def main(argv: list[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if getattr(args, 'clear_cache', False) and args.cache:
+        PreprocessingCache(args.cache).invalidate()
+    result = args.func(args)
+    # watch streams its records as it goes and returns the exit code
+    if isinstance(result, int):
+        return result
+    write_result(result, args.output)
+    return 1 if any('error' in record for record in result) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
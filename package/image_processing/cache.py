@@ -0,0 +1,108 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+import zlib
+import numpy as np
+from package.image_processing import parameter
+
+# Bump when the cached arrays or the pipeline that produces them change
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'tlc')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def parameter_snapshot() -> dict:
+    """ Current values of every constant in package.image_processing.parameter. """
+    return {name: getattr(parameter, name) for name in dir(parameter) if name.isupper()}
+
+def image_key(image: np.ndarray, stage: str) -> str:
+    """ Content address of an image for a pipeline stage under the current parameters. """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f'{CACHE_VERSION}|{stage}|{image.shape}|{image.dtype}|{sorted(parameter_snapshot().items())}'.encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+def pack_mask(mask: np.ndarray) -> np.ndarray:
+    return np.packbits(mask > 0)
+
+def unpack_mask(packed: np.ndarray, shape: tuple) -> np.ndarray:
+    size = shape[0] * shape[1]
+    return (np.unpackbits(packed, count=size).reshape(shape) * 255).astype(np.uint8)
+
+class PreprocessingCache:
+    """ Persistent content-addressed store of preprocessing results.
+
+    Each entry is a compressed .npz file named by its key. Reading an entry refreshes
+    its modification time, and the least recently used entries are deleted whenever
+    the directory grows past max_bytes.
+    """
+    def __init__(self, directory: str = DEFAULT_CACHE_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key: str) -> dict[str, np.ndarray]:
+        """ Arrays stored under key, or None on a miss; an unreadable entry is deleted and counts as a miss. """
+        path = self.__path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile, zlib.error):
+            self.invalidate(key)
+            return None
+        return arrays
+
+    def put(self, key: str, arrays: dict[str, np.ndarray]):
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                np.savez_compressed(file, **arrays)
+            os.replace(temporary_path, self.__path(key))
+        except BaseException:
+            # __evict only counts .npz entries, so a stray temporary file would never be removed
+            os.remove(temporary_path)
+            raise
+        self.__evict()
+
+    def invalidate(self, key: str = None):
+        """ Remove one entry, or every entry when key is None. """
+        list_path = [self.__path(key)] if key is not None else [path for path, _, _ in self.__entries()]
+        for path in list_path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.__entries())
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def __entries(self) -> list[tuple[str, int, float]]:
+        list_entry = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            list_entry.append((path, stat.st_size, stat.st_mtime))
+        return list_entry
+
+    def __evict(self):
+        list_entry = sorted(self.__entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in list_entry)
+        for path, size, _ in list_entry:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
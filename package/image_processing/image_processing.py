@@ -2,17 +2,104 @@ from package.image_processing.util import *
 import numpy as np
 import cv2
 from package.image_processing import parameter
+from package.image_processing.instrument import instrumented
 
-def read_image(image_path: str) -> np.ndarray:
-    image = cv2.imread(image_path)
+READ_FLAG_BY_REDUCE = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+# Rows compared at a time by the wide-block threshold, small enough for the bounds to stay in cache
+THRESHOLD_CHUNK_ROWS = 64
+
+class PreprocessingContext:
+    """ CLAHE objects, structuring elements and output buffers reused by the segmentation chain.
+
+    Pass one context to segment_mixture, segment_calibration or the preprocessing functions
+    for a run of plates of the same size: after the first plate the chain writes into the
+    same two planes, so only OpenCV's own scratch memory is allocated. A returned mask or
+    background-free image is a view of a context buffer and is overwritten by the next call,
+    so copy what must outlive it. A context is not thread-safe; use one per worker.
+    """
+    def __init__(self):
+        self.clahe = {}
+        self.kernel = {}
+        self.buffer = {}
+
+    def get_clahe(self, clip_limit: float, tile_grid_size: tuple[int, int]):
+        key = (clip_limit, tuple(tile_grid_size))
+        if key not in self.clahe:
+            self.clahe[key] = cv2.createCLAHE(clip_limit, tuple(tile_grid_size))
+        return self.clahe[key]
+
+    def get_kernel(self, kernel_size: tuple[int, int]) -> np.ndarray:
+        key = tuple(kernel_size)
+        if key not in self.kernel:
+            self.kernel[key] = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, key)
+        return self.kernel[key]
+
+    def get_buffer(self, name: str, shape: tuple, dtype=np.uint8) -> np.ndarray:
+        """ Buffer of the given shape, reallocated only when the plate size changes. """
+        buffer = self.buffer.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            buffer = self.buffer[name] = np.empty(shape, dtype=dtype)
+        return buffer
+
+@instrumented('read_image')
+def read_image(image_path: str, reduce: int = 1) -> np.ndarray:
+    """ Read a BGR image, optionally decoded directly at 1/2, 1/4 or 1/8 size.
+
+    A .npy file holding an (h, w, 3) uint8 BGR array is memory-mapped rather than read,
+    so strip-wise processing of a huge scan only pages in the rows it is working on.
+    """
+    if reduce not in READ_FLAG_BY_REDUCE:
+        raise ValueError(f"Reduce must be one of {list(READ_FLAG_BY_REDUCE)}")
+    if image_path.lower().endswith('.npy'):
+        image = np.load(image_path, mmap_mode='r')
+        return image if reduce == 1 else resize_image(image, 1 / reduce, cv2.INTER_AREA)
+    image = cv2.imread(image_path, READ_FLAG_BY_REDUCE[reduce])
     if image is None:
         raise FileNotFoundError(f"Image not found at {image_path}")
     return image
 
-def resize_image(image: np.ndarray, scale: float) -> np.ndarray:
+def resize_image(image: np.ndarray, scale: float, interpolation: int = cv2.INTER_CUBIC) -> np.ndarray:
     if scale <= 0:
         raise ValueError("Scale must be a positive number")
-    return cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    return cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=interpolation)
+
+def scale_kernel_size(kernel_size: tuple[int, int], scale: float) -> tuple[int, int]:
+    """ Kernel size for an image resized by scale, kept odd and at least 1. """
+    if scale == 1:
+        return tuple(kernel_size)
+    return tuple(max(1, int(round(k * scale)) // 2 * 2 + 1) for k in kernel_size)
+
+def preview_scale(image: np.ndarray, max_width: int = None) -> float:
+    max_width = max_width or parameter.PREVIEW_MAX_WIDTH
+    return min(1.0, max_width / image.shape[1])
+
+def preview_calibration(image: np.ndarray, max_width: int = None, source_scale: float = 1.0) -> tuple[list[np.ndarray], np.ndarray, float]:
+    """ preprocessing_calibration on a downscaled copy for fast parameter tuning.
+
+    Kernel sizes and the minimum contour area follow the scale, while the CLAHE grid is a
+    tile count and the threshold block a fraction of the height, so both already adapt.
+    source_scale is the size of image relative to the full scan, e.g. 0.25 after
+    read_image(path, reduce=4). Returns the peak crops, the annotated preview and the
+    overall scale; final numbers should still come from preprocessing_calibration.
+    """
+    resize_scale = preview_scale(image, max_width)
+    image_small = resize_image(image, resize_scale, cv2.INTER_AREA) if resize_scale < 1 else image
+    scale = resize_scale * source_scale
+    mask_morph, list_contour, list_box = segment_calibration(image_small, scale)
+    list_cropped, image_with_bounding_box = render_calibration(image_small, mask_morph, list_contour, list_box, scale)
+    return list_cropped, image_with_bounding_box, scale
+
+def preview_mixture(image: np.ndarray, max_width: int = None, source_scale: float = 1.0) -> tuple[np.ndarray, float]:
+    """ preprocessing_mixture on a downscaled copy, see preview_calibration. """
+    resize_scale = preview_scale(image, max_width)
+    image_small = resize_image(image, resize_scale, cv2.INTER_AREA) if resize_scale < 1 else image
+    scale = resize_scale * source_scale
+    return remove_background(image_small, segment_mixture(image_small, scale)), scale
 
 def select_area_from_image(image: np.ndarray) -> np.ndarray:
     x, y, width, height = cv2.selectROI(image, False)
@@ -21,86 +108,343 @@ def select_area_from_image(image: np.ndarray) -> np.ndarray:
     cv2.destroyAllWindows()
     return new_image
 
-def preprocessing_mixture(image: np.ndarray) -> np.ndarray:
-    image_original = image.copy()
+def preprocessing_mixture(image: np.ndarray, lanes: bool = False, context: PreprocessingContext = None) -> np.ndarray | list[np.ndarray]:
+    """ Background-free mixture plate, or with lanes=True one background-free image per vertical lane.
+
+    Lanes come from a single segmentation of the whole plate (see segment_lanes) and are
+    turned like crop_lane, so each one has the single-lane layout with peak 1 on the left.
+    With a context the background-free plate is a context buffer, see PreprocessingContext.
+    """
+    if lanes:
+        mask, _, list_lane_box = segment_lanes(image, context=context)
+        image_remove_background = remove_background(image, mask, dst=__context_buffer(context, 'background', image.shape))
+        return [crop_lane(image_remove_background, box) for box in list_lane_box]
+    threshold_mask = segment_mixture(image, context=context)
+    image_remove_background = remove_background(image, threshold_mask, dst=__context_buffer(context, 'background', image.shape))
+    return image_remove_background
+
+@instrumented('segment_mixture')
+def segment_mixture(image: np.ndarray, scale: float = 1.0, streamed: bool = False, context: PreprocessingContext = None) -> np.ndarray:
+    """ Foreground mask of a mixture plate; scale < 1 for an image downscaled from full resolution.
+
+    With a context the mask is a context buffer; plates small enough to be streamed in one
+    strip are then segmented in the context instead, which gives the same mask.
+    """
+    if __use_context(image, streamed, context):
+        return __segment_in_context(image, 'Mixture', scale, context)
+    if streamed:
+        return segment_mask_streamed(image, 'Mixture', scale)
     image = __to_grayscale(image)
-    image = __apply_gaussian_blur(image)
+    image = __apply_gaussian_blur(image, scale)
     image = __apply_clahe(image)
     image = __apply_adaptive_thresholding(image, mode='Mixture')
-    threshold_mask = __apply_morph(image)
-    image_remove_background = __apply_mask(image_original, threshold_mask, 'and')
-    return image_remove_background
+    return __apply_morph(image, scale)
+
+def preprocessing_calibration(image: np.ndarray, lanes: bool = False, context: PreprocessingContext = None) -> tuple[list, np.ndarray]:
+    """ Peak crops and the annotated plate; with lanes=True the crops are split per vertical lane.
+
+    Lanes share the one segmentation and the full-width peak boxes of the plate, so
+    list_cropped[lane][peak] is the spot of a peak band within a lane, bottom peak first.
+    With a context the crops are views of a context buffer, see PreprocessingContext.
+    """
+    mask_morph, list_contour, list_box_horizontal = segment_calibration(image, context=context)
+    if not lanes:
+        return render_calibration(image, mask_morph, list_contour, list_box_horizontal, context=context)
+    list_lane_box = find_lane_box(mask_morph, list_contour)
+    image_remove_background = remove_background(image, mask_morph, dst=__context_buffer(context, 'background', image.shape))
+    list_cropped = [__crop_by_bounding_box(image_remove_background, [intersection(lane_box, box) for box in list_box_horizontal]) for lane_box in list_lane_box]
+    image_with_bounding_box = draw_bounding_box(draw_contour(image, list_contour), list_box_horizontal)
+    return list_cropped, draw_lane_box(image_with_bounding_box, list_lane_box)
+
+@instrumented('segment_calibration')
+def segment_calibration(image: np.ndarray, scale: float = 1.0, streamed: bool = False, context: PreprocessingContext = None) -> tuple[np.ndarray, list, list]:
+    """ Foreground mask, peak contours and full-width peak bounding boxes of a calibration plate.
+
+    streamed=True builds the same mask strip by strip, see segment_mask_streamed. With a
+    context the mask is a context buffer, as in segment_mixture.
+    """
+    if __use_context(image, streamed, context):
+        mask_morph = __segment_in_context(image, 'Calibration', scale, context)
+    elif streamed:
+        mask_morph = segment_mask_streamed(image, 'Calibration', scale)
+    else:
+        image_gray = __to_grayscale(image)
+        image_blur = __apply_gaussian_blur(image_gray, scale)
+        image_clahe = __apply_clahe(image_blur)
+        mask = __apply_adaptive_thresholding(image_clahe)
+        mask_morph = __apply_morph(mask, scale)
+    list_contour, list_box_horizontal = find_peak_box(mask_morph, scale)
+    return mask_morph, list_contour, list_box_horizontal
 
-def preprocessing_calibration(image: np.ndarray) -> list[np.ndarray]:
-    image_original = image.copy()
-    image_gray = __to_grayscale(image_original)
-    image_blur = __apply_gaussian_blur(image_gray)
-    image_clahe = __apply_clahe(image_blur)
-    mask = __apply_adaptive_thresholding(image_clahe)
-    mask_morph = __apply_morph(mask)
-    image_remove_background = __apply_mask(image_original, mask_morph, operator='and')
-    list_contour = __get_contour(mask_morph, min_area=500)
-    list_box_horizontal = __get_bounding_box_horizontal(list_contour, image_original.shape[1])
-    list_cropped_by_box_horizontal = __crop_by_bounding_box(image_remove_background, list_box_horizontal)
-    image_with_contour = draw_contour(image_original, list_contour)
-    image_with_bounding_box = draw_bounding_box(image_with_contour, list_box_horizontal)
+@instrumented('segment_lanes')
+def segment_lanes(image: np.ndarray, scale: float = 1.0, streamed: bool = False, context: PreprocessingContext = None) -> tuple[np.ndarray, list, list]:
+    """ Foreground mask, spot contours and full-height lane bounding boxes (left lane first) of a multi-lane plate.
+
+    The plate is thresholded like a calibration plate, whose block is a fraction of the
+    height, since each lane holds several separate spots rather than one long lane.
+    """
+    mask_morph, list_contour, _ = segment_calibration(image, scale, streamed, context)
+    return mask_morph, list_contour, find_lane_box(mask_morph, list_contour)
+
+@instrumented('render_calibration')
+def render_calibration(image: np.ndarray, mask: np.ndarray, list_contour: list, list_box: list, scale: float = 1.0, context: PreprocessingContext = None) -> tuple[list[np.ndarray], np.ndarray]:
+    """ Background-free crop of every peak and the annotated overview image; with a context the crops are views of a context buffer. """
+    list_cropped_by_box_horizontal = __crop_by_bounding_box(remove_background(image, mask, dst=__context_buffer(context, 'background', image.shape)), list_box)
+    image_with_contour = draw_contour(image, list_contour, scale)
+    image_with_bounding_box = draw_bounding_box(image_with_contour, list_box, scale)
     return list_cropped_by_box_horizontal, image_with_bounding_box
 
-def draw_contour(image: np.ndarray, list_contour: list) -> np.ndarray:
+@instrumented('segment_streamed')
+def segment_mask_streamed(image: np.ndarray, mode: str = 'Calibration', scale: float = 1.0, strip_tile_rows: int = None) -> np.ndarray:
+    """ The grayscale -> blur -> clahe -> threshold -> morph mask, computed in horizontal strips.
+
+    Only the output mask is full size; every intermediate covers one strip. Each strip
+    finishes strip_tile_rows CLAHE tile rows and carries enough whole tiles above and
+    below for the threshold block and morph kernel, padded exactly as OpenCV pads the
+    full image, so the mask is identical to the one-shot pipeline. The CLAHE grid and
+    threshold block are fractions of the plate height, so a strip is a fixed fraction
+    of the plate too; a mixture threshold block spans the whole height, which makes it
+    a single strip. Strips trade memory for time, since the context rows are segmented
+    twice, so plates under STREAM_MIN_PIXELS are done in one strip by default.
+    """
+    height, width = image.shape[:2]
+    tile_x, tile_y = parameter.CLAHE_GRID_SIZE
+    if width % tile_x == 0 and height % tile_y == 0:
+        width_padded, height_padded = width, height
+    else:
+        width_padded, height_padded = width + tile_x - width % tile_x, height + tile_y - height % tile_y
+    tile_height = height_padded // tile_y
+    block_size = threshold_block_size(height, mode)
+    blur_radius = scale_kernel_size(parameter.GAUSSIAN_BLUR_KERNEL_SIZE, scale)[1] // 2
+    morph_radius = scale_kernel_size(parameter.MORPH_KERNEL_SIZE, scale)[1] // 2
+    # Rows of CLAHE output the threshold and the open (erode then dilate) read past a strip, plus
+    # the half tile CLAHE interpolates over
+    context_row = block_size // 2 + 2 * morph_radius + 1
+    context_tile = -(-(context_row + tile_height // 2) // tile_height)
+    if strip_tile_rows is None:
+        strip_tile_rows = parameter.STREAM_STRIP_TILE_ROWS if height * width >= parameter.STREAM_MIN_PIXELS else tile_y
+
+    mask = np.empty((height, width), dtype=np.uint8)
+    for tile_start in range(0, tile_y, strip_tile_rows):
+        tile_end = min(tile_y, tile_start + strip_tile_rows)
+        slab_start = max(0, tile_start - context_tile) * tile_height
+        slab_end = min(tile_y, tile_end + context_tile) * tile_height
+        read_start, read_end = max(0, slab_start - blur_radius), min(height, slab_end + blur_radius)
+        image_blur = __apply_gaussian_blur(__to_grayscale(np.ascontiguousarray(image[read_start:read_end])), scale)
+        image_blur = image_blur[slab_start - read_start:min(slab_end, height) - read_start]
+        image_blur = cv2.copyMakeBorder(image_blur, 0, slab_end - min(slab_end, height), 0, width_padded - width, cv2.BORDER_REFLECT_101)
+        image_clahe = __apply_clahe(image_blur, tile_grid_size=(tile_x, (slab_end - slab_start) // tile_height))
+        image_clahe = image_clahe[:min(slab_end, height) - slab_start, :width]
+        mask_strip = __apply_morph(__apply_adaptive_thresholding(image_clahe, mode, block_size=block_size), scale)
+        core_start, core_end = tile_start * tile_height, min(tile_end * tile_height, height)
+        mask[core_start:core_end] = mask_strip[core_start - slab_start:core_end - slab_start]
+    return mask
+
+def threshold_block_size(height: int, mode: str = 'Calibration') -> int:
+    """ Odd adaptive threshold block: a 1/11 of the height for calibrations, the whole height for mixtures. """
+    block_cnt = 11 if mode == 'Calibration' else 1
+    return height // block_cnt if (height // block_cnt) % 2 == 1 else height // block_cnt + 1
+
+def find_lane_box(mask: np.ndarray, list_contour: list) -> list:
+    """ Full-height bounding boxes of the vertical lanes holding list_contour, left lane first. """
+    if len(list_contour) == 0:
+        return []
+    return sorted(__get_bounding_box_vertical(list_contour, mask.shape[0]), key=lambda x: x[0])
+
+def crop_lane(image: np.ndarray, box: tuple) -> np.ndarray:
+    """ Lane crop turned clockwise, so the bottom of the plate is on the left like a single-lane mixture. """
+    x, y, w, h = box
+    return cv2.rotate(image[y:y+h, x:x+w], cv2.ROTATE_90_CLOCKWISE)
+
+def crop_peak(image: np.ndarray, mask: np.ndarray, list_box: list) -> list[np.ndarray]:
+    """ Background-free crop of every peak box. """
+    return __crop_by_bounding_box(remove_background(image, mask), list_box)
+
+def calibration_contour(mask: np.ndarray, scale: float = 1.0) -> list:
+    return __get_contour(mask, min_area=500 * scale * scale)
+
+def remove_background(image: np.ndarray, mask: np.ndarray, dst: np.ndarray = None) -> np.ndarray:
+    return __apply_mask(image, mask, operator='and', dst=dst)
+
+# Named preprocessing stages in pipeline order, with the parameter overrides each accepts
+PIPELINE_STAGE = {
+    'grayscale': (),
+    'blur': ('kernel_size', 'scale'),
+    'clahe': ('clip_limit', 'tile_grid_size'),
+    'threshold': ('mode', 'constant', 'block_size'),
+    'morph': ('kernel_size', 'scale'),
+}
+
+def run_stage(stage: str, image: np.ndarray, **kwargs) -> np.ndarray:
+    """ Run one named preprocessing stage; parameters left out come from the parameter module. """
+    if stage == 'grayscale':
+        return __to_grayscale(image)
+    elif stage == 'blur':
+        return __apply_gaussian_blur(image, **kwargs)
+    elif stage == 'clahe':
+        return __apply_clahe(image, **kwargs)
+    elif stage == 'threshold':
+        return __apply_adaptive_thresholding(image, **kwargs)
+    elif stage == 'morph':
+        return __apply_morph(image, **kwargs)
+    raise KeyError(f"Unknown stage '{stage}', expected one of {list(PIPELINE_STAGE)}")
+
+def find_peak_box(mask: np.ndarray, scale: float = 1.0) -> tuple[list, list]:
+    """ Peak contours and full-width bounding boxes (bottom peak first) of a calibration mask. """
+    list_contour = calibration_contour(mask, scale)
+    return list_contour, __get_bounding_box_horizontal(list_contour, mask.shape[1])
+
+@instrumented('draw_contour')
+def draw_contour(image: np.ndarray, list_contour: list, scale: float = 1.0) -> np.ndarray:
     index = -1
     color = (0, 255, 255)
-    thickness = 4
+    thickness = max(1, round(4 * scale))
     line_type = cv2.LINE_AA
     new_image = image.copy()
     cv2.drawContours(new_image, list_contour, index, color, thickness, line_type)
     return new_image
 
-def draw_bounding_box(image: np.ndarray, list_box: list) -> np.ndarray:
+@instrumented('draw_bounding_box')
+def draw_bounding_box(image: np.ndarray, list_box: list, scale: float = 1.0) -> np.ndarray:
     new_image = image.copy()
     for i, box in enumerate(list_box):
         x, y, w, h = box
         top_left_point = (x, y)
         bottom_right_point = (x+w, y+h)
         color = (255, 0, 255)
-        thickness = 4
+        thickness = max(1, round(4 * scale))
         new_image = cv2.rectangle(new_image, top_left_point, bottom_right_point, color, thickness)
         
-        new_image = cv2.putText(new_image, f"Peak {i+1}", (10, y+h-10), cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 6)
+        new_image = cv2.putText(new_image, f"Peak {i+1}", (max(1, round(10 * scale)), y+h-max(1, round(10 * scale))), cv2.FONT_HERSHEY_SIMPLEX, 3 * scale, (0, 0, 0), max(1, round(6 * scale)))
+    return new_image
+
+@instrumented('draw_bounding_box')
+def draw_lane_box(image: np.ndarray, list_box: list, scale: float = 1.0) -> np.ndarray:
+    new_image = image.copy()
+    for i, box in enumerate(list_box):
+        x, y, w, h = box
+        color = (255, 255, 0)
+        thickness = max(1, round(4 * scale))
+        new_image = cv2.rectangle(new_image, (x, y), (x+w, y+h), color, thickness)
+        new_image = cv2.putText(new_image, f"Lane {i+1}", (x+max(1, round(10 * scale)), y+max(1, round(100 * scale))), cv2.FONT_HERSHEY_SIMPLEX, 3 * scale, (0, 0, 0), max(1, round(6 * scale)))
     return new_image
 
-def __to_grayscale(image_rgb: np.ndarray) -> np.ndarray:
-    return cv2.cvtColor(image_rgb, cv2.COLOR_BGR2GRAY)
+def __use_context(image: np.ndarray, streamed: bool, context: PreprocessingContext) -> bool:
+    """ Segment in the context unless the plate is big enough to be streamed in several strips. """
+    return context is not None and not (streamed and image.shape[0] * image.shape[1] >= parameter.STREAM_MIN_PIXELS)
 
-def __apply_gaussian_blur(image: np.ndarray) -> np.ndarray:
-    kernel_size = parameter.GAUSSIAN_BLUR_KERNEL_SIZE
-    return cv2.GaussianBlur(image, kernel_size, 3)
+def __context_buffer(context: PreprocessingContext, name: str, shape: tuple) -> np.ndarray:
+    return None if context is None else context.get_buffer(name, shape)
 
-def __apply_clahe(image: np.ndarray) -> np.ndarray:
-    clip_limit = parameter.CLAHE_CLIP_LIMIT
-    tile_grid_size = parameter.CLAHE_GRID_SIZE
-    clahe_object = cv2.createCLAHE(clip_limit, tile_grid_size)
-    return clahe_object.apply(image)
+def __segment_in_context(image: np.ndarray, mode: str, scale: float, context: PreprocessingContext) -> np.ndarray:
+    """ The grayscale -> blur -> clahe -> threshold -> morph chain, alternating between two context planes. """
+    plane = context.get_buffer('segment', image.shape[:2])
+    plane_other = context.get_buffer('segment_other', image.shape[:2])
+    __to_grayscale(image, dst=plane)
+    __apply_gaussian_blur(plane, scale, dst=plane_other)
+    __apply_clahe(plane_other, context=context, dst=plane)
+    __apply_adaptive_thresholding(plane, mode, dst=plane_other)
+    return __apply_morph(plane_other, scale, context=context, dst=plane)
 
-def __apply_adaptive_thresholding(image: np.ndarray, mode='Calibration') -> np.ndarray:
+@instrumented('grayscale')
+def __to_grayscale(image_rgb: np.ndarray, dst: np.ndarray = None) -> np.ndarray:
+    return cv2.cvtColor(image_rgb, cv2.COLOR_BGR2GRAY, dst=dst)
+
+@instrumented('blur')
+def __apply_gaussian_blur(image: np.ndarray, scale: float = 1.0, kernel_size: tuple[int, int] = None, dst: np.ndarray = None) -> np.ndarray:
+    kernel_size = scale_kernel_size(kernel_size or parameter.GAUSSIAN_BLUR_KERNEL_SIZE, scale)
+    return cv2.GaussianBlur(image, kernel_size, 3 * scale, dst=dst)
+
+@instrumented('clahe')
+def __apply_clahe(image: np.ndarray, clip_limit: float = None, tile_grid_size: tuple[int, int] = None, context: PreprocessingContext = None, dst: np.ndarray = None) -> np.ndarray:
+    clip_limit = parameter.CLAHE_CLIP_LIMIT if clip_limit is None else clip_limit
+    tile_grid_size = tile_grid_size or parameter.CLAHE_GRID_SIZE
+    clahe_object = cv2.createCLAHE(clip_limit, tile_grid_size) if context is None else context.get_clahe(clip_limit, tile_grid_size)
+    return clahe_object.apply(image, dst)
+
+@instrumented('threshold')
+def __apply_adaptive_thresholding(image: np.ndarray, mode='Calibration', constant: float = None, block_size: int = None, dst: np.ndarray = None) -> np.ndarray:
     max_value = 255
     adaptive_method = cv2.ADAPTIVE_THRESH_MEAN_C
     threshold_type = cv2.THRESH_BINARY_INV
-    block_cnt = 11 if mode == 'Calibration' else 1
-    block_size = image.shape[0] // block_cnt  if (image.shape[0] // block_cnt) % 2 == 1 else image.shape[0] // block_cnt + 1
-    constant = parameter.ADAPTIVE_THRESHOLDING_CONSTANT
-    return cv2.adaptiveThreshold(image, max_value, adaptive_method, threshold_type, block_size, constant)
+    block_size = threshold_block_size(image.shape[0], mode) if block_size is None else block_size
+    constant = parameter.ADAPTIVE_THRESHOLDING_CONSTANT if constant is None else constant
+    if block_size // 2 >= image.shape[1] - 1:
+        return __threshold_wide_block(image, block_size, constant, dst)
+    if block_size // 2 >= image.shape[0] - 1:
+        mask = cv2.transpose(__threshold_wide_block(cv2.transpose(image), block_size, constant))
+        if dst is None:
+            return mask
+        dst[...] = mask
+        return dst
+    return cv2.adaptiveThreshold(image, max_value, adaptive_method, threshold_type, block_size, constant, dst=dst)
 
-def __apply_morph(image: np.ndarray) -> np.ndarray:
-    return cv2.morphologyEx(image, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, parameter.MORPH_KERNEL_SIZE))
+def __threshold_wide_block(image: np.ndarray, block_size: int, constant: float, dst: np.ndarray = None) -> np.ndarray:
+    """ The mean adaptive THRESH_BINARY_INV mask of cv2.adaptiveThreshold, for a block at least twice as wide as the image.
 
-def __apply_mask(image: np.ndarray, mask: np.ndarray, operator: str) -> np.ndarray:
-    mask_rgb = cv2.merge([mask, mask, mask])
+    OpenCV pads every row by half the block for its running sums, so its time grows with the
+    block. Once a window spans the whole row, its replicated-border sum is the column window
+    sum of the row total plus (radius - x) copies of the first column and (x + radius - w + 1)
+    of the last, i.e. linear in x, so only three columns need window sums. OpenCV keeps
+    src - round(sum / area) <= -floor(constant); the area of an odd block is odd, so the mean
+    is never half-way and the test is src < sum / area - floor(constant) + 0.5.
+
+    The mean here is rounded exactly, while OpenCV scales some block sizes in float32, so
+    the masks can differ where the true mean is within about 1e-5 of a half gray level:
+    a few pixels per million, none at the default constant on the synthetic plates tried.
+    """
+    height, width = image.shape
+    radius = block_size // 2
+    area = block_size * block_size
+    row_sum = cv2.reduce(image, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+    window_total = __window_sum_replicate(row_sum, radius)
+    window_first, window_last = __window_sum_replicate(image[:, 0], radius), __window_sum_replicate(image[:, -1], radius)
+    offset = (window_total + radius * window_first + (radius - (width - 1)) * window_last) / area - np.floor(constant) + 0.5
+    slope = (window_last - window_first) / area
+    x = np.arange(width, dtype=np.float64)
+    dst = np.empty((height, width), dtype=np.uint8) if dst is None else dst
+    bound = np.empty((THRESHOLD_CHUNK_ROWS, width), dtype=np.float64)
+    for start in range(0, height, THRESHOLD_CHUNK_ROWS):
+        end = min(height, start + THRESHOLD_CHUNK_ROWS)
+        bound_chunk = bound[:end - start]
+        np.multiply(slope[start:end, None], x, out=bound_chunk)
+        bound_chunk += offset[start:end, None]
+        np.less(image[start:end], bound_chunk, out=dst[start:end].view(bool))
+    dst *= 255
+    return dst
+
+def __window_sum_replicate(value: np.ndarray, radius: int) -> np.ndarray:
+    """ Sum of value[i - radius : i + radius + 1] for every i, with the ends repeated past the border. """
+    n = len(value)
+    cumulative = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(value, dtype=np.int64, out=cumulative[1:])
+    index = np.arange(n)
+    start, end = index - radius, index + radius
+    window = cumulative[np.minimum(end, n - 1) + 1] - cumulative[np.maximum(start, 0)]
+    return window + np.maximum(-start, 0) * np.int64(value[0]) + np.maximum(end - (n - 1), 0) * np.int64(value[-1])
+
+@instrumented('morph')
+def __apply_morph(image: np.ndarray, scale: float = 1.0, kernel_size: tuple[int, int] = None, context: PreprocessingContext = None, dst: np.ndarray = None) -> np.ndarray:
+    kernel_size = scale_kernel_size(kernel_size or parameter.MORPH_KERNEL_SIZE, scale)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, kernel_size) if context is None else context.get_kernel(kernel_size)
+    return cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel, dst=dst)
+
+@instrumented('mask')
+def __apply_mask(image: np.ndarray, mask: np.ndarray, operator: str, dst: np.ndarray = None) -> np.ndarray:
     if operator == 'and':
-        return cv2.bitwise_and(image, mask_rgb)
-    elif operator == 'or':
+        # A masked copy over zeros equals AND with the 0/255 mask, without a 3-channel copy of it
+        if dst is None:
+            dst = np.zeros_like(image)
+        else:
+            dst.fill(0)
+        cv2.copyTo(image, mask, dst)
+        return dst
+    mask_rgb = cv2.merge([mask, mask, mask])
+    if operator == 'or':
         return cv2.bitwise_or(image, mask_rgb)
     return KeyError
 
+@instrumented('contour')
 def __get_contour(image: np.ndarray, min_area: int) -> list:
     mode = cv2.RETR_EXTERNAL
     method = cv2.CHAIN_APPROX_NONE
@@ -116,21 +460,23 @@ def __remove_contour(list_contour: list, min_area: int) -> list:
             new_list_contour.append(contour)
     return new_list_contour
 
+@instrumented('bounding_box')
 def __get_bounding_box_vertical(list_contour: list, h_max: int) -> list:
-    list_box = []
-    for contour in list_contour:
-        x, y, w ,h = cv2.boundingRect(contour)
-        list_box.append((x, 0, w, h_max))
-    return groupBoundingBox(list_box)
+    box = __bounding_rect_array(list_contour)
+    box[:, 1], box[:, 3] = 0, h_max
+    return groupBoundingBox(box)
 
+@instrumented('bounding_box')
 def __get_bounding_box_horizontal(list_contour: list, w_max: int) -> list:
-    list_box = []
-    for contour in list_contour:
-        x, y, w ,h = cv2.boundingRect(contour)
-        list_box.append((0, y, w_max, h))
-    grouped_list_box = sorted(groupBoundingBox(list_box), key=lambda x: x[1], reverse=True)
+    box = __bounding_rect_array(list_contour)
+    box[:, 0], box[:, 2] = 0, w_max
+    grouped_list_box = sorted(groupBoundingBox(box), key=lambda x: x[1], reverse=True)
     return grouped_list_box
 
+def __bounding_rect_array(list_contour: list) -> np.ndarray:
+    return np.array([cv2.boundingRect(contour) for contour in list_contour], dtype=np.int64).reshape(-1, 4)
+
+@instrumented('crop')
 def __crop_by_bounding_box(image: np.ndarray, list_bounding_box: list) -> list:
     list_cropped_by_bounding_box = []
     for box in list_bounding_box:
@@ -0,0 +1,164 @@
+import contextvars
+import functools
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+_active_recorder = contextvars.ContextVar('active_stage_recorder', default=None)
+
+# tracemalloc is process-wide: the first recorder tracing memory starts it and the last one
+# stops it. Memory is only measured while a single recorder is active, since reset_peak()
+# would clobber the peaks other threads measure; the generation changes whenever another
+# recorder enters, invalidating the stages it overlaps.
+_memory_lock = threading.Lock()
+_memory_recorder_count = 0
+_memory_generation = 0
+_memory_started_tracing = False
+
+class StageRecorder:
+    """ Collect wall time, peak allocated bytes and output shape of every named stage.
+
+    Stages only report while a recorder is active in the current thread or task:
+
+        with StageRecorder() as recorder:
+            Calibration(name, image, concentration)
+        recorder.report()
+
+    Each record is passed to the optional hooks as it is made. With no active
+    recorder a stage costs one context variable lookup. peak_bytes is None for stages that
+    ran while another recorder was active, e.g. in another thread.
+    """
+    def __init__(self, trace_memory: bool = True, hooks: list = None):
+        self.trace_memory = trace_memory
+        self.hooks = hooks or []
+        self.list_record = []
+        self.stack = []
+        self.token = None
+
+    def __enter__(self):
+        global _memory_recorder_count, _memory_generation, _memory_started_tracing
+        if self.trace_memory:
+            with _memory_lock:
+                _memory_recorder_count += 1
+                _memory_generation += 1
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _memory_started_tracing = True
+        self.token = _active_recorder.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        global _memory_recorder_count, _memory_started_tracing
+        _active_recorder.reset(self.token)
+        if self.trace_memory:
+            with _memory_lock:
+                _memory_recorder_count -= 1
+                if _memory_recorder_count == 0 and _memory_started_tracing:
+                    tracemalloc.stop()
+                    _memory_started_tracing = False
+
+    def report(self) -> list[dict]:
+        """ Every stage run in order, nested stages before the stage containing them. """
+        return list(self.list_record)
+
+    def summary(self) -> dict[str, dict]:
+        """ Call count, total seconds and largest peak allocation per stage name (None if never measured). """
+        summary = {}
+        for record in self.list_record:
+            entry = summary.setdefault(record['stage'], {'count': 0, 'seconds': 0.0, 'peak_bytes': None})
+            entry['count'] += 1
+            entry['seconds'] += record['seconds']
+            if record['peak_bytes'] is not None:
+                entry['peak_bytes'] = max(entry['peak_bytes'] or 0, record['peak_bytes'])
+        return summary
+
+    def begin(self, name: str):
+        memory, generation = 0, None
+        if self.trace_memory:
+            with _memory_lock:
+                if _memory_recorder_count == 1 and tracemalloc.is_tracing():
+                    memory, generation = tracemalloc.get_traced_memory()[0], _memory_generation
+                    tracemalloc.reset_peak()
+        self.stack.append({'stage': name, 'memory': memory, 'generation': generation, 'child_peak': 0, 'start': time.perf_counter()})
+
+    def end(self, output=None):
+        seconds = time.perf_counter() - self.stack[-1]['start']
+        frame = self.stack.pop()
+        peak_bytes = None
+        if frame['generation'] is not None:
+            with _memory_lock:
+                if frame['generation'] == _memory_generation and tracemalloc.is_tracing():
+                    absolute_peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+                    peak_bytes = absolute_peak - frame['memory']
+                    if self.stack:
+                        self.stack[-1]['child_peak'] = max(self.stack[-1]['child_peak'], absolute_peak)
+        record = {
+            'stage': frame['stage'],
+            'depth': len(self.stack),
+            'seconds': seconds,
+            'peak_bytes': peak_bytes,
+            'shape': output_shape(output),
+        }
+        self.list_record.append(record)
+        for hook in self.hooks:
+            hook(record)
+
+def output_shape(output):
+    if isinstance(output, np.ndarray):
+        return list(output.shape)
+    if isinstance(output, (list, tuple)):
+        return [output_shape(item) for item in output] if len(output) <= 4 else [len(output)]
+    return None
+
+class Stage:
+    """ Context manager timing a block as one named stage of the active recorder. """
+    def __init__(self, name: str):
+        self.name = name
+        self.recorder = None
+        self.output = None
+
+    def __enter__(self):
+        self.recorder = _active_recorder.get()
+        if self.recorder is not None:
+            self.recorder.begin(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.recorder is not None:
+            self.recorder.end(self.output)
+
+def instrumented(name: str):
+    """ Decorator recording every call of a function as the stage name, with its return value's shape. """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = _active_recorder.get()
+            if recorder is None:
+                return function(*args, **kwargs)
+            recorder.begin(name)
+            output = None
+            try:
+                output = function(*args, **kwargs)
+                return output
+            finally:
+                recorder.end(output)
+        return wrapper
+    return decorator
+
+def format_report(report: list[dict]) -> str:
+    """ Indented text table of a report, for logs and the GUI. """
+    lines = [f"{'Stage':<28}{'ms':>10}{'peak MB':>10}  shape"]
+    for record in report:
+        name = '  ' * record['depth'] + record['stage']
+        peak = '-' if record['peak_bytes'] is None else f"{record['peak_bytes'] / 1e6:.1f}"
+        lines.append(f"{name:<28}{record['seconds'] * 1000:>10.1f}{peak:>10}  {record['shape']}")
+    return '\n'.join(lines)
+
+def format_summary(summary: dict[str, dict]) -> str:
+    """ Text table of StageRecorder.summary(), slowest stage first. """
+    lines = [f"{'Stage':<24}{'calls':>6}{'ms':>10}{'peak MB':>10}"]
+    for name, entry in sorted(summary.items(), key=lambda item: -item[1]['seconds']):
+        peak = '-' if entry['peak_bytes'] is None else f"{entry['peak_bytes'] / 1e6:.1f}"
+        lines.append(f"{name:<24}{entry['count']:>6}{entry['seconds'] * 1000:>10.1f}{peak:>10}")
+    return '\n'.join(lines)
@@ -6,4 +6,14 @@ CLAHE_GRID_SIZE = (11, 11)
 ADAPTIVE_THRESHOLDING_BLOCK_SIZE = 151
 ADAPTIVE_THRESHOLDING_CONSTANT = 10
 
-MORPH_KERNEL_SIZE = (25, 25)
\ No newline at end of file
+MORPH_KERNEL_SIZE = (25, 25)
+
+PREVIEW_MAX_WIDTH = 800
+
+# Smallest prominence of a minimum in a mixture profile that separates two peaks
+MINIMA_PROMINENCE = 2
+
+# CLAHE tile rows finished per strip when segmenting in strips, for plates of at least
+# STREAM_MIN_PIXELS; smaller plates are segmented in one strip
+STREAM_STRIP_TILE_ROWS = 3
+STREAM_MIN_PIXELS = 20_000_000
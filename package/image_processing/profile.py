@@ -0,0 +1,161 @@
+import numpy as np
+from scipy.signal import find_peaks, peak_prominences, peak_widths
+
+CHUNK_ROWS = 256
+
+def channel_sum_count(image: np.ndarray, orientation: str = 'column', mask: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    """ Sum and count of non-zero pixels per column (or row) for every channel of a BGR image.
+
+    The image is read once in blocks of CHUNK_ROWS rows, accumulating into uint32 arrays
+    shaped (n, 3), so no RGB conversion, channel split or full-size int64 temporaries are made.
+    With a mask, pixels where it is zero are skipped block by block, giving the same result
+    as remove_background(image, mask) without the full-size masked copy.
+    """
+    if orientation not in ('column', 'row'):
+        raise ValueError(f"Unknown orientation '{orientation}', expected 'column' or 'row'")
+    height = image.shape[0]
+    if orientation == 'column':
+        total = np.zeros((image.shape[1], image.shape[2]), dtype=np.uint32)
+        count = np.zeros((image.shape[1], image.shape[2]), dtype=np.uint32)
+        for start in range(0, height, CHUNK_ROWS):
+            block = __masked_block(image, mask, start)
+            total += np.sum(block, axis=0, dtype=np.uint32)
+            count += np.count_nonzero(block, axis=0).astype(np.uint32)
+        return total, count
+    total = np.empty((height, image.shape[2]), dtype=np.uint32)
+    count = np.empty((height, image.shape[2]), dtype=np.uint32)
+    for start in range(0, height, CHUNK_ROWS):
+        block = __masked_block(image, mask, start)
+        np.sum(block, axis=1, dtype=np.uint32, out=total[start:start+CHUNK_ROWS])
+        count[start:start+CHUNK_ROWS] = np.count_nonzero(block, axis=1)
+    return total, count
+
+def lane_sum_count(image: np.ndarray, list_box: list, mask: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    """ Per-row sum and count of non-zero pixels inside every lane box, shaped (row, lane, 3).
+
+    All lanes are summed in the same block-wise pass over the plate as channel_sum_count,
+    with one np.add.reduceat over the lane edges per block. The boxes must be full-height,
+    sorted left to right and apart, as find_lane_box returns them.
+    """
+    edge = np.array([[x, x + w] for x, _, w, _ in list_box], dtype=np.intp).reshape(-1)
+    height = image.shape[0]
+    total = np.empty((height, len(list_box), image.shape[2]), dtype=np.uint32)
+    count = np.empty((height, len(list_box), image.shape[2]), dtype=np.uint32)
+    if len(list_box) == 0:
+        return total, count
+    for start in range(0, height, CHUNK_ROWS):
+        # Segments alternate lane, gap, lane, ...; cutting at the last lane end drops the trailing gap
+        block = __masked_block(image, mask, start)[:, :edge[-1]]
+        total[start:start+CHUNK_ROWS] = np.add.reduceat(block, edge[:-1], axis=1, dtype=np.uint32)[:, ::2]
+        count[start:start+CHUNK_ROWS] = np.add.reduceat(block != 0, edge[:-1], axis=1, dtype=np.uint32)[:, ::2]
+    return total, count
+
+def __masked_block(image: np.ndarray, mask: np.ndarray, start: int) -> np.ndarray:
+    block = image[start:start+CHUNK_ROWS]
+    if mask is None:
+        return block
+    return block * (mask[start:start+CHUNK_ROWS, :, None] != 0)
+
+def average_intensity(total: np.ndarray, count: np.ndarray) -> np.ndarray:
+    """ Inverted mean intensity (255 - mean) of the masked pixels, 0 where no pixel is set. """
+    safe_count = np.where(count == 0, 1, count)
+    intensity = (255 - (total / safe_count)).astype(int)
+    intensity[count == 0] = 0
+    return intensity
+
+def intensity_profile(image: np.ndarray, orientation: str = 'column', mask: np.ndarray = None) -> np.ndarray:
+    """ Masked inverted intensity profile of a BGR image, shaped (3, n) in R, G, B order. """
+    total, count = channel_sum_count(image, orientation, mask)
+    return average_intensity(total, count).T[::-1]
+
+def intensity_rgb(image: np.ndarray, orientation: str = 'column', mask: np.ndarray = None) -> dict[str, np.ndarray]:
+    """ Same as intensity_profile but keyed by colour like PeakInfo.intensity and Mixture.intensity. """
+    return dict(zip('RGB', intensity_profile(image, orientation, mask)))
+
+
+def lane_intensity_rgb(image: np.ndarray, list_box: list, mask: np.ndarray = None) -> list[dict[str, np.ndarray]]:
+    """ intensity_rgb of every lane of a multi-lane plate, read from the bottom of the plate up.
+
+    Matches intensity_rgb of each lane turned by image_processing.crop_lane, without cropping.
+    """
+    total, count = lane_sum_count(image, list_box, mask)
+    intensity = average_intensity(total, count)[::-1]
+    return [dict(zip('RGB', intensity[:, lane, ::-1].T)) for lane in range(len(list_box))]
+
+
+class ProfileIntegral:
+    """ Running trapezoid integral of an RGB profile, so the area between any boundaries is two lookups.
+
+    Built once per profile; area() then measures every segment of every channel in one call,
+    whether the boundaries are detected minima, overlapping or edited by hand. Integer
+    profiles, including the uint8 ones of compact objects, are summed in int64 as twice the
+    area, so the result equals np.trapz over the same slices exactly.
+    """
+    __slots__ = ('cumulative', 'length')
+
+    def __init__(self, intensity: dict[str, np.ndarray]):
+        stacked = np.stack([np.asarray(intensity[color]) for color in 'RGB'])
+        stacked = stacked.astype(np.int64) if np.issubdtype(stacked.dtype, np.integer) else stacked.astype(np.float64)
+        self.length = stacked.shape[1]
+        self.cumulative = np.zeros((3, self.length), dtype=stacked.dtype)
+        np.cumsum(stacked[:, :-1] + stacked[:, 1:], axis=1, out=self.cumulative[:, 1:])
+
+    def area(self, start, end) -> dict[str, np.ndarray]:
+        """ np.trapz(intensity[color][start[i]:end[i]+1]) for every boundary pair i and colour. """
+        start = np.minimum(np.asarray(start, dtype=np.intp).reshape(-1), self.length - 1)
+        end = np.minimum(np.asarray(end, dtype=np.intp).reshape(-1), self.length - 1)
+        end = np.maximum(end, start)
+        area = (self.cumulative[:, end] - self.cumulative[:, start]) / 2
+        return dict(zip('RGB', area))
+
+
+class ProfileMinima:
+    """ Minima of an RGB profile as peak boundaries, with every candidate measured once.
+
+    The candidates are the local maxima of the inverted grayscale profile, stored with their
+    prominences and half-height widths, so find() with any prominence, distance or width gives
+    the same minima as scipy.signal.find_peaks without touching the profile again. The
+    boundaries also include the first lit column and the column just after the last lit run.
+    """
+    __slots__ = ('inverse', 'candidate', 'prominence', 'width', 'first', 'last')
+
+    def __init__(self, intensity: dict[str, np.ndarray]):
+        grayscale = 0.299*np.asarray(intensity['R']) + 0.587*np.asarray(intensity['G']) + 0.114*np.asarray(intensity['B'])
+        self.inverse = 255 - grayscale
+        self.candidate, _ = find_peaks(self.inverse)
+        prominence_data = peak_prominences(self.inverse, self.candidate)
+        self.prominence = prominence_data[0]
+        self.width = peak_widths(self.inverse, self.candidate, prominence_data=prominence_data)[0]
+        lit = grayscale != 0
+        run_end = np.flatnonzero(lit[:-1] & ~lit[1:]) + 1
+        self.first = int(np.argmax(lit)) if lit.any() else None
+        # The column after the last lit run that is followed by a zero; the last column when no run
+        # is followed by a zero
+        self.last = int(run_end[-1]) if len(run_end) else len(lit) - 1
+
+    def find(self, prominence: float = None, distance: float = None, width: float = None) -> np.ndarray:
+        """ Boundaries for minimum prominence, distance and width, as find_peaks with the same arguments; empty when nothing is lit. """
+        if self.first is None:
+            return np.empty(0, dtype=np.intp)
+        keep = np.ones(len(self.candidate), dtype=bool)
+        if distance is not None:
+            keep = self.__select_by_distance(distance)
+        if prominence is not None:
+            keep &= self.prominence >= prominence
+        if width is not None:
+            keep &= self.width >= width
+        return np.concatenate(([self.first], self.candidate[keep], [self.last]))
+
+    def __select_by_distance(self, distance: float) -> np.ndarray:
+        """ Greedy removal of lower candidates closer than distance to a higher one, in the order find_peaks uses. """
+        if distance < 1:
+            raise ValueError('distance must be greater or equal to 1')
+        distance = np.ceil(distance)
+        keep = np.ones(len(self.candidate), dtype=bool)
+        for j in np.argsort(self.inverse[self.candidate])[::-1]:
+            if not keep[j]:
+                continue
+            close = np.abs(self.candidate - self.candidate[j]) < distance
+            close[j] = False
+            keep &= ~close
+        return keep
@@ -1,3 +1,5 @@
+import numpy as np
+
 def union(rect_1: tuple, rect_2: tuple) -> tuple:
   x = min(rect_1[0], rect_2[0])
   y = min(rect_1[1], rect_2[1])
@@ -13,20 +15,92 @@ def intersection(rect_1: tuple, rect_2: tuple) -> tuple:
   if w<0 or h<0: return (0, 0, 0, 0)
   return (x, y, w, h)
 
-def groupBoundingBox(rect_list: list) -> list:
-  is_tested = [False for i in range(len(rect_list))]
-  final_rect = []
-  i = 0
-
-  while i < len(rect_list):
-    if not is_tested[i]:
-      j = i+1
-      while j <len(rect_list):
-        if not is_tested[j] and intersection(rect_list[i], rect_list[j]) != (0, 0, 0, 0):
-          rect_list[i] = union(rect_list[i], rect_list[j])
-          is_tested[j] = True
-          j = i
-        j += 1
-      final_rect += [rect_list[i]]
-    i += 1
-  return final_rect
\ No newline at end of file
+def groupBoundingBox(rect_list) -> list:
+  """ Merge overlapping or touching (x, y, w, h) boxes; does not modify rect_list.
+
+  Groups are returned in the order of their first box in rect_list. Boxes that all
+  share the same x/w (or y/h) take the 1-D sort-and-sweep path, anything else the
+  2-D sweep plus union-find path; both give the same result on 1-D input.
+  """
+  boxes = np.asarray(rect_list, dtype=np.int64).reshape(-1, 4)
+  if len(boxes) == 0:
+    return []
+  if np.all(boxes[:, 0] == boxes[0, 0]) and np.all(boxes[:, 2] == boxes[0, 2]):
+    merged = merge_interval_boxes(boxes, axis=1)
+  elif np.all(boxes[:, 1] == boxes[0, 1]) and np.all(boxes[:, 3] == boxes[0, 3]):
+    merged = merge_interval_boxes(boxes, axis=0)
+  else:
+    merged = merge_boxes(boxes)
+  return [tuple(int(v) for v in box) for box in merged]
+
+def merge_interval_boxes(boxes: np.ndarray, axis: int = 1) -> np.ndarray:
+  """ 1-D merge of (n, 4) boxes along x (axis=0) or y (axis=1) in O(n log n).
+
+  The other axis is taken from the first box, so all boxes must share it.
+  """
+  boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+  start = boxes[:, axis]
+  end = start + boxes[:, axis+2]
+  order = np.argsort(start, kind='stable')
+  start_sorted, end_sorted = start[order], end[order]
+  running_end = np.maximum.accumulate(end_sorted)
+  group_start = np.flatnonzero(np.concatenate(([True], start_sorted[1:] > running_end[:-1])))
+
+  merged = np.repeat(boxes[:1], len(group_start), axis=0)
+  merged[:, axis] = start_sorted[group_start]
+  merged[:, axis+2] = np.maximum.reduceat(end_sorted, group_start) - merged[:, axis]
+  first_index = np.minimum.reduceat(order, group_start)
+  return merged[np.argsort(first_index, kind='stable')]
+
+def merge_boxes(boxes: np.ndarray) -> np.ndarray:
+  """ 2-D merge of (n, 4) boxes, repeated until no two resulting boxes overlap. """
+  boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+  first_index = np.arange(len(boxes))
+  while len(boxes) > 1:
+    label = __label_overlapping_boxes(boxes)
+    n_group = label.max() + 1
+    if n_group == len(boxes):
+      break
+    x0 = np.full(n_group, np.iinfo(np.int64).max)
+    y0 = np.full(n_group, np.iinfo(np.int64).max)
+    x1 = np.full(n_group, np.iinfo(np.int64).min)
+    y1 = np.full(n_group, np.iinfo(np.int64).min)
+    group_first = np.full(n_group, np.iinfo(np.int64).max)
+    np.minimum.at(x0, label, boxes[:, 0])
+    np.minimum.at(y0, label, boxes[:, 1])
+    np.maximum.at(x1, label, boxes[:, 0] + boxes[:, 2])
+    np.maximum.at(y1, label, boxes[:, 1] + boxes[:, 3])
+    np.minimum.at(group_first, label, first_index)
+    order = np.argsort(group_first, kind='stable')
+    boxes = np.stack([x0, y0, x1 - x0, y1 - y0], axis=1)[order]
+    first_index = group_first[order]
+  return boxes
+
+def __label_overlapping_boxes(boxes: np.ndarray) -> np.ndarray:
+  """ Connected component label of every box, sweeping along x and joining with union-find. """
+  x0, y0 = boxes[:, 0], boxes[:, 1]
+  x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+  order = np.argsort(x0, kind='stable')
+  x0_sorted = x0[order]
+  # Boxes order[i+1:stop[i]] start before box order[i] ends, so only they can overlap it
+  stop = np.searchsorted(x0_sorted, x1[order], side='right')
+  parent = list(range(len(boxes)))
+
+  def find(i: int) -> int:
+    while parent[i] != i:
+      parent[i] = parent[parent[i]]
+      i = parent[i]
+    return i
+
+  for position, i in enumerate(order):
+    candidate = order[position+1:stop[position]]
+    if len(candidate) == 0:
+      continue
+    overlap = candidate[(y0[candidate] <= y1[i]) & (y1[candidate] >= y0[i])]
+    root_i = find(i)
+    for j in overlap:
+      root_j = find(j)
+      if root_j != root_i:
+        parent[root_j] = root_i
+  root = np.array([find(i) for i in range(len(boxes))])
+  return np.unique(root, return_inverse=True)[1].reshape(-1)
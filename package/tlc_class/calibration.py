@@ -1,42 +1,115 @@
-import cv2
+import functools
+import os
 import numpy as np
-import matplotlib.pyplot as plt
 from package.image_processing import image_processing
-import time
+from package.image_processing import profile
+from package.image_processing.instrument import instrumented
+from package.image_processing.cache import PreprocessingCache, image_key, pack_mask, unpack_mask
+from package.tlc_class import fitting
+from package.tlc_class import plot
+
+# Bumped whenever the layout written by Calibration.save changes; version 2 stores float fit lines
+MODEL_VERSION = 2
+MODEL_EXTENSION = '.npz'
 
 class PeakInfo:
-    def __init__(self, image: np.ndarray, concentration: list[float]):
-        self.image = image
+    __slots__ = ('concentration', 'intensity', 'minima', 'peak_area', 'best_fit_line', 'r2', '__image', '__load_image', '__integral', '__weakref__')
+
+    @instrumented('peak')
+    def __init__(self, image: np.ndarray, concentration: list[float], cached: dict[str, np.ndarray] = None, intensity: dict[str, np.ndarray] = None, fit: bool = True):
+        """ cached holds the 'intensity', 'minima' and 'peak_area' arrays of a previous run (see cache_entry).
+        intensity is a column profile measured elsewhere (e.g. straight from the plate and its
+        mask), used instead of measuring image.
+
+        A cached entry from a model file may also hold 'best_fit_line' and 'r2', which are then
+        used as saved instead of being refitted, and may leave out the profiles. fit=False leaves
+        the line to the caller, e.g. Calibration fits all of its peaks together.
+        """
+        self.__image = image
+        self.__load_image = None
+        self.__integral = None
         self.concentration = concentration
         self.intensity = {}
         self.minima = []
         self.peak_area = {}
         self.best_fit_line = {}
         self.r2 = {}
-        self.plot_intensity = None
-        self.plot_fit_line = None
-        self.__process_peak()
+        self.__process_peak(cached, intensity, fit)
         
-    def __process_peak(self):
-        self.__calculate_intensity()
-        self.__calculate_minima()
+    def __process_peak(self, cached: dict[str, np.ndarray], intensity: dict[str, np.ndarray], fit: bool):
+        if cached is None:
+            if intensity is None:
+                self.__calculate_intensity()
+            else:
+                self.intensity = intensity
+            self.__calculate_minima()
+            self.__calculate_peak_area()
+        else:
+            self.intensity = dict(zip('RGB', cached['intensity'])) if 'intensity' in cached else {}
+            self.minima = cached.get('minima', [])
+            self.peak_area = dict(zip('RGB', cached['peak_area']))
+        if cached is not None and 'best_fit_line' in cached:
+            self.best_fit_line = {color: tuple(float(v) for v in line) for color, line in zip('RGB', cached['best_fit_line'])}
+            self.r2 = {color: float(r2) for color, r2 in zip('RGB', cached['r2'])}
+        elif fit:
+            self.__calculate_fit_line(self.concentration)
+    
+    @property
+    def image(self) -> np.ndarray:
+        """ Background-free peak crop, regenerated through load_image after compact(). """
+        if self.__image is None and self.__load_image is not None:
+            return self.__load_image()
+        return self.__image
+    
+    def set_minima(self, minima):
+        """ Replace the peak boundaries, e.g. after an edit by hand, and refresh the areas and fit. """
+        self.minima = np.asarray(minima, dtype=np.int32)
         self.__calculate_peak_area()
         self.__calculate_fit_line(self.concentration)
-        self.__create_plot_intensity()
-        self.__create_plot_fit_line(self.concentration)
+        plot.figure_cache.discard(self, 'intensity')
+        plot.figure_cache.discard(self, 'fit_line')
+    
+    def compact(self, load_image=None):
+        """ Drop the pixel crop and keep the profiles as uint8; load_image() rebuilds the crop on demand. """
+        self.__image = self.__integral = None
+        self.__load_image = load_image
+        self.intensity = {color: intensity.astype(np.uint8) for color, intensity in self.intensity.items()}
+        self.minima = np.asarray(self.minima, dtype=np.int32)
+    
+    def cache_entry(self) -> dict[str, np.ndarray]:
+        return {
+            'intensity': np.stack([self.intensity[color] for color in 'RGB']),
+            'minima': np.asarray(self.minima),
+            'peak_area': np.stack([self.peak_area[color] for color in 'RGB']),
+        }
+    
+    def model_entry(self, include_profile: bool = True) -> dict[str, np.ndarray]:
+        """ Arrays written to a calibration model file, profiles only when include_profile and present. """
+        entry = {
+            'peak_area': np.stack([self.peak_area[color] for color in 'RGB']),
+            'best_fit_line': np.array([self.best_fit_line[color] for color in 'RGB'], dtype=np.float64),
+            'r2': np.array([self.r2[color] for color in 'RGB'], dtype=np.float64),
+        }
+        if include_profile and self.intensity:
+            entry['intensity'] = np.stack([self.intensity[color] for color in 'RGB']).astype(np.uint8)
+            entry['minima'] = np.asarray(self.minima, dtype=np.int32)
+        return entry
     
+    @property
+    def plot_intensity(self):
+        """ Intensity figure, rendered on first access. """
+        return plot.figure_cache.get(self, 'intensity', lambda: plot.plot_intensity(self.intensity, self.minima))
+    
+    @property
+    def plot_fit_line(self):
+        """ Best fit line figure, rendered on first access. """
+        return plot.figure_cache.get(self, 'fit_line', lambda: plot.plot_fit_line(self.peak_area, self.best_fit_line, self.r2, self.concentration))
+    
+    @instrumented('peak.intensity')
     def __calculate_intensity(self):
-        intensity = {}
-        image_rgb = cv2.split(cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB))
-        for j, color in enumerate(['R', 'G', 'B']):
-            sum_intensity = np.sum(image_rgb[j], axis=0)
-            count_color_pixel = np.sum(np.where(image_rgb[j] > 0, 1, 0), axis=0)
-            safe_count_color_pixel = np.where(count_color_pixel == 0, 1, count_color_pixel)
-            average_intensity = (255 - (sum_intensity / safe_count_color_pixel)).astype(int)
-            average_intensity[count_color_pixel == 0] = 0
-            intensity[color] = average_intensity
-        self.intensity = intensity
+        self.intensity = profile.intensity_rgb(self.image)
     
+    @instrumented('peak.minima')
     def __calculate_minima(self):
         """ Calculate the minima points for intensity curves to determine peak boundaries. """
         intensity_grayscale = 0.299*self.intensity['R'] + 0.587*self.intensity['G'] + 0.114*self.intensity['B']
@@ -46,84 +119,166 @@ class PeakInfo:
         minima_index = np.sort(np.concatenate((zero_to_non_zero, non_zero_to_zero)))
         self.minima = minima_index
     
+    @instrumented('peak.peak_area')
     def __calculate_peak_area(self):
-        """ Calculate the area under the intensity curve for each peak and color channel. """
-        peak_area = {}
-        for color in 'RGB':
-            each_color_area = []
-            intensity = self.intensity[color]
-            for index_minima in range(0, len(self.minima)-1, 2):
-                each_color_area.append(np.trapz(intensity[self.minima[index_minima]: self.minima[index_minima + 1] + 1]))
-            peak_area[color] = np.array(each_color_area)
-        self.peak_area = peak_area
+        """ Calculate the area under the intensity curve for each peak and color channel.
+
+        Minima alternate rising and falling edges, so each peak spans minima[2i] to minima[2i+1].
+        """
+        if self.__integral is None:
+            self.__integral = profile.ProfileIntegral(self.intensity)
+        minima = np.asarray(self.minima)
+        self.peak_area = self.__integral.area(minima[:len(minima)-1:2], minima[1:len(minima):2])
     
+    @instrumented('peak.fit_line')
     def __calculate_fit_line(self, concentration):
-        """ Calculate the best fit line for the peak areas vs. concentrations. """
-        best_fit_line = {}
-        r2 = {}
-        for color in 'RGB':
-            # Best fite line
-            new_concentration = concentration[-len(self.peak_area[color]):]
-            best_fit_line[color] = tuple(np.polyfit(new_concentration, self.peak_area[color], 1).astype(int))
-            
-            # R2
-            actual = np.array(self.peak_area[color])
-            coef, const = best_fit_line[color]
-            predict = np.array([coef*cont + const for cont in new_concentration])
-            mean = np.mean(actual)
-            ssr = sum(np.power(actual-predict, 2))
-            sst = sum(np.power(actual-mean, 2))
-            r2[color] = round(1 - ssr/sst, 3)
-        self.best_fit_line = best_fit_line
-        self.r2 = r2
-    
-    def __create_plot_intensity(self):
-        x = np.arange(0, len(self.intensity['R']))
-        figure, axis = plt.subplots(nrows=3, ncols=1, figsize=(4, 12))
-        rgb = ['Red', 'Green', 'Blue']
-        for i, color in enumerate(['R', 'G', 'B']):
-            intensity = self.intensity[color]
-            axis[i].plot(x, intensity, color=rgb[i])
-            axis[i].scatter(self.minima, np.take(intensity, self.minima))
-            axis[i].set_title(f'{rgb[i]} Intensity')
-            axis[i].set_xlabel('Pixel')
-            axis[i].set_ylabel('Intensity')
-            axis[i].set_ylim((0, 255))
-            axis[i].grid()
-        figure.tight_layout()
-        self.plot_intensity = figure
-        plt.close()
-    
-    def __create_plot_fit_line(self, concentration):
-        figure, axis = plt.subplots(nrows=3, ncols=1, figsize=(3, 9))
-        rgb_color = {'R':'Red', 'G':'Green', 'B':'Blue'}
-        for i, color in enumerate('RGB'):
-            peak_area = self.peak_area[color]
-            while len(peak_area) < len(concentration):
-                peak_area = np.insert(peak_area, 0, 0, axis=0)
-            a, b = self.best_fit_line[color]
-            x = np.linspace(concentration[0], concentration[-1], 100)
-            y = a * x + b
-            r2 = round(self.r2[color], 3)
-            axis[i].scatter(concentration, peak_area, color=rgb_color[color])
-            axis[i].plot(x, y, color=rgb_color[color], label=f'{a}c + {b}\nR2: {r2}')
-            axis[i].set_title(f'Peak: {rgb_color[color]} Peak Area')
-            axis[i].set_xlabel('Concentration')
-            axis[i].set_ylabel('Peak Area')
-            axis[i].grid()
-            axis[i].legend()
-        figure.tight_layout()
-        self.plot_fit_line = figure
-        plt.close()
+        """ Calculate the least-squares line and R² of the peak areas vs. concentrations for R, G and B in one batch. """
+        slope, intercept, r2 = fitting.fit_lines(*fitting.stack_peak_area([self.peak_area[color] for color in 'RGB'], concentration))
+        self.best_fit_line = {color: (float(slope[i]), float(intercept[i])) for i, color in enumerate('RGB')}
+        self.r2 = {color: fitting.stored_r2(r2[i]) for i, color in enumerate('RGB')}
     
 class Calibration:
-    def __init__(self, name: str, image: np.ndarray, concentration: list[float]):
-        """ Initialize the Calibration object. """
+    __slots__ = ('name', 'concentration', 'cache', 'source_path', 'compact', 'peaks', '__image', '__processed_image_peak', '__processed_image_full', '__list_box', '__weakref__')
+
+    @instrumented('calibration')
+    def __init__(self, name: str, image: np.ndarray, concentration: list[float], cache: PreprocessingCache = None, compact: bool = False, source_path: str = None, context: image_processing.PreprocessingContext = None):
+        """ Initialize the Calibration object, reusing the mask, boxes and peak profiles from cache when present.
+
+        compact=True keeps only the profiles, peak boundaries and fit results; the source image,
+        overview and peak crops are read again from source_path whenever they are asked for.
+        A compact calibration is also segmented in strips and profiled straight from the plate
+        and its mask, so no full-size intermediate or masked copy of the plate is made.
+
+        context reuses the segmentation buffers of the previous plate, see image_processing.PreprocessingContext.
+        """
+        if compact and source_path is None:
+            raise ValueError("A compact Calibration needs source_path to regenerate its pixels")
         self.name = name
-        self.image = image
         self.concentration = concentration
-        self.processed_image_peak, self.processed_image_full = image_processing.preprocessing_calibration(image)
-        self.peaks = [PeakInfo(image, self.concentration) for image in self.processed_image_peak]
+        self.cache = cache
+        self.source_path = source_path
+        self.compact = compact
+        key = image_key(image, 'calibration') if cache is not None else None
+        entry = cache.get(key) if cache is not None else None
+        mask, list_contour, self.__list_box = self.__segment(image, entry, streamed=compact, context=context)
+        if compact:
+            self.__image = self.__processed_image_full = self.__processed_image_peak = None
+            self.peaks = [PeakInfo(None, self.concentration, self.__cached_peak(entry, i), None if entry else self.__peak_intensity(image, mask, box), fit=False) for i, box in enumerate(self.__list_box)]
+        else:
+            self.__image = image
+            self.__processed_image_peak, self.__processed_image_full = image_processing.render_calibration(image, mask, list_contour, self.__list_box)
+            self.peaks = [PeakInfo(image, self.concentration, self.__cached_peak(entry, i), fit=False) for i, image in enumerate(self.__processed_image_peak)]
+        self.fit()
+        if cache is not None and entry is None:
+            cache.put(key, self.__cache_entry(mask, self.__list_box))
+        if compact:
+            for i, peak in enumerate(self.peaks):
+                peak.compact(functools.partial(self.peak_image, i))
+    
+    @property
+    def image(self) -> np.ndarray:
+        return self.render()[0]
+    
+    @property
+    def processed_image_full(self) -> np.ndarray:
+        return self.render()[1]
+    
+    @property
+    def processed_image_peak(self) -> list[np.ndarray]:
+        return self.render()[2]
     
     def set_name(self, name):
-        self.name = name
\ No newline at end of file
+        self.name = name
+    
+    def fit(self, weight: list[float] = None, through_origin: bool = False, method: str = 'least_squares', residual_threshold: float = None):
+        """ Fit the line and R² of every peak and channel in one batched call, see fitting.fit_lines.
+
+        weight is one weight per concentration; method is 'least_squares', 'huber' or 'ransac'.
+        """
+        fitting.fit_calibration([self], weight, through_origin, method, residual_threshold)
+    
+    def save(self, path: str, include_profile: bool = True):
+        """ Write concentrations, peak boxes, areas, fit lines, r² and optionally the profiles to a .npz model file. """
+        model = {
+            'version': np.array(MODEL_VERSION),
+            'name': np.array(self.name),
+            'source_path': np.array(os.path.abspath(self.source_path) if self.source_path else ''),
+            'concentration': np.asarray(self.concentration, dtype=np.float64),
+            'box': np.array(self.__list_box, dtype=np.int32).reshape(-1, 4),
+        }
+        for i, peak in enumerate(self.peaks):
+            model.update({f'peak{i}_{name}': array for name, array in peak.model_entry(include_profile).items()})
+        with open(path, 'wb') as file:
+            np.savez_compressed(file, **model)
+    
+    @classmethod
+    def load(cls, path: str, cache: PreprocessingCache = None) -> 'Calibration':
+        """ Calibration written by save(), without reading or processing any image.
+
+        The result is compact; its pixels are rebuilt from the saved source path if that file still exists.
+        """
+        with np.load(path, allow_pickle=False) as model:
+            version = int(model['version'])
+            if version > MODEL_VERSION:
+                raise ValueError(f"Calibration model {path} has version {version}, this version reads up to {MODEL_VERSION}")
+            model = {name: model[name] for name in model.files}
+        calibration = cls.__new__(cls)
+        calibration.name = str(model['name'])
+        calibration.concentration = model['concentration'].tolist()
+        calibration.cache = cache
+        calibration.source_path = str(model['source_path']) or None
+        calibration.compact = True
+        calibration.__image = calibration.__processed_image_full = calibration.__processed_image_peak = None
+        calibration.__list_box = [tuple(int(v) for v in box) for box in model['box']]
+        calibration.peaks = []
+        for i in range(len(calibration.__list_box)):
+            entry = {name[len(f'peak{i}_'):]: array for name, array in model.items() if name.startswith(f'peak{i}_')}
+            peak = PeakInfo(None, calibration.concentration, entry)
+            peak.compact(functools.partial(calibration.peak_image, i))
+            calibration.peaks.append(peak)
+        return calibration
+    
+    def render(self) -> tuple[np.ndarray, np.ndarray, list[np.ndarray]]:
+        """ Source image, annotated overview and peak crops, rebuilt from source_path in compact mode. """
+        if not self.compact:
+            return self.__image, self.__processed_image_full, self.__processed_image_peak
+        image, mask, list_contour = self.__load_pixels()
+        list_cropped, image_with_bounding_box = image_processing.render_calibration(image, mask, list_contour, self.__list_box)
+        return image, image_with_bounding_box, list_cropped
+    
+    def peak_image(self, peak_index: int) -> np.ndarray:
+        """ Background-free crop of one peak, without drawing the overview. """
+        if not self.compact:
+            return self.__processed_image_peak[peak_index]
+        image, mask, _ = self.__load_pixels()
+        return image_processing.crop_peak(image, mask, self.__list_box[peak_index:peak_index+1])[0]
+    
+    def __load_pixels(self) -> tuple[np.ndarray, np.ndarray, list]:
+        if not self.source_path:
+            raise FileNotFoundError(f"Calibration {self.name} has no source image to rebuild its pixels from")
+        image = image_processing.read_image(self.source_path)
+        entry = self.cache.get(image_key(image, 'calibration')) if self.cache is not None else None
+        mask, list_contour, _ = self.__segment(image, entry)
+        return image, mask, list_contour
+    
+    def __peak_intensity(self, image: np.ndarray, mask: np.ndarray, box: tuple) -> dict[str, np.ndarray]:
+        x, y, w, h = box
+        return profile.intensity_rgb(image[y:y+h, x:x+w], mask=mask[y:y+h, x:x+w])
+    
+    def __segment(self, image: np.ndarray, entry: dict[str, np.ndarray], streamed: bool = False, context: image_processing.PreprocessingContext = None) -> tuple[np.ndarray, list, list]:
+        if entry is None:
+            return image_processing.segment_calibration(image, streamed=streamed, context=context)
+        mask = unpack_mask(entry['mask'], image.shape[:2])
+        list_box = [tuple(int(v) for v in box) for box in entry['box']]
+        return mask, image_processing.calibration_contour(mask), list_box
+    
+    def __cache_entry(self, mask: np.ndarray, list_box: list) -> dict[str, np.ndarray]:
+        entry = {'mask': pack_mask(mask), 'box': np.array(list_box, dtype=np.int32).reshape(-1, 4)}
+        for i, peak in enumerate(self.peaks):
+            entry.update({f'peak{i}_{name}': array for name, array in peak.cache_entry().items()})
+        return entry
+    
+    def __cached_peak(self, entry: dict[str, np.ndarray], peak_index: int) -> dict[str, np.ndarray]:
+        if entry is None:
+            return None
+        return {name: entry[f'peak{peak_index}_{name}'] for name in ['intensity', 'minima', 'peak_area']}
@@ -0,0 +1,174 @@
+import numpy as np
+
+FIT_METHOD = ('least_squares', 'huber', 'ransac')
+# Huber tuning constant (95% efficiency on normal residuals) and IRLS iteration cap
+HUBER_K = 1.345
+HUBER_MAX_ITERATION = 50
+# Residual scale of a normal sample from its median absolute deviation
+MAD_TO_SIGMA = 1 / 0.6745
+# Stored R² is rounded like the per-peak fit always did, so MixtureHack ranks peaks that fit
+# equally well by their order instead of by noise in the last digits
+R2_DECIMALS = 3
+
+def stack_peak_area(list_peak_area: list[np.ndarray], concentration: list[float]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Stack peak-area series of any lengths into (batch, n_concentration) concentration, area and validity arrays.
+
+    A series shorter than concentration belongs to its highest concentrations, since the
+    faintest spots are the ones that drop out, so it is aligned to the right.
+    """
+    concentration = np.asarray(concentration, dtype=np.float64)
+    length = np.array([len(area) for area in list_peak_area], dtype=np.intp)
+    if np.any(length > len(concentration)):
+        raise ValueError(f"A peak has {length.max()} areas but there are only {len(concentration)} concentrations")
+    valid = np.arange(len(concentration)) >= len(concentration) - length[:, None]
+    area = np.zeros(valid.shape, dtype=np.float64)
+    if len(list_peak_area):
+        area[valid] = np.concatenate([np.asarray(area, dtype=np.float64) for area in list_peak_area])
+    return np.broadcast_to(concentration, valid.shape), area, valid
+
+def fit_lines(concentration: np.ndarray, area: np.ndarray, valid: np.ndarray = None, weight: np.ndarray = None, through_origin: bool = False, method: str = 'least_squares', residual_threshold: float = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Fit area = slope * concentration + intercept for every row of (batch, n) arrays at once.
+
+    weight holds per-point weights (e.g. inverse variances) broadcast against area. 'huber'
+    reweights residuals iteratively, 'ransac' tries the line through every pair of points and
+    keeps the one with the most points within residual_threshold (default: the median absolute
+    deviation of the row's areas). Returns slope, intercept and R² per row; R² is weighted by
+    the final weights, so points rejected or damped by a robust method count less or not at all.
+    Rows with fewer than two distinct concentrations get the minimum-norm line, like np.polyfit.
+    """
+    if method not in FIT_METHOD:
+        raise ValueError(f"Unknown fit method '{method}', expected one of {list(FIT_METHOD)}")
+    concentration, area = np.broadcast_arrays(np.asarray(concentration, dtype=np.float64), np.asarray(area, dtype=np.float64))
+    valid = np.ones(area.shape, dtype=bool) if valid is None else np.broadcast_to(valid, area.shape)
+    weight = np.where(valid, 1.0 if weight is None else np.broadcast_to(np.asarray(weight, dtype=np.float64), area.shape), 0.0)
+    if method == 'huber':
+        weight = weight * __huber_weight(concentration, area, weight, through_origin)
+    elif method == 'ransac':
+        weight = weight * __ransac_inlier(concentration, area, weight, through_origin, residual_threshold)
+    slope, intercept = __solve(concentration, area, weight, through_origin)
+    return slope, intercept, r_squared(concentration, area, weight, slope, intercept)
+
+def r_squared(concentration: np.ndarray, area: np.ndarray, weight: np.ndarray, slope: np.ndarray, intercept: np.ndarray) -> np.ndarray:
+    """ Weighted 1 - SSR/SST per row, NaN where the areas do not vary. """
+    weight_sum = weight.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (weight * area).sum(axis=-1) / weight_sum
+        ssr = (weight * (area - slope[:, None] * concentration - intercept[:, None]) ** 2).sum(axis=-1)
+        sst = (weight * (area - mean[:, None]) ** 2).sum(axis=-1)
+        return 1 - ssr / sst
+
+def stored_r2(r2: float) -> float:
+    """ R² as kept on a peak, rounded to R2_DECIMALS.
+
+    A peak with one spot or constant areas has no R²; like the per-peak fit always did, it
+    is stored as -inf rather than NaN so that such peaks rank last.
+    """
+    r2 = float(r2)
+    return round(r2, R2_DECIMALS) if np.isfinite(r2) else -np.inf
+
+def fit_calibration(list_calibration: list, weight: np.ndarray = None, through_origin: bool = False, method: str = 'least_squares', residual_threshold: float = None):
+    """ Refit every peak and channel of every calibration in one batched call and store the lines and R² on the peaks.
+
+    Calibrations may have different concentrations; weight is per concentration and
+    shared, so replicate plates of the same series can be refitted together.
+    """
+    list_row = [(peak, color) for calibration in list_calibration for peak in calibration.peaks for color in 'RGB']
+    if not list_row:
+        return
+    by_concentration = {}
+    for calibration in list_calibration:
+        by_concentration.setdefault(tuple(calibration.concentration), []).append(calibration)
+    width = max(len(concentration_series) for concentration_series in by_concentration)
+    concentration, area, valid = np.zeros((len(list_row), width)), np.zeros((len(list_row), width)), np.zeros((len(list_row), width), dtype=bool)
+    row_index = {(id(peak), color): i for i, (peak, color) in enumerate(list_row)}
+    # Series are right-aligned, so a shorter concentration list is padded on the left
+    for concentration_series, list_group in by_concentration.items():
+        index = [row_index[(id(peak), color)] for calibration in list_group for peak in calibration.peaks for color in 'RGB']
+        x, y, mask = stack_peak_area([peak.peak_area[color] for calibration in list_group for peak in calibration.peaks for color in 'RGB'], concentration_series)
+        concentration[index, width-len(concentration_series):] = x
+        area[index, width-len(concentration_series):] = y
+        valid[index, width-len(concentration_series):] = mask
+    if weight is not None:
+        weight = np.asarray(weight, dtype=np.float64)
+        weight = np.pad(weight, (width - len(weight), 0), constant_values=1.0)
+    slope, intercept, r2 = fit_lines(concentration, area, valid, weight, through_origin, method, residual_threshold)
+    for i, (peak, color) in enumerate(list_row):
+        peak.best_fit_line[color] = (float(slope[i]), float(intercept[i]))
+        peak.r2[color] = stored_r2(r2[i])
+
+def __solve(concentration: np.ndarray, area: np.ndarray, weight: np.ndarray, through_origin: bool) -> tuple[np.ndarray, np.ndarray]:
+    """ Weighted least-squares line of every row from its 2x2 normal equations.
+
+    The columns are scaled to unit norm first, as np.polyfit does, and rank-deficient rows
+    use the pseudo-inverse, which gives polyfit's minimum-norm answer.
+    """
+    sum_xx = (weight * concentration * concentration).sum(axis=-1)
+    sum_xy = (weight * concentration * area).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if through_origin:
+            return sum_xy / sum_xx, np.zeros(len(sum_xx))
+        sum_w = weight.sum(axis=-1)
+        sum_x = (weight * concentration).sum(axis=-1)
+        sum_y = (weight * area).sum(axis=-1)
+        scale_x, scale_1 = np.sqrt(sum_xx), np.sqrt(sum_w)
+        scale_x = np.where(scale_x > 0, scale_x, 1.0)
+        cross = sum_x / (scale_x * scale_1)
+        rhs_x, rhs_1 = sum_xy / scale_x, sum_y / scale_1
+        determinant = 1 - cross * cross
+        full_rank = determinant > 1e-12
+        safe_determinant = np.where(full_rank, determinant, 1.0)
+        # pinv of the rank-one [[1, c], [c, 1]] with |c| = 1 is itself over its squared trace, 4
+        slope = np.where(full_rank, (rhs_x - cross * rhs_1) / safe_determinant, (rhs_x + cross * rhs_1) / 4)
+        intercept = np.where(full_rank, (rhs_1 - cross * rhs_x) / safe_determinant, (cross * rhs_x + rhs_1) / 4)
+        return slope / scale_x, intercept / scale_1
+
+def __huber_weight(concentration: np.ndarray, area: np.ndarray, weight: np.ndarray, through_origin: bool) -> np.ndarray:
+    """ Huber weights by iteratively reweighted least squares, with the residual scale from the MAD. """
+    robust = np.ones(area.shape)
+    for _ in range(HUBER_MAX_ITERATION):
+        slope, intercept = __solve(concentration, area, weight * robust, through_origin)
+        residual = np.abs(area - slope[:, None] * concentration - intercept[:, None])
+        scale = __nanmedian(np.where(weight > 0, residual, np.nan))[:, None] * MAD_TO_SIGMA * HUBER_K
+        with np.errstate(divide='ignore', invalid='ignore'):
+            updated = np.where((residual <= scale) | ~(scale > 0), 1.0, scale / residual)
+        if np.allclose(updated, robust, rtol=0, atol=1e-6):
+            break
+        robust = updated
+    return robust
+
+def __ransac_inlier(concentration: np.ndarray, area: np.ndarray, weight: np.ndarray, through_origin: bool, residual_threshold: float) -> np.ndarray:
+    """ 1 for the points of the best candidate line of every row, trying every pair of points (every point through the origin). """
+    n = area.shape[-1]
+    first, second = (np.arange(n), None) if through_origin else np.triu_indices(n, 1)
+    usable = weight > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if through_origin:
+            candidate = usable & (concentration != 0)
+            slope = area / concentration
+            intercept = np.zeros(slope.shape)
+        else:
+            candidate = usable[:, first] & usable[:, second] & (concentration[:, first] != concentration[:, second])
+            slope = (area[:, second] - area[:, first]) / (concentration[:, second] - concentration[:, first])
+            intercept = area[:, first] - slope * concentration[:, first]
+        if residual_threshold is None:
+            masked_area = np.where(usable, area, np.nan)
+            threshold = __nanmedian(np.abs(masked_area - __nanmedian(masked_area)[:, None]))
+        else:
+            threshold = np.full(len(area), residual_threshold, dtype=np.float64)
+        # (row, candidate, point)
+        residual = np.abs(area[:, None, :] - slope[..., None] * concentration[:, None, :] - intercept[..., None])
+    inlier = (residual <= threshold[:, None, None]) & usable[:, None, :] & candidate[..., None]
+    count = inlier.sum(axis=-1)
+    error = np.where(inlier, residual * residual, 0).sum(axis=-1)
+    best = np.argmin(np.where(count == count.max(axis=-1, keepdims=True), error, np.inf), axis=-1)
+    chosen = inlier[np.arange(len(area)), best]
+    # Rows without a usable candidate keep every point
+    return np.where(candidate.any(axis=-1)[:, None], chosen, usable).astype(np.float64)
+
+def __nanmedian(value: np.ndarray) -> np.ndarray:
+    """ Median of every row ignoring NaN, NaN for rows without any value; np.nanmedian is far slower on many short rows. """
+    ordered = np.sort(value, axis=-1)
+    count = np.count_nonzero(~np.isnan(value), axis=-1)
+    row = np.arange(len(value))
+    low, high = np.maximum(count - 1, 0) // 2, count // 2
+    return np.where(count > 0, (ordered[row, low] + ordered[row, np.minimum(high, value.shape[-1] - 1)]) / 2, np.nan)
@@ -1,96 +1,195 @@
-import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 from package.image_processing import image_processing
-from scipy.signal import find_peaks
+from package.image_processing import parameter
+from package.image_processing import profile
+from package.image_processing.instrument import instrumented
+from package.image_processing.cache import PreprocessingCache, image_key, pack_mask, unpack_mask
+from package.tlc_class import plot
 
 class Mixture:
-    def __init__(self, name: str, image: np.ndarray):
+    __slots__ = ('name', 'cache', 'source_path', 'compact', 'lane_box', 'intensity', 'minima', 'peak_area', '__image', '__processed_image', '__integral', '__minima_finder', '__weakref__')
+
+    @instrumented('mixture')
+    def __init__(self, name: str, image: np.ndarray, cache: PreprocessingCache = None, compact: bool = False, source_path: str = None, intensity: dict[str, np.ndarray] = None, lane_box: tuple = None, context: image_processing.PreprocessingContext = None):
+        """ Reuse the mask, profile, minima and peak areas from cache when the same image was processed before.
+
+        compact=True keeps only the profile, minima and peak areas; the source and background-free
+        images are read again from source_path whenever they are asked for. A compact mixture is
+        segmented in strips and profiled straight from the plate and its mask, without a masked copy.
+
+        intensity and lane_box are set by from_plate for one lane of a multi-lane plate: the
+        profile was already measured there, and lane_box locates the lane on the plate at
+        source_path. image is then the lane crop, or None in compact mode.
+
+        context reuses the segmentation buffers of the previous plate, see image_processing.PreprocessingContext.
+        """
+        if compact and source_path is None:
+            raise ValueError("A compact Mixture needs source_path to regenerate its pixels")
         self.name = name
-        self.image = image
-        self.processed_image = None
+        self.cache = cache
+        self.source_path = source_path
+        self.compact = compact
+        self.lane_box = lane_box
+        self.__image = image
+        self.__processed_image = None
+        self.__integral = None
+        self.__minima_finder = None
         self.intensity = {}
         self.minima = []
         self.peak_area = {}
-        self.plot_intensity = None
         
-        self.__preprocess_image()
-        self.__calculate_intensity_rgb()
-        self.__calculate_minima()
-        #self.minima = self.__refine_minima(minima)
-        self.__calculate_peak_area_rgb()
-        self.__plot_intensity()
+        key = image_key(image, 'mixture') if cache is not None and intensity is None else None
+        entry = cache.get(key) if key is not None else None
+        if entry is not None:
+            self.__restore(entry)
+        elif intensity is not None:
+            self.intensity = intensity
+            self.__calculate_minima()
+            self.__calculate_peak_area_rgb()
+        else:
+            mask = self.__preprocess_image(context)
+            self.__calculate_intensity_rgb(mask)
+            self.__calculate_minima()
+            #self.minima = self.__refine_minima(minima)
+            self.__calculate_peak_area_rgb()
+            if key is not None:
+                cache.put(key, self.__cache_entry(mask))
+        if compact:
+            self.__image = self.__processed_image = self.__integral = self.__minima_finder = None
+            self.intensity = {color: intensity.astype(np.uint8) for color, intensity in self.intensity.items()}
+            self.minima = np.asarray(self.minima, dtype=np.int32)
+    
+    @classmethod
+    @instrumented('mixture.plate')
+    def from_plate(cls, name: str, image: np.ndarray, cache: PreprocessingCache = None, compact: bool = False, source_path: str = None, context: image_processing.PreprocessingContext = None) -> list['Mixture']:
+        """ One Mixture per vertical lane of a multi-lane plate, named '<name> lane <i>' from the left.
+
+        The plate is segmented once (see image_processing.segment_lanes) and every lane profile
+        comes from one masked pass over it (profile.lane_intensity_rgb), so a plate of many
+        lanes costs about as much as a single mixture image. Each lane reads from the bottom of
+        the plate up, the layout of a single-lane mixture with peak 1 on the left. The cache
+        holds the plate mask and lane boxes.
+        """
+        if compact and source_path is None:
+            raise ValueError("A compact Mixture needs source_path to regenerate its pixels")
+        mask, list_lane_box = cls.__segment_plate(image, cache, streamed=compact, context=context)
+        list_intensity = profile.lane_intensity_rgb(image, list_lane_box, mask)
+        image_remove_background = None if compact else image_processing.remove_background(image, mask)
+        list_mixture = []
+        for i, (box, intensity) in enumerate(zip(list_lane_box, list_intensity)):
+            mixture = cls(f'{name} lane {i+1}', None if compact else image_processing.crop_lane(image, box), cache=cache, compact=compact, source_path=source_path, intensity=intensity, lane_box=box)
+            if not compact:
+                mixture.__processed_image = image_processing.crop_lane(image_remove_background, box)
+            list_mixture.append(mixture)
+        return list_mixture
+
+    @staticmethod
+    def __segment_plate(image: np.ndarray, cache: PreprocessingCache, streamed: bool = False, context: image_processing.PreprocessingContext = None) -> tuple[np.ndarray, list]:
+        """ Mask and lane boxes of a multi-lane plate, from cache when it was segmented before. """
+        key = image_key(image, 'mixture_plate') if cache is not None else None
+        entry = cache.get(key) if key is not None else None
+        if entry is not None:
+            return unpack_mask(entry['mask'], image.shape[:2]), [tuple(int(v) for v in box) for box in entry['box']]
+        mask, _, list_lane_box = image_processing.segment_lanes(image, streamed=streamed, context=context)
+        if key is not None:
+            cache.put(key, {'mask': pack_mask(mask), 'box': np.array(list_lane_box, dtype=np.int32).reshape(-1, 4)})
+        return mask, list_lane_box
+
+    @property
+    def image(self) -> np.ndarray:
+        return self.render()[0]
+    
+    @property
+    def processed_image(self) -> np.ndarray:
+        return self.render()[1]
+    
+    @property
+    def plot_intensity(self):
+        """ Intensity figure, rendered on first access. """
+        return plot.figure_cache.get(self, 'intensity', lambda: plot.plot_intensity(self.intensity, self.minima))
 
     def set_name(self, name: str):
         self.name = name
     
-    def __preprocess_image(self):
-        """ Preprocess the image for analysis. """
-        self.processed_image = image_processing.preprocessing_mixture(self.image)
+    def set_minima(self, minima):
+        """ Replace the peak boundaries, e.g. after an edit by hand, and refresh the areas. """
+        self.minima = np.asarray(minima, dtype=np.int32) if self.compact else list(minima)
+        self.__calculate_peak_area_rgb()
+        plot.figure_cache.discard(self, 'intensity')
+    
+    def set_peak_detection(self, prominence: float = None, distance: float = None, width: float = None):
+        """ Find the minima again with other find_peaks limits and refresh the areas, without redoing the profile.
 
-    def __calculate_intensity_rgb(self):
-        image_rgb = cv2.split(cv2.cvtColor(self.processed_image, cv2.COLOR_BGR2RGB))
-        self.intensity = {color: self.__calculate_intensity_single_channel(image_rgb[i]) for i, color in enumerate('RGB')}
+        prominence defaults to parameter.MINIMA_PROMINENCE; the candidate minima are measured
+        once per profile, so this is fast enough to follow a slider.
+        """
+        self.__calculate_minima(prominence, distance, width)
+        self.__calculate_peak_area_rgb()
+        plot.figure_cache.discard(self, 'intensity')
+    
+    def render(self) -> tuple[np.ndarray, np.ndarray]:
+        """ Source and background-free images, rebuilt from source_path in compact mode. """
+        if not self.compact:
+            return self.__image, self.__processed_image
+        image = image_processing.read_image(self.source_path)
+        if self.lane_box is not None:
+            mask, _ = self.__segment_plate(image, self.cache)
+            return image_processing.crop_lane(image, self.lane_box), image_processing.crop_lane(image_processing.remove_background(image, mask), self.lane_box)
+        entry = self.cache.get(image_key(image, 'mixture')) if self.cache is not None else None
+        mask = image_processing.segment_mixture(image) if entry is None else unpack_mask(entry['mask'], image.shape[:2])
+        return image, image_processing.remove_background(image, mask)
+    
+    @instrumented('mixture.preprocess')
+    def __preprocess_image(self, context: image_processing.PreprocessingContext = None) -> np.ndarray:
+        """ Preprocess the image for analysis. """
+        mask = image_processing.segment_mixture(self.__image, streamed=self.compact, context=context)
+        if not self.compact:
+            self.__processed_image = image_processing.remove_background(self.__image, mask)
+        return mask
     
-    def __calculate_intensity_single_channel(self, image):
-        total_intensity = np.sum(image, axis=0)
-        count_color_pixel = np.sum(np.where(image > 0, 1, 0), axis=0)
-        safe_count_color_pixel = np.where(count_color_pixel == 0, 1, count_color_pixel)
-        average_intensity = (255 - (total_intensity / safe_count_color_pixel)).astype(int)
-        average_intensity[count_color_pixel == 0] = 0
-        return average_intensity
+    def __cache_entry(self, mask: np.ndarray) -> dict[str, np.ndarray]:
+        return {
+            'mask': pack_mask(mask),
+            'intensity': np.stack([self.intensity[color] for color in 'RGB']),
+            'minima': np.asarray(self.minima),
+            'peak_area': np.stack([self.peak_area[color] for color in 'RGB']),
+        }
+    
+    def __restore(self, entry: dict[str, np.ndarray]):
+        if not self.compact:
+            mask = unpack_mask(entry['mask'], self.__image.shape[:2])
+            self.__processed_image = image_processing.remove_background(self.__image, mask)
+        self.intensity = dict(zip('RGB', entry['intensity']))
+        self.minima = entry['minima'].tolist()
+        self.peak_area = dict(zip('RGB', entry['peak_area']))
 
-    def __calculate_minima(self):
-        """ Calculate the minima points for intensity curves to determine peak boundaries. """
-        intensity_grayscale = 0.299*self.intensity['R'] + 0.587*self.intensity['G'] + 0.114*self.intensity['B']
-        intensity_grayscale_inverse = 255 - intensity_grayscale
-        minima_index, _ = find_peaks(intensity_grayscale_inverse, prominence=2)
-        
-        for i in range(len(intensity_grayscale)):
-            if intensity_grayscale[i] != 0 and (intensity_grayscale[i-1] == 0 or i == 0):
-                first_index = i
-                break
-            
-        for i in range(len(intensity_grayscale)-1, 0, -1):
-            if intensity_grayscale[i] == 0 and intensity_grayscale[i-1] != 0:
-                last_index = i
-                break
-        
-        new_minima = list(minima_index)
-        new_minima.insert(0, first_index)
-        new_minima.append(last_index)
-        self.minima = new_minima
+    @instrumented('mixture.intensity')
+    def __calculate_intensity_rgb(self, mask: np.ndarray):
+        if self.__processed_image is None:
+            self.intensity = profile.intensity_rgb(self.__image, mask=mask)
+        else:
+            self.intensity = profile.intensity_rgb(self.__processed_image)
+
+    @instrumented('mixture.minima')
+    def __calculate_minima(self, prominence: float = None, distance: float = None, width: float = None):
+        """ Calculate the minima points for intensity curves to determine peak boundaries, see profile.ProfileMinima. """
+        if self.__minima_finder is None:
+            self.__minima_finder = profile.ProfileMinima(self.intensity)
+        prominence = parameter.MINIMA_PROMINENCE if prominence is None else prominence
+        minima = self.__minima_finder.find(prominence, distance, width)
+        self.minima = np.asarray(minima, dtype=np.int32) if self.compact else minima.tolist()
 
     def __refine_minima(self, minima: list):
         """ Refine the minima points to determine accurate peak boundaries. """
         new_minima = list(minima.copy())
         new_minima.insert(0, 0)
-        new_minima.append(self.image.shape[1] - 1)
+        new_minima.append(self.__image.shape[1] - 1)
         return new_minima
 
+    @instrumented('mixture.peak_area')
     def __calculate_peak_area_rgb(self):
-        """ Calculate the area under the intensity curve for each peak and color channel. """
-        self.peak_area = {color: self.__calculate_peak_area_single_channel(self.intensity[color]) for color in 'RGB'}
-    
-    def __calculate_peak_area_single_channel(self, intensity):
-        peak_area = []
-        for index_minima in range(0, len(self.minima)-1, 1):
-            peak_area.append(np.trapz(intensity[self.minima[index_minima]: self.minima[index_minima + 1] + 1]))
-        return np.array(peak_area)
-    
-    def __plot_intensity(self):
-        x = np.arange(0, len(self.intensity['R']))
-        figure, axis = plt.subplots(nrows=3, ncols=1, figsize=(4, 12))
-        rgb = ['Red', 'Green', 'Blue']
-        for i, color in enumerate('RGB'):
-            intensity = self.intensity[color]
-            axis[i].plot(x, intensity, color=rgb[i])
-            axis[i].scatter(self.minima, np.take(intensity, self.minima))
-            axis[i].set_title(f'{rgb[i]} Intensity')
-            axis[i].set_xlabel('Pixel')
-            axis[i].set_ylabel('Intensity')
-            axis[i].set_ylim((0, 255))
-            axis[i].grid()
-        figure.tight_layout()
-        self.plot_intensity = figure
-        plt.close()
\ No newline at end of file
+        """ Calculate the area under the intensity curve for each peak and color channel, between consecutive minima. """
+        if self.__integral is None:
+            self.__integral = profile.ProfileIntegral(self.intensity)
+        minima = np.asarray(self.minima)
+        self.peak_area = self.__integral.area(minima[:-1], minima[1:])
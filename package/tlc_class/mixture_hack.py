@@ -1,38 +1,161 @@
 from package.tlc_class.mixture import Mixture
 from package.tlc_class.calibration import Calibration
-import sympy as sp
+from package.tlc_class import solver
+from package.tlc_class import uncertainty
+from package.tlc_class import plot
+from package.image_processing.instrument import instrumented
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+import os
 
 class MixtureHack:
-    def __init__(self, mixture: Mixture, list_calibration: list[Calibration], r2_threshold=0.9):
+    def __init__(self, mixture: Mixture, list_calibration: list[Calibration | str], r2_threshold=0.9, method='lstsq', symbolic=False):
+        """ list_calibration may mix Calibration objects and paths of model files written by Calibration.save.
+
+        Set symbolic=True to also build the SymPy equations and solve with sp.solve (debug only).
+        """
         self.mixture_object = mixture
-        self.list_calibration_object = list_calibration
-        self.list_variable = []
+        self.list_calibration_object = [Calibration.load(calibration) if isinstance(calibration, (str, os.PathLike)) else calibration for calibration in list_calibration]
+        self.list_variable = [calibration_object.name for calibration_object in self.list_calibration_object]
         self.expression = {}
         self.equation = {}
         self.r2_threshold = r2_threshold
+        self.method = method
+        self.symbolic = symbolic
         self.list_selected_peak_index = []
+        self.dict_selected_peak_index = {}
         self.solution = {}
-        self.plot_mixture = None
+        self.residual = {}
+        self.condition_number = {}
+        self.uncertainty = {}
+        self.confidence = None
         
-        self.__create_variable()
-        self.__create_expression_rgb()
-        self.__create_equation()
+        if self.symbolic:
+            self.__create_variable()
+            self.__create_expression_rgb()
+            self.__create_equation()
     
+    @instrumented('solve')
     def solve_equation(self, color: str):
-        log = ''
-        # print("\nSelecting peaks based on r² values...")
-        # self.list_selected_peak_index = self.__select_peaks_based_on_r2(color)
-        
-        # if not self.list_selected_peak_index:
-        #     print(f"\tNo peaks with r² above the threshold {self.r2_threshold} for color {color}.")
-        #     return
-        # else:
-        #     print(f"\t{len(self.list_selected_peak_index)} peaks with r² above the threshold {self.r2_threshold} for color {color}.\n\tSelected peaks: {self.list_selected_peak_index}")
+        if self.symbolic:
+            return self.__solve_equation_symbolic(color)
+        log = "Selecting top peaks based on r² values..."
+        self.__select_top_peaks_by_r2(color)
+
+        if len(self.list_selected_peak_index) == 0:
+            return f"No peaks with r² above the threshold {self.r2_threshold} for color {color}."
+        log += f'\n\tSelected peaks: {self.list_selected_peak_index}'
         
-        log += "Selecting top peaks based on r² values..."
+        log += "\n\nSolving equation system for selected peaks..."
+        coefficient, target = solver.build_system(self.list_calibration_object, self.mixture_object.peak_area, {color: self.list_selected_peak_index})
+        solution, residual, condition_number = solver.solve(coefficient, target, self.method)
+        self.__store_solution(color, solution[0], residual[0], condition_number[0])
+        log += f"\n\tSelected Peak Indices: {self.list_selected_peak_index}\n\tSolution: {self.solution[color]}\n\tResidual: {self.residual[color]:.3f}\n\tCondition Number: {self.condition_number[color]:.3f}\n\n\n\n"
+        return log
+    
+    @instrumented('solve')
+    def solve_all(self, stacked: bool = False):
+        """ Solve R, G and B in one batched call; stacked=True solves all channels as one system stored under 'RGB'. """
+        for color in 'RGB':
+            self.__select_top_peaks_by_r2(color)
+        if len(self.list_selected_peak_index) == 0:
+            return f"No peaks with r² above the threshold {self.r2_threshold}."
+        coefficient, target = solver.build_system(self.list_calibration_object, self.mixture_object.peak_area, self.dict_selected_peak_index)
+        if stacked:
+            coefficient, target = solver.stack_channels(coefficient, target)
+        solution, residual, condition_number = solver.solve(coefficient, target, self.method)
+        list_color = ['RGB'] if stacked else list('RGB')
+        for i, color in enumerate(list_color):
+            self.__store_solution(color, solution[i], residual[i], condition_number[i])
+        return self.__format_log(list_color)
+    
+    @instrumented('uncertainty')
+    def estimate_uncertainty(self, draw_count: int = uncertainty.DRAW_COUNT, confidence: float = uncertainty.CONFIDENCE, seed: int = 0) -> str:
+        """ Monte Carlo robust standard deviation and confidence interval of every solved channel, see CalibrationSolver.estimate_uncertainty.
+
+        Call after solve_equation or solve_all; the results are stored in self.uncertainty
+        as {color: {name: {'std', 'low', 'high'}}} and returned as log lines.
+        """
+        stacked = 'RGB' in self.solution
+        calibration_solver = solver.CalibrationSolver(self.list_calibration_object, self.method, stacked)
+        std, low, high = calibration_solver.estimate_uncertainty({color: [self.mixture_object.peak_area[color]] for color in 'RGB'}, draw_count, confidence, seed)
+        log = ''
+        for k, color in enumerate(calibration_solver.list_color):
+            if color in self.solution and std.shape[-1]:
+                self.__store_uncertainty(color, std[0, k], low[0, k], high[0, k], confidence)
+                log += f'{color}: {self.__format_uncertainty(color)}\n'
+        return log
+    
+    @classmethod
+    @instrumented('solve')
+    def solve_batch(cls, list_mixture: list[Mixture], calibration_solver: solver.CalibrationSolver, r2_threshold=0.9, draw_count: int = 0, confidence: float = uncertainty.CONFIDENCE, seed: int = 0) -> list[tuple['MixtureHack', str]]:
+        """ Solve every mixture like solve_all, with one vectorized call per peak count through a shared CalibrationSolver.
+
+        draw_count > 0 also estimates the uncertainty of every solution from that many Monte
+        Carlo draws, see estimate_uncertainty. Returns a (MixtureHack, log) pair per mixture,
+        in the order of list_mixture.
+        """
+        list_result = [(cls(mixture, calibration_solver.list_calibration, r2_threshold=r2_threshold, method=calibration_solver.method), '') for mixture in list_mixture]
+        by_peak_count = {}
+        for i, mixture in enumerate(list_mixture):
+            by_peak_count.setdefault(min(len(mixture.peak_area['R']), calibration_solver.peak_count), []).append(i)
+        for peak_count, list_index in by_peak_count.items():
+            peak_area = {color: np.array([list_mixture[i].peak_area[color][:peak_count] for i in list_index], dtype=np.float64).reshape(len(list_index), peak_count) for color in 'RGB'}
+            dict_peak_index, solution, residual, condition_number = calibration_solver.solve(peak_area)
+            if draw_count > 0:
+                std, low, high = calibration_solver.estimate_uncertainty(peak_area, draw_count, confidence, seed)
+            for j, i in enumerate(list_index):
+                mixture_hack = list_result[i][0]
+                mixture_hack.dict_selected_peak_index = dict(dict_peak_index)
+                mixture_hack.list_selected_peak_index = dict_peak_index['B']
+                if not mixture_hack.list_selected_peak_index:
+                    list_result[i] = (mixture_hack, f"No peaks with r² above the threshold {r2_threshold}.")
+                    continue
+                for k, color in enumerate(calibration_solver.list_color):
+                    mixture_hack.__store_solution(color, solution[j, k], residual[j, k], condition_number[k])
+                    if draw_count > 0:
+                        mixture_hack.__store_uncertainty(color, std[j, k], low[j, k], high[j, k], confidence)
+                list_result[i] = (mixture_hack, mixture_hack.__format_log(calibration_solver.list_color))
+        return list_result
+    
+    @property
+    def plot_mixture(self):
+        """ Solution figure, rendered on first access after the last plot_answer(). """
+        return plot.figure_cache.get(self, 'mixture', lambda: plot.plot_mixture_answer(self.mixture_object.intensity, self.mixture_object.minima, self.list_calibration_object, self.solution, self.dict_selected_peak_index))
+    
+    def plot_answer(self):
+        """ Drop the cached solution figure so it reflects the latest solve. """
+        plot.figure_cache.discard(self, 'mixture')
+        return self.plot_mixture
+    
+    def __store_solution(self, color: str, solution: np.ndarray, residual: float, condition_number: float):
+        self.solution[color] = {name: float(value) for name, value in zip(self.list_variable, solution)}
+        self.residual[color] = float(residual)
+        self.condition_number[color] = float(condition_number)
+    
+    def __store_uncertainty(self, color: str, std: np.ndarray, low: np.ndarray, high: np.ndarray, confidence: float):
+        self.uncertainty[color] = {name: {'std': float(s), 'low': float(l), 'high': float(h)} for name, s, l, h in zip(self.list_variable, std, low, high)}
+        self.confidence = confidence
+    
+    def __format_uncertainty(self, color: str) -> str:
+        return f"{self.confidence:.0%} Interval: " + ', '.join(f"{name} {value['low']:.3f} to {value['high']:.3f} (sd {value['std']:.3f})" for name, value in self.uncertainty[color].items())
+    
+    def __format_log(self, list_color: list[str]) -> str:
+        log = ''
+        for color in list_color:
+            log += f'============ {color} Channel ============\n'
+            log += f"Selected Peak Indices: {self.dict_selected_peak_index.get(color, self.dict_selected_peak_index)}\nSolution: {self.solution[color]}\nResidual: {self.residual[color]:.3f}\nCondition Number: {self.condition_number[color]:.3f}\n"
+            if color in self.uncertainty:
+                log += self.__format_uncertainty(color) + '\n'
+            log += '\n'
+        return log
+    
+    def __count_common_peak(self) -> int:
+        """ Number of peaks present in the mixture and in every calibration. """
+        return min([len(self.mixture_object.peak_area['R'])] + [len(calibration.peaks) for calibration in self.list_calibration_object])
+    
+    def __solve_equation_symbolic(self, color: str):
+        import sympy as sp
+        log = "Selecting top peaks based on r² values..."
         self.__select_top_peaks_by_r2(color)
 
         if len(self.list_selected_peak_index) == 0:
@@ -42,7 +165,7 @@ class MixtureHack:
         
         log += "\n\nSolving equation system for selected peaks..."
         list_equation = [self.equation[peak_index][color] for peak_index in self.list_selected_peak_index]
-        solutions = {str(var): con for var, con in sp.solve(list_equation, self.list_variable).items()}
+        solutions = {str(var): con for var, con in sp.solve(list_equation, self.list_symbol).items()}
         
         if not solutions:
             return log + "\n\tNo solution found for the given system of equations."
@@ -52,50 +175,22 @@ class MixtureHack:
         log += f"\n\tSelected Peak Indices: {self.list_selected_peak_index}\n\tEquation: {list_equation}\n\tSolution: {formatted_solution}\n\n\n\n"
         return log
     
-    def plot_answer(self):
-        intensity_rgb = self.mixture_object.intensity
-        minima = self.mixture_object.minima
-        x = np.arange(0, len(intensity_rgb['R']))
-        figure, axis = plt.subplots(nrows=3, ncols=1, figsize=(4, 12))
-        rgb = ['Red', 'Green', 'Blue']
-        for i, color in enumerate('RGB'):
-            intensity = intensity_rgb[color]
-            axis[i].plot(x, intensity, color=rgb[i])
-            axis[i].scatter(minima, np.take(intensity, minima))
-            
-            for peak_index in self.list_selected_peak_index:
-                x_start = minima[peak_index-1]
-                y_start = 0
-                width = minima[peak_index] - minima[peak_index-1]
-                for calibration_object in self.list_calibration_object:
-                    concentration = self.solution[color][calibration_object.name]
-                    coef, const = calibration_object.peaks[peak_index-1].best_fit_line[color]
-                    height = (coef*concentration + const) // width
-                    rect = patches.Rectangle((x_start, y_start), width=width, height=height)
-                    axis[i].add_patch(rect)
-                    y_start += height
-            axis[i].set_title(f'{rgb[i]} Intensity')
-            axis[i].set_xlabel('Pixel')
-            axis[i].set_ylabel('Intensity')
-            axis[i].set_ylim((0, 255))
-        figure.tight_layout()
-        self.plot_mixture = figure
-        plt.close()
-    
     def __create_variable(self):
-        self.list_variable = [sp.symbols(calibration_object.name) for calibration_object in self.list_calibration_object]
+        import sympy as sp
+        self.list_symbol = [sp.symbols(calibration_object.name) for calibration_object in self.list_calibration_object]
     
     def __create_expression_rgb(self):
-        for peak_index in range(len(self.mixture_object.peak_area['R'])):
+        for peak_index in range(self.__count_common_peak()):
             self.expression[peak_index+1] = {color: self.__create_expression_single_channel(color, peak_index) for color in 'RGB'}
     
     def __create_expression_single_channel(self, color: str, peak_index: int):
         coef = [calibration.peaks[peak_index].best_fit_line[color][0] for calibration in self.list_calibration_object]
         constant = sum([calibration.peaks[peak_index].best_fit_line[color][1] for calibration in self.list_calibration_object])
-        return sum(a*v for a,v in zip(coef, self.list_variable)) + constant
+        return sum(a*v for a,v in zip(coef, self.list_symbol)) + constant
     
     def __create_equation(self):
-        for peak_index in range(len(self.mixture_object.peak_area['R'])):
+        import sympy as sp
+        for peak_index in range(self.__count_common_peak()):
             equation = {}
             for color in 'RGB':
                 peak_area = self.mixture_object.peak_area[color][peak_index]
@@ -104,17 +199,5 @@ class MixtureHack:
     
     def __select_top_peaks_by_r2(self, color: str):
         """ Select enough peaks to solve the equation system based on the highest r² values. """
-        peak_r2_values = []
-        
-        # Collect r² values for each peak
-        for peak_index in range(len(self.list_calibration_object[0].peaks)):
-            r2_values = [calibration.peaks[peak_index].r2[color] for calibration in self.list_calibration_object]
-            avg_r2 = np.mean(r2_values)  # Average r² for the peak across calibrations
-            peak_r2_values.append((peak_index + 1, avg_r2))  # (peak_index, avg_r2)
-        
-        # Sort the peaks by the highest average r² values
-        sorted_peaks = sorted(peak_r2_values, key=lambda x: x[1], reverse=True)
-        
-        # Select the top N peaks (where N = number of variables/calibration objects)
-        self.list_selected_peak_index = [peak[0] for peak in sorted_peaks[:len(self.list_variable)]]
-        
\ No newline at end of file
+        self.list_selected_peak_index = solver.select_top_peaks(self.list_calibration_object, self.__count_common_peak(), color)
+        self.dict_selected_peak_index[color] = self.list_selected_peak_index
@@ -0,0 +1,86 @@
+import itertools
+import numpy as np
+from package.image_processing import image_processing, parameter
+from package.tlc_class.calibration import PeakInfo
+
+# Parameter module constant swept -> (stage it feeds, run_stage keyword)
+SWEEP_PARAMETER = {
+    'GAUSSIAN_BLUR_KERNEL_SIZE': ('blur', 'kernel_size'),
+    'CLAHE_CLIP_LIMIT': ('clahe', 'clip_limit'),
+    'CLAHE_GRID_SIZE': ('clahe', 'tile_grid_size'),
+    'ADAPTIVE_THRESHOLDING_CONSTANT': ('threshold', 'constant'),
+    'MORPH_KERNEL_SIZE': ('morph', 'kernel_size'),
+}
+STAGE_ORDER = ['grayscale', 'blur', 'clahe', 'threshold', 'morph']
+
+class ParameterSweep:
+    """ Evaluate calibration preprocessing over a grid of parameter values.
+
+    The chain grayscale -> blur -> clahe -> threshold -> morph is walked depth first,
+    so every stage output is computed once per unique set of upstream parameters and
+    reused by every downstream combination. A 5x5x5 sweep over blur, CLAHE clip and
+    morph kernel runs 5 blurs, 25 CLAHEs and 125 morphs instead of 125 full chains.
+
+    scale < 1 is for images downscaled from full resolution: grid values stay full-resolution
+    ones and kernel sizes and the minimum contour area follow the scale, as in preview_calibration.
+    """
+    def __init__(self, list_image: list[np.ndarray], concentration: list[float], grid: dict[str, list], scale: float = 1.0):
+        unknown = [name for name in grid if name not in SWEEP_PARAMETER]
+        if unknown:
+            raise KeyError(f"Cannot sweep {unknown}, expected names from {list(SWEEP_PARAMETER)}")
+        self.list_image = list_image
+        self.concentration = concentration
+        self.grid = grid
+        self.scale = scale
+        self.stage_count = {stage: 0 for stage in STAGE_ORDER}
+        self.result = []
+
+    def run(self) -> list[dict]:
+        """ One record per parameter combination with peak counts and mean R² per image. """
+        by_combination = {}
+        for image in self.list_image:
+            for combination, mask in self.__walk(0, image, {}):
+                record = by_combination.setdefault(tuple(combination.items()), {'parameter': combination, 'peak_count': [], 'r2': []})
+                peak_count, r2 = self.__evaluate(image, mask)
+                record['peak_count'].append(peak_count)
+                record['r2'].append(r2)
+        self.result = list(by_combination.values())
+        for record in self.result:
+            finite_r2 = [r2 for r2 in record['r2'] if np.isfinite(r2)]
+            record['mean_r2'] = float(np.mean(finite_r2)) if finite_r2 else float('nan')
+        return self.result
+
+    def best(self) -> dict:
+        """ Combination with the highest mean R². """
+        return max(self.result, key=lambda record: np.nan_to_num(record['mean_r2'], nan=-np.inf))
+
+    def __stage_values(self, stage: str) -> list[dict]:
+        """ Every override for one stage; parameters not in the grid keep the parameter module value. """
+        names = [name for name, (target, _) in SWEEP_PARAMETER.items() if target == stage]
+        values = [self.grid.get(name, [getattr(parameter, name)]) for name in names]
+        return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+    def __walk(self, depth: int, image: np.ndarray, upstream: dict):
+        if depth == len(STAGE_ORDER):
+            yield upstream, image
+            return
+        stage = STAGE_ORDER[depth]
+        for values in self.__stage_values(stage):
+            kwargs = {SWEEP_PARAMETER[name][1]: value for name, value in values.items()}
+            if 'scale' in image_processing.PIPELINE_STAGE[stage]:
+                kwargs['scale'] = self.scale
+            output = image_processing.run_stage(stage, image, **kwargs)
+            self.stage_count[stage] += 1
+            yield from self.__walk(depth + 1, output, {**upstream, **values})
+
+    def __evaluate(self, image: np.ndarray, mask: np.ndarray) -> tuple[int, float]:
+        _, list_box = image_processing.find_peak_box(mask, self.scale)
+        list_cropped = image_processing.crop_peak(image, mask, list_box)
+        list_r2 = []
+        for cropped in list_cropped:
+            try:
+                peak = PeakInfo(cropped, self.concentration)
+            except (TypeError, ValueError, np.linalg.LinAlgError):
+                continue
+            list_r2 += [r2 for r2 in peak.r2.values() if np.isfinite(r2)]
+        return len(list_box), float(np.mean(list_r2)) if list_r2 else float('nan')
@@ -0,0 +1,172 @@
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+MAX_LIVE_FIGURES = 24
+
+class FigureCache:
+    """ Bounded LRU of rendered figures keyed by (owner, plot name).
+
+    Figures are rendered on first access and dropped when the cache is full or
+    when their owner is garbage collected, so batch runs that never look at a
+    plot never import matplotlib.
+    """
+    def __init__(self, max_figures: int = MAX_LIVE_FIGURES):
+        self.max_figures = max_figures
+        self.figures = OrderedDict()
+        self.owners = set()
+
+    def get(self, owner, name: str, render):
+        key = (id(owner), name)
+        if key in self.figures:
+            self.figures.move_to_end(key)
+            return self.figures[key]
+        if id(owner) not in self.owners:
+            self.owners.add(id(owner))
+            weakref.finalize(owner, self.discard_owner, id(owner))
+        figure = render()
+        self.figures[key] = figure
+        while len(self.figures) > self.max_figures:
+            self.figures.popitem(last=False)
+        return figure
+
+    def discard(self, owner, name: str):
+        self.figures.pop((id(owner), name), None)
+
+    def discard_owner(self, owner_id: int):
+        self.owners.discard(owner_id)
+        for key in [key for key in self.figures if key[0] == owner_id]:
+            del self.figures[key]
+
+    def clear(self):
+        self.figures.clear()
+
+figure_cache = FigureCache()
+
+def plot_intensity(intensity: dict, minima: list):
+    import matplotlib.pyplot as plt
+    x = np.arange(0, len(intensity['R']))
+    figure, axis = plt.subplots(nrows=3, ncols=1, figsize=(4, 12))
+    rgb = ['Red', 'Green', 'Blue']
+    for i, color in enumerate('RGB'):
+        axis[i].plot(x, intensity[color], color=rgb[i])
+        axis[i].scatter(minima, np.take(intensity[color], minima))
+        axis[i].set_title(f'{rgb[i]} Intensity')
+        axis[i].set_xlabel('Pixel')
+        axis[i].set_ylabel('Intensity')
+        axis[i].set_ylim((0, 255))
+        axis[i].grid()
+    figure.tight_layout()
+    plt.close(figure)
+    return figure
+
+def plot_fit_line(peak_area: dict, best_fit_line: dict, r2: dict, concentration: list[float]):
+    import matplotlib.pyplot as plt
+    figure, axis = plt.subplots(nrows=3, ncols=1, figsize=(3, 9))
+    rgb_color = {'R':'Red', 'G':'Green', 'B':'Blue'}
+    for i, color in enumerate('RGB'):
+        color_peak_area = peak_area[color]
+        while len(color_peak_area) < len(concentration):
+            color_peak_area = np.insert(color_peak_area, 0, 0, axis=0)
+        a, b = best_fit_line[color]
+        x = np.linspace(concentration[0], concentration[-1], 100)
+        y = a * x + b
+        color_r2 = round(r2[color], 3)
+        axis[i].scatter(concentration, color_peak_area, color=rgb_color[color])
+        axis[i].plot(x, y, color=rgb_color[color], label=f'{a:.4g}c + {b:.4g}\nR2: {color_r2}')
+        axis[i].set_title(f'Peak: {rgb_color[color]} Peak Area')
+        axis[i].set_xlabel('Concentration')
+        axis[i].set_ylabel('Peak Area')
+        axis[i].grid()
+        axis[i].legend()
+    figure.tight_layout()
+    plt.close(figure)
+    return figure
+
+def mixture_answer_rectangle(minima: list, list_calibration: list, solution: dict, dict_selected_peak_index: dict) -> dict[str, list[tuple]]:
+    """ (x, y, width, height) of every calibration's stacked contribution on the selected peaks, per channel. """
+    dict_rectangle = {}
+    for color in 'RGB':
+        color_solution = solution.get(color, solution.get('RGB'))
+        dict_rectangle[color] = []
+        for peak_index in dict_selected_peak_index.get(color, []):
+            x_start = minima[peak_index-1]
+            y_start = 0
+            width = minima[peak_index] - minima[peak_index-1]
+            for calibration_object in list_calibration:
+                concentration = color_solution[calibration_object.name]
+                coef, const = calibration_object.peaks[peak_index-1].best_fit_line[color]
+                height = (coef*concentration + const) // width
+                dict_rectangle[color].append((x_start, y_start, width, height))
+                y_start += height
+    return dict_rectangle
+
+def plot_mixture_answer(intensity: dict, minima: list, list_calibration: list, solution: dict, dict_selected_peak_index: dict):
+    """ Intensity curves with the solved contribution of each calibration stacked on the selected peaks. """
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+    x = np.arange(0, len(intensity['R']))
+    figure, axis = plt.subplots(nrows=3, ncols=1, figsize=(4, 12))
+    rgb = ['Red', 'Green', 'Blue']
+    dict_rectangle = mixture_answer_rectangle(minima, list_calibration, solution, dict_selected_peak_index)
+    for i, color in enumerate('RGB'):
+        axis[i].plot(x, intensity[color], color=rgb[i])
+        axis[i].scatter(minima, np.take(intensity[color], minima))
+        for x_start, y_start, width, height in dict_rectangle[color]:
+            axis[i].add_patch(patches.Rectangle((x_start, y_start), width=width, height=height))
+        axis[i].set_title(f'{rgb[i]} Intensity')
+        axis[i].set_xlabel('Pixel')
+        axis[i].set_ylabel('Intensity')
+        axis[i].set_ylim((0, 255))
+    figure.tight_layout()
+    plt.close(figure)
+    return figure
+
+class IntensityPanel:
+    """ The three channel axes of an intensity figure, kept alive and updated in place.
+
+    The curve, minima markers and rectangles of each channel are single artists whose data is
+    replaced by update(), so showing another profile costs a redraw of those artists only
+    (see ui.plot_canvas.IntensityCanvas) instead of building a new figure.
+    """
+    def __init__(self, figure, grid: bool = True):
+        from matplotlib.collections import PolyCollection
+        rgb = ['Red', 'Green', 'Blue']
+        self.figure = figure
+        self.axis = figure.subplots(nrows=3, ncols=1)
+        self.line, self.marker, self.rectangle = [], [], []
+        self.length = None
+        for i, axis in enumerate(self.axis):
+            # Same drawing order as plot_mixture_answer: markers, then rectangles, then the curve
+            self.marker.append(axis.scatter([], [], color='C0', animated=True))
+            self.rectangle.append(axis.add_collection(PolyCollection([], facecolor='C0', edgecolor='none', animated=True)))
+            self.line.append(axis.plot([], [], color=rgb[i], animated=True)[0])
+            axis.set_title(f'{rgb[i]} Intensity')
+            axis.set_xlabel('Pixel')
+            axis.set_ylabel('Intensity')
+            axis.set_ylim((0, 255))
+            if grid:
+                axis.grid()
+
+    @property
+    def artists(self) -> list:
+        return [artist for i in range(3) for artist in (self.marker[i], self.rectangle[i], self.line[i])]
+
+    def update(self, intensity: dict, minima: list, dict_rectangle: dict = None) -> bool:
+        """ Show another profile; True when the pixel axis changed and the static parts must be redrawn too. """
+        length = len(intensity['R'])
+        x = np.arange(length)
+        minima = np.asarray(minima, dtype=np.intp)
+        for i, color in enumerate('RGB'):
+            self.line[i].set_data(x, intensity[color])
+            self.marker[i].set_offsets(np.column_stack([minima, np.take(intensity[color], minima)]).reshape(-1, 2))
+            list_rectangle = [] if dict_rectangle is None else dict_rectangle[color]
+            self.rectangle[i].set_verts([[(x0, y0), (x0 + w, y0), (x0 + w, y0 + h), (x0, y0 + h)] for x0, y0, w, h in list_rectangle])
+        if length == self.length:
+            return False
+        self.length = length
+        # Matplotlib's default 5% data margin
+        margin = 0.05 * max(length - 1, 1)
+        for axis in self.axis:
+            axis.set_xlim((-margin, length - 1 + margin))
+        return True
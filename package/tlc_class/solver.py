@@ -0,0 +1,179 @@
+import numpy as np
+from scipy.optimize import nnls
+
+from package.tlc_class import uncertainty
+
+def select_top_peaks(list_calibration: list, peak_count: int, color: str) -> list[int]:
+    """ 1-based indices of the len(list_calibration) peaks among the first peak_count with the highest mean r² across calibrations. """
+    peak_r2_values = []
+    for peak_index in range(peak_count):
+        avg_r2 = np.mean([calibration.peaks[peak_index].r2[color] for calibration in list_calibration])
+        # NaN (e.g. from a model file saved before R² was stored as -inf) would break the sort
+        peak_r2_values.append((peak_index + 1, np.nan_to_num(avg_r2, nan=-np.inf)))
+    sorted_peaks = sorted(peak_r2_values, key=lambda x: x[1], reverse=True)
+    return [peak[0] for peak in sorted_peaks[:len(list_calibration)]]
+
+def build_coefficient(list_calibration: list, dict_peak_index: dict[str, list[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """ Slopes (n_color, n_peak, n_calibration) and summed intercepts (n_color, n_peak) of the system, see build_system. """
+    colors = list(dict_peak_index.keys())
+    n_peak = len(dict_peak_index[colors[0]])
+    coefficient = np.empty((len(colors), n_peak, len(list_calibration)), dtype=np.float64)
+    constant = np.zeros((len(colors), n_peak), dtype=np.float64)
+    for i, color in enumerate(colors):
+        for j, peak_index in enumerate(dict_peak_index[color]):
+            for k, calibration in enumerate(list_calibration):
+                coef, const = calibration.peaks[peak_index-1].best_fit_line[color]
+                coefficient[i, j, k] = coef
+                constant[i, j] += const
+    return coefficient, constant
+
+def build_system(list_calibration: list, mixture_peak_area: dict, dict_peak_index: dict[str, list[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """ Build the stacked linear system A x = b for every colour in dict_peak_index.
+
+    A has shape (n_color, n_peak, n_calibration) and holds the slopes of each calibration's
+    best fit line. b has shape (n_color, n_peak) and holds the mixture peak area minus the
+    summed intercepts. Peak indices are 1-based like MixtureHack.list_selected_peak_index.
+    """
+    coefficient, constant = build_coefficient(list_calibration, dict_peak_index)
+    area = np.array([[mixture_peak_area[color][peak_index-1] for peak_index in list_peak_index] for color, list_peak_index in dict_peak_index.items()], dtype=np.float64)
+    return coefficient, area - constant
+
+def stack_channels(coefficient: np.ndarray, target: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ Merge the colour axis into the equation axis so all channels are solved together. """
+    n_color, n_peak, n_variable = coefficient.shape
+    return coefficient.reshape(1, n_color * n_peak, n_variable), target.reshape(1, n_color * n_peak)
+
+def condition_number(coefficient: np.ndarray) -> np.ndarray:
+    singular_value = np.linalg.svd(coefficient, compute_uv=False)
+    with np.errstate(divide='ignore'):
+        return singular_value[..., 0] / singular_value[..., -1]
+
+def factorize(coefficient: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ SVD of a batch of systems with the small singular values cut off: u, 1/s (0 past the cutoff), vt and condition number. """
+    u, s, vt = np.linalg.svd(coefficient, full_matrices=False)
+    cutoff = np.finfo(np.float64).eps * max(coefficient.shape[-2:]) * s[..., :1]
+    s_inverse = np.divide(1.0, s, out=np.zeros_like(s), where=s > cutoff)
+    with np.errstate(divide='ignore'):
+        condition = s[..., 0] / s[..., -1]
+    return u, s_inverse, vt, condition
+
+def solve_least_squares(coefficient: np.ndarray, target: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Minimum-norm least squares for a batch of systems in one SVD call.
+
+    Works for square, overdetermined, underdetermined and singular systems.
+    Returns (solution, residual, condition_number) with solution shaped (batch, n_variable)
+    and residual the sum of squared errors of each system.
+    """
+    u, s_inverse, vt, condition = factorize(coefficient)
+    projection = np.einsum('bpk,bp->bk', u, target) * s_inverse
+    solution = np.einsum('bkv,bk->bv', vt, projection)
+    residual = __residual(coefficient, target, solution)
+    return solution, residual, condition
+
+def solve_nonnegative(coefficient: np.ndarray, target: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Non-negative least squares (concentrations cannot be negative), same outputs as solve_least_squares. """
+    solution = np.array([nnls(a, b)[0] for a, b in zip(coefficient, target)])
+    return solution, __residual(coefficient, target, solution), condition_number(coefficient)
+
+def solve(coefficient: np.ndarray, target: np.ndarray, method: str = 'lstsq') -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if method == 'lstsq':
+        return solve_least_squares(coefficient, target)
+    elif method == 'nnls':
+        return solve_nonnegative(coefficient, target)
+    raise ValueError(f"Unknown solver method '{method}', expected 'lstsq' or 'nnls'")
+
+def __residual(coefficient: np.ndarray, target: np.ndarray, solution: np.ndarray) -> np.ndarray:
+    error = np.einsum('bpv,bv->bp', coefficient, solution) - target
+    return np.sum(error * error, axis=-1)
+
+class CalibrationSolver:
+    """ Solve many mixtures against one set of calibrations, factoring each system only once.
+
+    The peaks a mixture is solved with only depend on the calibrations and on how many peaks
+    the mixture shares with them, so the slopes, intercepts and SVD of every such system are
+    built on first use and cached. A batch of mixtures is then two matrix products per system.
+    method and stacked have the meaning of MixtureHack.solve_all; 'nnls' reuses the cached
+    systems but still runs one iterative solve per mixture.
+    """
+    def __init__(self, list_calibration: list, method: str = 'lstsq', stacked: bool = False):
+        if method not in ('lstsq', 'nnls'):
+            raise ValueError(f"Unknown solver method '{method}', expected 'lstsq' or 'nnls'")
+        self.list_calibration = list_calibration
+        self.method = method
+        self.stacked = stacked
+        self.list_color = ['RGB'] if stacked else list('RGB')
+        self.peak_count = min((len(calibration.peaks) for calibration in list_calibration), default=0)
+        self.__system = {}
+        self.__draw = {}
+    
+    def selected_peak_index(self, peak_count: int) -> dict[str, list[int]]:
+        """ Selected 1-based peak indices per colour for mixtures with peak_count peaks. """
+        return self.__get_system(peak_count)[0]
+    
+    def solve(self, peak_area: dict[str, np.ndarray]) -> tuple[dict[str, list[int]], np.ndarray, np.ndarray, np.ndarray]:
+        """ Solve a batch of mixtures given as one (n_mixture, n_peak) array of peak areas per colour.
+
+        Returns the selected peak indices per colour, solutions shaped (n_mixture, n_system,
+        n_calibration), residuals shaped (n_mixture, n_system) and the condition number of every
+        system, where the systems are R, G and B, or one 'RGB' system when stacked.
+        """
+        area = np.stack([np.asarray(peak_area[color], dtype=np.float64) for color in 'RGB'], axis=1)
+        dict_peak_index, coefficient, constant, factor = self.__get_system(area.shape[-1])
+        if not dict_peak_index['R']:
+            return dict_peak_index, np.empty((len(area), len(self.list_color), 0)), np.empty((len(area), len(self.list_color))), np.empty(len(self.list_color))
+        target = self.__select_area(area, dict_peak_index) - constant
+        u, s_inverse, vt, condition = factor
+        if self.method == 'lstsq':
+            solution = np.einsum('cpk,ncp->nck', u, target) * s_inverse
+            solution = np.einsum('ckv,nck->ncv', vt, solution)
+        else:
+            solution = np.array([[nnls(a, b)[0] for a, b in zip(coefficient, row)] for row in target]).reshape(len(area), len(self.list_color), -1)
+        error = np.einsum('cpv,ncv->ncp', coefficient, solution) - target
+        return dict_peak_index, solution, np.sum(error * error, axis=-1), condition
+    
+    def estimate_uncertainty(self, peak_area: dict[str, np.ndarray], draw_count: int = uncertainty.DRAW_COUNT, confidence: float = uncertainty.CONFIDENCE, seed: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Monte Carlo robust standard deviation and confidence interval (low, high) of a batch of solutions, see uncertainty.draw_system and uncertainty.interval.
+
+        Every calibration line and mixture peak area is perturbed draw_count times and each
+        draw is solved by least squares, also when method is 'nnls'. The draws of a peak
+        count are made and factored once per seed, so only the final products scale with
+        the number of mixtures. Arrays are shaped like the solutions of solve().
+        """
+        area = np.stack([np.asarray(peak_area[color], dtype=np.float64) for color in 'RGB'], axis=1)
+        dict_peak_index = self.__get_system(area.shape[-1])[0]
+        shape = (len(area), len(self.list_color), len(self.list_calibration) if dict_peak_index['R'] else 0)
+        std, low, high = np.empty(shape), np.empty(shape), np.empty(shape)
+        if not dict_peak_index['R']:
+            return std, low, high
+        inverse, offset = self.__get_draw(area.shape[-1], draw_count, seed)
+        target = self.__select_area(area, dict_peak_index)
+        chunk = uncertainty.chunk_count(draw_count, shape[1] * shape[2])
+        for start in range(0, len(area), chunk):
+            sample = uncertainty.solve_draws(inverse, offset, target[start:start+chunk])
+            std[start:start+chunk], low[start:start+chunk], high[start:start+chunk] = uncertainty.interval(sample, confidence)
+        return std, low, high
+    
+    def __select_area(self, area: np.ndarray, dict_peak_index: dict[str, list[int]]) -> np.ndarray:
+        """ Areas (n_mixture, n_system, n_equation) of the selected peaks from (n_mixture, colour, peak) areas. """
+        target = np.stack([area[:, i, np.array(dict_peak_index[color]) - 1] for i, color in enumerate('RGB')], axis=1)
+        return target.reshape(len(area), len(self.list_color), -1)
+    
+    def __get_draw(self, peak_count: int, draw_count: int, seed: int) -> tuple:
+        key = (min(peak_count, self.peak_count), draw_count, seed)
+        if key not in self.__draw:
+            coefficient, constant, area_noise = uncertainty.draw_system(self.list_calibration, self.__get_system(peak_count)[0], self.stacked, draw_count, np.random.default_rng(seed))
+            self.__draw[key] = uncertainty.prepare_draws(factorize(coefficient), constant, area_noise)
+        return self.__draw[key]
+    
+    def __get_system(self, peak_count: int) -> tuple:
+        peak_count = min(peak_count, self.peak_count)
+        if peak_count not in self.__system:
+            dict_peak_index = {color: select_top_peaks(self.list_calibration, peak_count, color) for color in 'RGB'}
+            coefficient, constant, factor = None, None, None
+            if dict_peak_index['R']:
+                coefficient, constant = build_coefficient(self.list_calibration, dict_peak_index)
+                if self.stacked:
+                    coefficient, constant = stack_channels(coefficient, constant)
+                factor = factorize(coefficient)
+            self.__system[peak_count] = (dict_peak_index, coefficient, constant, factor)
+        return self.__system[peak_count]
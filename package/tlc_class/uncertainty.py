@@ -0,0 +1,110 @@
+from statistics import NormalDist
+
+import numpy as np
+
+from package.tlc_class import fitting
+
+DRAW_COUNT = 2000
+CONFIDENCE = 0.95
+# Largest (mixture, draw, solution) block solved at once, 32 MB of float64
+CHUNK_SIZE = 2 ** 22
+
+def line_covariance(list_calibration: list, dict_peak_index: dict[str, list[int]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Stored lines, their (slope, intercept) covariance and residual variance per colour, selected peak and calibration.
+
+    Shapes are (n_color, n_peak, n_calibration, 2), (..., 2, 2) and (...). The covariance is the
+    ordinary least-squares one, s² (XᵀX)⁻¹, with s² the residual variance of the stored line
+    over its n - 2 degrees of freedom, also for lines fitted with weights or a robust method.
+    Lines with two points or fewer carry no residual information and get zero covariance.
+    """
+    colors = list(dict_peak_index.keys())
+    shape = (len(colors), len(dict_peak_index[colors[0]]), len(list_calibration))
+    line = np.zeros(shape + (2,))
+    covariance = np.zeros(shape + (2, 2))
+    variance = np.zeros(shape)
+    for k, calibration in enumerate(list_calibration):
+        list_peak = [calibration.peaks[peak_index-1] for color in colors for peak_index in dict_peak_index[color]]
+        list_color = [color for color in colors for _ in dict_peak_index[color]]
+        if not list_peak:
+            continue
+        x, y, valid = fitting.stack_peak_area([peak.peak_area[color] for peak, color in zip(list_peak, list_color)], calibration.concentration)
+        x = np.where(valid, x, 0.0)
+        slope_intercept = np.array([peak.best_fit_line[color] for peak, color in zip(list_peak, list_color)], dtype=np.float64)
+        residual = np.where(valid, y - slope_intercept[:, :1] * x - slope_intercept[:, 1:], 0.0)
+        count = valid.sum(axis=-1)
+        residual_variance = np.where(count > 2, (residual * residual).sum(axis=-1) / np.maximum(count - 2, 1), 0.0)
+        sum_xx, sum_x = (x * x).sum(axis=-1), x.sum(axis=-1)
+        determinant = sum_xx * count - sum_x * sum_x
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(determinant > 0, residual_variance / determinant, 0.0)
+        line[:, :, k] = slope_intercept.reshape(shape[:2] + (2,))
+        covariance[:, :, k] = (scale[:, None, None] * np.stack([np.stack([count, -sum_x], -1), np.stack([-sum_x, sum_xx], -1)], -2)).reshape(shape[:2] + (2, 2))
+        variance[:, :, k] = residual_variance.reshape(shape[:2])
+    return line, covariance, variance
+
+def draw_system(list_calibration: list, dict_peak_index: dict[str, list[int]], stacked: bool = False, draw_count: int = DRAW_COUNT, rng: np.random.Generator = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ draw_count perturbed systems with every calibration line drawn from its fit covariance.
+
+    Returns slopes (draw, n_system, n_equation, n_calibration), summed intercepts and the
+    noise to add to the mixture peak areas, both (draw, n_system, n_equation). The area noise
+    is normal with the root mean residual variance of the calibrations at that peak: their
+    scatter around the line is the spot-to-spot area noise of a plate. The same draws serve
+    every mixture, so a mixture's interval does not depend on what it is batched with.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    line, covariance, variance = line_covariance(list_calibration, dict_peak_index)
+    # Closed-form Cholesky factor of every 2x2 covariance, clamped for the degenerate ones
+    l00 = np.sqrt(np.maximum(covariance[..., 0, 0], 0))
+    l10 = np.divide(covariance[..., 1, 0], l00, out=np.zeros_like(l00), where=l00 > 0)
+    l11 = np.sqrt(np.maximum(covariance[..., 1, 1] - l10 * l10, 0))
+    z = rng.standard_normal((2, draw_count) + l00.shape)
+    coefficient = line[..., 0] + l00 * z[0]
+    constant = (line[..., 1] + l10 * z[0] + l11 * z[1]).sum(axis=-1)
+    area_noise = np.sqrt(variance.mean(axis=-1)) * rng.standard_normal(constant.shape)
+    if stacked:
+        coefficient = coefficient.reshape(draw_count, 1, -1, coefficient.shape[-1])
+        constant = constant.reshape(draw_count, 1, -1)
+        area_noise = area_noise.reshape(draw_count, 1, -1)
+    return coefficient, constant, area_noise
+
+def prepare_draws(factor: tuple, constant: np.ndarray, area_noise: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ Pseudo-inverse (n_system, n_calibration, draw, n_equation) and offset (n_system, n_calibration, draw) of every drawn system.
+
+    factor is solver.factorize of the drawn slopes. A solution is linear in the mixture areas,
+    x = P (a + noise - constant), so P and the offset P (noise - constant) are computed once
+    and a batch of mixtures costs one matrix product per system.
+    """
+    u, s_inverse, vt, _ = factor
+    inverse = np.einsum('dskv,dsk,dsek->svde', vt, s_inverse, u, optimize=True)
+    offset = np.einsum('svde,dse->svd', inverse, area_noise - constant)
+    return np.ascontiguousarray(inverse), offset
+
+def solve_draws(inverse: np.ndarray, offset: np.ndarray, area: np.ndarray) -> np.ndarray:
+    """ Least-squares solutions (n_mixture, n_system, n_calibration, draw) of every drawn system for the (n_mixture, n_system, n_equation) peak areas. """
+    n_system, n_calibration, draw_count, n_equation = inverse.shape
+    sample = np.empty((len(area), n_system, n_calibration, draw_count))
+    for s in range(n_system):
+        sample[:, s] = (area[:, s] @ inverse[s].reshape(-1, n_equation).T).reshape(len(area), n_calibration, draw_count)
+    return sample + offset
+
+def interval(sample: np.ndarray, confidence: float = CONFIDENCE) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Robust standard deviation and central confidence interval (low, high) of the samples along the last axis.
+
+    The bounds are np.quantile's linear ones, read from one sort, which is faster than the
+    partitions np.quantile does for a few thousand draws. The standard deviation is the one
+    of a normal distribution with the same interval, (high - low) / (2 z): the few draws of
+    a near-singular system would dominate the sample standard deviation.
+    """
+    ordered = np.sort(sample, axis=-1)
+    bound = []
+    for quantile in ((1 - confidence) / 2, (1 + confidence) / 2):
+        position = (sample.shape[-1] - 1) * quantile
+        index = int(position)
+        upper = min(index + 1, sample.shape[-1] - 1)
+        bound.append(ordered[..., index] + (position - index) * (ordered[..., upper] - ordered[..., index]))
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return (bound[1] - bound[0]) / (2 * z), bound[0], bound[1]
+
+def chunk_count(draw_count: int, solution_count: int) -> int:
+    """ Mixtures solved per block so that a block stays within CHUNK_SIZE values. """
+    return max(1, CHUNK_SIZE // max(1, draw_count * solution_count))
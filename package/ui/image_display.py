@@ -0,0 +1,65 @@
+import weakref
+from collections import OrderedDict
+import numpy as np
+import cv2
+from PySide6.QtGui import QImage, QPixmap
+
+DISPLAY_WIDTH = 500
+MAX_THUMBNAILS = 64
+
+def to_qpixmap(image: np.ndarray, width: int = DISPLAY_WIDTH) -> QPixmap:
+    """ BGR (or grayscale) image resized to width and handed to Qt as is.
+
+    The image is resized first, so only display-sized pixels are converted, and the QImage
+    is a BGR888 view over the NumPy buffer, so there is no RGB swap or PIL round trip.
+    QPixmap.fromImage makes the one copy Qt needs while the buffer is still alive.
+    """
+    if image.shape[1] != width:
+        height = max(1, round(image.shape[0] * width / image.shape[1]))
+        interpolation = cv2.INTER_AREA if image.shape[1] > width else cv2.INTER_LINEAR
+        image = cv2.resize(image, (width, height), interpolation=interpolation)
+    image = np.ascontiguousarray(image)
+    image_format = QImage.Format_BGR888 if image.ndim == 3 else QImage.Format_Grayscale8
+    qimage = QImage(image.data, image.shape[1], image.shape[0], image.strides[0], image_format)
+    return QPixmap.fromImage(qimage)
+
+class ThumbnailCache:
+    """ Bounded LRU of display pixmaps keyed by (owner, image name).
+
+    Works like plot.FigureCache: entries are dropped when the cache is full or their owner
+    is garbage collected, so compact objects only re-read their pixels the first time an
+    image is shown.
+    """
+    def __init__(self, max_thumbnails: int = MAX_THUMBNAILS, width: int = DISPLAY_WIDTH):
+        self.max_thumbnails = max_thumbnails
+        self.width = width
+        self.thumbnails = OrderedDict()
+        self.owners = set()
+
+    def get(self, owner, name: str) -> QPixmap:
+        """ Cached pixmap, or None on a miss. """
+        key = (id(owner), name)
+        if key not in self.thumbnails:
+            return None
+        self.thumbnails.move_to_end(key)
+        return self.thumbnails[key]
+
+    def put(self, owner, name: str, image: np.ndarray) -> QPixmap:
+        if id(owner) not in self.owners:
+            self.owners.add(id(owner))
+            weakref.finalize(owner, self.discard_owner, id(owner))
+        pixmap = to_qpixmap(image, self.width)
+        self.thumbnails[(id(owner), name)] = pixmap
+        while len(self.thumbnails) > self.max_thumbnails:
+            self.thumbnails.popitem(last=False)
+        return pixmap
+
+    def discard_owner(self, owner_id: int):
+        self.owners.discard(owner_id)
+        for key in [key for key in self.thumbnails if key[0] == owner_id]:
+            del self.thumbnails[key]
+
+    def clear(self):
+        self.thumbnails.clear()
+
+thumbnail_cache = ThumbnailCache()
@@ -0,0 +1,35 @@
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from matplotlib.figure import Figure
+
+from package.tlc_class import plot
+
+class IntensityCanvas(FigureCanvasQTAgg):
+    """ One persistent intensity figure per panel, redrawn by blitting when only the data changes.
+
+    The axes, labels and grid are rendered once into a cached background; a new profile of
+    the same length restores that background and draws the curves, markers and rectangles
+    on top. A profile of another length rescales the pixel axis and does a full redraw.
+    """
+    def __init__(self, figsize: tuple = (4, 12), grid: bool = True):
+        figure = Figure(figsize=figsize, layout='tight')
+        super().__init__(figure)
+        self.panel = plot.IntensityPanel(figure, grid)
+        self.background = None
+        self.mpl_connect('draw_event', self.__on_draw)
+
+    def show_profile(self, intensity: dict, minima: list, dict_rectangle: dict = None):
+        if self.panel.update(intensity, minima, dict_rectangle) or self.background is None:
+            self.draw_idle()
+            return
+        self.restore_region(self.background)
+        self.__draw_artists()
+        self.blit(self.figure.bbox)
+
+    def __on_draw(self, event):
+        """ Cache the static parts after every full draw (also on resize), then add the data. """
+        self.background = self.copy_from_bbox(self.figure.bbox)
+        self.__draw_artists()
+
+    def __draw_artists(self):
+        for artist in self.panel.artists:
+            self.figure.draw_artist(artist)
@@ -1,18 +1,30 @@
 from PySide6.QtCore import Qt, Signal
-from PySide6.QtGui import QPixmap
-from PySide6.QtWidgets import QWidget, QListWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QFileDialog, QLineEdit, QTreeWidget, QTreeWidgetItem
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from PySide6.QtWidgets import QWidget, QListWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QFileDialog, QCheckBox, QLineEdit, QTreeWidget, QTreeWidgetItem
 
 from package.image_processing.image_processing import read_image
-from package.tlc_class.calibration import Calibration
+from package.image_processing.cache import PreprocessingCache
+from package.image_processing.instrument import StageRecorder, format_summary
+from package.tlc_class.calibration import Calibration, MODEL_EXTENSION
+from package.ui.worker import WorkerBatch, thread_context
+from package.ui.widget_progress import WidgetProgress
+from package.ui.image_display import thumbnail_cache
+from package.ui.plot_canvas import IntensityCanvas
 
-from PIL.ImageQt import ImageQt
-from PIL import Image
-import numpy as np
-import cv2
+import contextlib
+import os
 import matplotlib
 matplotlib.use('Qt5Agg')
 
+def load_calibration(name: str, path: str, concentration: list[float], cache: PreprocessingCache, profile: bool) -> tuple[Calibration, dict]:
+    """ Calibrate an image, or load a saved model file (which keeps its own concentrations). """
+    with StageRecorder() if profile else contextlib.nullcontext() as recorder:
+        if path.lower().endswith(MODEL_EXTENSION):
+            calibration_object = Calibration.load(path, cache=cache)
+            calibration_object.set_name(name)
+        else:
+            calibration_object = Calibration(name, read_image(path), concentration, cache=cache, compact=True, source_path=path, context=thread_context())
+    return calibration_object, recorder.summary() if recorder is not None else None
+
 class WidgetCalibration(QWidget):
     data_sent = Signal(dict)
 
@@ -20,6 +32,9 @@ class WidgetCalibration(QWidget):
         super().__init__()
         self.dict_input_path = {}
         self.dict_calibration_object = {}
+        self.dict_stage_summary = {}
+        self.cache = PreprocessingCache()
+        self.batch = None
         self.init_main_layout()
         
     def init_main_layout(self):
@@ -27,6 +42,8 @@ class WidgetCalibration(QWidget):
         self.init_left_layout()
         self.init_middle_layout()
         self.v_layout_right = QVBoxLayout()
+        self.canvas_intensity = IntensityCanvas()
+        self.v_layout_right.addWidget(self.canvas_intensity)
         self.main_layout.addLayout(self.v_layout_left, 1)
         self.main_layout.addLayout(self.v_layout_middle, 2)
         self.main_layout.addLayout(self.v_layout_right, 2)
@@ -44,7 +61,12 @@ class WidgetCalibration(QWidget):
         button_calibrate.clicked.connect(self.calibrate_image)
         h_layout_button.addWidget(button_upload)
         h_layout_button.addWidget(button_delete)
+        button_save = QPushButton("Save")
+        button_save.clicked.connect(self.save_calibration)
         h_layout_button.addWidget(button_calibrate)
+        h_layout_button.addWidget(button_save)
+        self.check_box_profile = QCheckBox("Profile")
+        h_layout_button.addWidget(self.check_box_profile)
         # Concentration Input
         h_layout_concentration = QHBoxLayout()
         label_concentration = QLabel("Concentration: ")
@@ -52,6 +74,8 @@ class WidgetCalibration(QWidget):
         self.line_edit_concentration.setText("5 8.33 16.67 33.33 50 66.67 83.33 100")
         h_layout_concentration.addWidget(label_concentration)
         h_layout_concentration.addWidget(self.line_edit_concentration)
+        # Progress
+        self.widget_progress = WidgetProgress()
         # Input Path
         self.list_widget_input_path = QListWidget()
         # Calibration Data
@@ -61,6 +85,7 @@ class WidgetCalibration(QWidget):
         self.tree_widget_calibration_data.itemClicked.connect(self.show_calibration_data)
         self.v_layout_left.addLayout(h_layout_button)
         self.v_layout_left.addLayout(h_layout_concentration)
+        self.v_layout_left.addWidget(self.widget_progress)
         self.v_layout_left.addWidget(self.list_widget_input_path, 1)
         self.v_layout_left.addWidget(self.tree_widget_calibration_data, 4)
         
@@ -83,13 +108,22 @@ class WidgetCalibration(QWidget):
         self.v_layout_middle.addWidget(self.label_peak_data, 1)
     
     def upload_image(self):
-        files, _ = QFileDialog.getOpenFileNames(self, "Open file", "C:\\Users\\Suttawee\\Desktop\\TLC\\Input", "Image files (*.png *.jpg *.gif *.svg)")
+        files, _ = QFileDialog.getOpenFileNames(self, "Open file", "C:\\Users\\Suttawee\\Desktop\\TLC\\Input", "Image files (*.png *.jpg *.gif *.svg);;Calibration models (*.npz)")
         for path in files:
             image_name = path.split('/')[-1]
             self.dict_input_path[image_name] = path
             self.list_widget_input_path.addItem(image_name)
             self.dict_calibration_object[image_name] = None
 
+    def save_calibration(self):
+        """ Write every finished calibration as a model file that can be uploaded instead of its image. """
+        directory = QFileDialog.getExistingDirectory(self, "Save calibration models")
+        if not directory:
+            return
+        for name, calibration_object in self.dict_calibration_object.items():
+            if calibration_object is not None:
+                calibration_object.save(os.path.join(directory, os.path.splitext(name)[0] + MODEL_EXTENSION))
+
     def delete_image(self):
         image_name = self.list_widget_input_path.currentItem().text()
         self.dict_calibration_object.pop(image_name)
@@ -97,53 +131,71 @@ class WidgetCalibration(QWidget):
         self.list_widget_input_path.takeItem(self.list_widget_input_path.currentRow())
 
     def calibrate_image(self):
+        self.widget_progress.cancel()
         self.tree_widget_calibration_data.clear()
         concentration = [float(c) for c in self.line_edit_concentration.text().split(' ')]
 
-        items = []
+        self.batch = WorkerBatch(self)
+        self.batch.result_ready.connect(self.on_calibration_ready)
+        self.batch.error.connect(self.on_calibration_error)
         for name, path in self.dict_input_path.items():
-            image = read_image(path)
-            calibration_object = Calibration(name, image, concentration)
-            self.dict_calibration_object[name] = calibration_object
+            self.dict_calibration_object[name] = None
+            self.batch.submit(name, load_calibration, name, path, concentration, self.cache, self.check_box_profile.isChecked())
+        self.widget_progress.track(self.batch)
+        self.batch.start()
 
-            item = QTreeWidgetItem([name])
-            for peak in range(len(calibration_object.peaks)):
-                child = QTreeWidgetItem([f"Peak {peak+1}"])
-                item.addChild(child)
-            items.append(item)
-            self.tree_widget_calibration_data.addTopLevelItems(items)
+    def on_calibration_ready(self, name: str, result: tuple[Calibration, dict]):
+        if name not in self.dict_input_path:
+            return
+        calibration_object, self.dict_stage_summary[name] = result
+        self.dict_calibration_object[name] = calibration_object
+
+        item = QTreeWidgetItem([name])
+        for peak in range(len(calibration_object.peaks)):
+            child = QTreeWidgetItem([f"Peak {peak+1}"])
+            item.addChild(child)
+        self.tree_widget_calibration_data.addTopLevelItem(item)
 
         # Send Signal
-        self.data_sent.emit(self.dict_calibration_object)
+        self.data_sent.emit({name: calibration for name, calibration in self.dict_calibration_object.items() if calibration is not None})
+
+    def on_calibration_error(self, name: str, message: str):
+        self.tree_widget_calibration_data.addTopLevelItem(QTreeWidgetItem([f"{name} (failed: {message})"]))
         
     def show_calibration_data(self, item, column):
+        if item.parent() is None:
+            return
         name = item.parent().text(column)
         peak_index = int(item.text(column).split(' ')[1]) - 1
         calibration_object = self.dict_calibration_object[name]
-        
-        pix = self.__convert_cv2_to_qpixmap(calibration_object.image)
-        self.label_image_original.setPixmap(pix)
-
-        pix = self.__convert_cv2_to_qpixmap(calibration_object.processed_image_full)
-        self.label_image_processed.setPixmap(pix)
-
-        pix = self.__convert_cv2_to_qpixmap(calibration_object.peaks[peak_index].image)
-        self.label_image_peak.setPixmap(pix)
+        try:
+            list_pixmap = self.__calibration_pixmap(calibration_object, peak_index)
+        except FileNotFoundError:
+            # A model file whose source image has moved still has its numbers and plots
+            for label in [self.label_image_original, self.label_image_processed, self.label_image_peak]:
+                label.clear()
+        else:
+            for label, pixmap in zip([self.label_image_original, self.label_image_processed, self.label_image_peak], list_pixmap):
+                label.setPixmap(pixmap)
         
         data_peak_area = calibration_object.peaks[peak_index].peak_area
         data_best_fit_line = calibration_object.peaks[peak_index].best_fit_line
         data_calibration = f"Calibration: {name}\nPeak: {peak_index+1}\nPeak Area:\n\tR: {data_peak_area['R']}\n\tG: {data_peak_area['G']}\n\tB: {data_peak_area['B']}\nBest Fit Line:\n\tR: {data_best_fit_line['R']}\n\tG: {data_best_fit_line['G']}\n\tB: {data_best_fit_line['B']}"
+        if self.dict_stage_summary.get(name):
+            data_calibration += f"\n\n{format_summary(self.dict_stage_summary[name])}"
         self.label_peak_data.setText(data_calibration)
         
-        plot = calibration_object.peaks[peak_index].plot_intensity
-        if self.v_layout_right.count() != 0:
-            canvas = self.v_layout_right.takeAt(0)
-            canvas.widget().deleteLater()
-        canvas_best_fit_line = FigureCanvasQTAgg(plot)
-        self.v_layout_right.addWidget(canvas_best_fit_line)
+        self.canvas_intensity.show_profile(calibration_object.peaks[peak_index].intensity, calibration_object.peaks[peak_index].minima)
 
-    def __convert_cv2_to_qpixmap(self, cv_image: np.ndarray):
-        rgb_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
-        PIL_image = Image.fromarray(rgb_image).convert('RGB')
-        pix = QPixmap.fromImage(ImageQt(PIL_image))
-        return pix.scaledToWidth(500)
\ No newline at end of file
+    def __calibration_pixmap(self, calibration_object: Calibration, peak_index: int) -> list:
+        """ Thumbnails of the plate, the annotated plate and one peak; a miss renders the calibration once and caches every peak. """
+        list_name = ['original', 'processed', f'peak{peak_index}']
+        list_pixmap = [thumbnail_cache.get(calibration_object, name) for name in list_name]
+        if None not in list_pixmap:
+            return list_pixmap
+        image, image_processed, list_image_peak = calibration_object.render()
+        thumbnail_cache.put(calibration_object, 'original', image)
+        thumbnail_cache.put(calibration_object, 'processed', image_processed)
+        for i, image_peak in enumerate(list_image_peak):
+            thumbnail_cache.put(calibration_object, f'peak{i}', image_peak)
+        return [thumbnail_cache.get(calibration_object, name) for name in list_name]
\ No newline at end of file
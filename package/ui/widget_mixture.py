@@ -1,18 +1,25 @@
 from PySide6.QtCore import Qt, Signal
-from PySide6.QtGui import QPixmap
-from PySide6.QtWidgets import QWidget, QListWidget, QListWidgetItem, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QFileDialog
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from PySide6.QtWidgets import QWidget, QListWidget, QListWidgetItem, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QFileDialog, QCheckBox, QDoubleSpinBox
 
+from package.image_processing import parameter
 from package.image_processing.image_processing import read_image
+from package.image_processing.cache import PreprocessingCache
+from package.image_processing.instrument import StageRecorder, format_summary
 from package.tlc_class.mixture import Mixture
+from package.ui.worker import WorkerBatch, thread_context
+from package.ui.widget_progress import WidgetProgress
+from package.ui.image_display import thumbnail_cache
+from package.ui.plot_canvas import IntensityCanvas
 
-from PIL.ImageQt import ImageQt
-from PIL import Image
-import numpy as np
-import cv2
+import contextlib
 import matplotlib
 matplotlib.use('Qt5Agg')
 
+def load_mixture(name: str, path: str, cache: PreprocessingCache, profile: bool) -> tuple[Mixture, dict]:
+    with StageRecorder() if profile else contextlib.nullcontext() as recorder:
+        mixture_object = Mixture(name, read_image(path), cache=cache, compact=True, source_path=path, context=thread_context())
+    return mixture_object, recorder.summary() if recorder is not None else None
+
 class WidgetMixture(QWidget):
     data_sent = Signal(dict)
     
@@ -20,6 +27,9 @@ class WidgetMixture(QWidget):
         super().__init__()
         self.dict_input_path = {}
         self.dict_mixture_object = {}
+        self.dict_stage_summary = {}
+        self.cache = PreprocessingCache()
+        self.batch = None
         self.init_main_layout()
         
     def init_main_layout(self):
@@ -27,6 +37,8 @@ class WidgetMixture(QWidget):
         self.init_left_layout()
         self.init_middle_layout()
         self.v_layout_right = QVBoxLayout()
+        self.canvas_intensity = IntensityCanvas()
+        self.v_layout_right.addWidget(self.canvas_intensity)
         self.main_layout.addLayout(self.v_layout_left, 1)
         self.main_layout.addLayout(self.v_layout_middle, 2)
         self.main_layout.addLayout(self.v_layout_right, 2)
@@ -45,12 +57,27 @@ class WidgetMixture(QWidget):
         h_layout_button.addWidget(button_upload)
         h_layout_button.addWidget(button_delete)
         h_layout_button.addWidget(button_calibrate)
+        self.check_box_profile = QCheckBox("Profile")
+        h_layout_button.addWidget(self.check_box_profile)
+        # Peak Detection
+        h_layout_prominence = QHBoxLayout()
+        self.spin_box_prominence = QDoubleSpinBox()
+        self.spin_box_prominence.setRange(0, 255)
+        self.spin_box_prominence.setSingleStep(0.5)
+        self.spin_box_prominence.setValue(parameter.MINIMA_PROMINENCE)
+        self.spin_box_prominence.valueChanged.connect(self.update_peak_detection)
+        h_layout_prominence.addWidget(QLabel("Minima Prominence"))
+        h_layout_prominence.addWidget(self.spin_box_prominence)
+        # Progress
+        self.widget_progress = WidgetProgress()
         # Input Path
         self.list_widget_input_path = QListWidget()
         # Mixture Data
         self.list_widget_mixture_data = QListWidget()
         self.list_widget_mixture_data.currentItemChanged.connect(self.show_mixture_data)
         self.v_layout_left.addLayout(h_layout_button)
+        self.v_layout_left.addLayout(h_layout_prominence)
+        self.v_layout_left.addWidget(self.widget_progress)
         self.v_layout_left.addWidget(self.list_widget_input_path, 1)
         self.v_layout_left.addWidget(self.list_widget_mixture_data, 4)
         
@@ -83,38 +110,56 @@ class WidgetMixture(QWidget):
         self.list_widget_input_path.takeItem(self.list_widget_input_path.currentRow())
 
     def process_image(self):
+        self.widget_progress.cancel()
         self.list_widget_mixture_data.clear()
+        self.batch = WorkerBatch(self)
+        self.batch.result_ready.connect(self.on_mixture_ready)
+        self.batch.error.connect(self.on_mixture_error)
         for name, path in self.dict_input_path.items():
-            image = read_image(path)
-            mixture_object = Mixture(name, image)
-            self.dict_mixture_object[name] = mixture_object
-            self.list_widget_mixture_data.addItem(name)
+            self.dict_mixture_object[name] = None
+            self.batch.submit(name, load_mixture, name, path, self.cache, self.check_box_profile.isChecked())
+        self.widget_progress.track(self.batch)
+        self.batch.start()
+    
+    def on_mixture_ready(self, name: str, result: tuple[Mixture, dict]):
+        if name not in self.dict_input_path:
+            return
+        mixture_object, self.dict_stage_summary[name] = result
+        if self.spin_box_prominence.value() != parameter.MINIMA_PROMINENCE:
+            mixture_object.set_peak_detection(prominence=self.spin_box_prominence.value())
+        self.dict_mixture_object[name] = mixture_object
+        self.list_widget_mixture_data.addItem(name)
         
         # Send Signal
-        self.data_sent.emit(self.dict_mixture_object)
+        self.data_sent.emit({name: mixture for name, mixture in self.dict_mixture_object.items() if mixture is not None})
+    
+    def update_peak_detection(self, prominence: float):
+        """ Re-segment every processed mixture with the new prominence; profiles are not recomputed. """
+        for mixture_object in self.dict_mixture_object.values():
+            if mixture_object is not None:
+                mixture_object.set_peak_detection(prominence=prominence)
+        self.show_mixture_data(self.list_widget_mixture_data.currentItem())
+        self.data_sent.emit({name: mixture for name, mixture in self.dict_mixture_object.items() if mixture is not None})
+    
+    def on_mixture_error(self, name: str, message: str):
+        self.label_mixture_data.setText(f"Mixture: {name}\nFailed: {message}")
     
     def show_mixture_data(self, item: QListWidgetItem):
+        if item is None:
+            return
         name = item.text()
         mixture_object = self.dict_mixture_object[name]
-        
-        pix = self.__convert_cv2_to_qpixmap(mixture_object.image)
-        self.label_image_original.setPixmap(pix)
-        
-        pix = self.__convert_cv2_to_qpixmap(mixture_object.processed_image)
-        self.label_image_processed.setPixmap(pix)
+        pixmap_original, pixmap_processed = thumbnail_cache.get(mixture_object, 'original'), thumbnail_cache.get(mixture_object, 'processed')
+        if pixmap_original is None or pixmap_processed is None:
+            image, image_processed = mixture_object.render()
+            pixmap_original = thumbnail_cache.put(mixture_object, 'original', image)
+            pixmap_processed = thumbnail_cache.put(mixture_object, 'processed', image_processed)
+        self.label_image_original.setPixmap(pixmap_original)
+        self.label_image_processed.setPixmap(pixmap_processed)
         
         data_mixture = f"Mixture: {name}\nPeak Count: {len(mixture_object.peak_area['R'])}\nPeak Area:\n\tR: {mixture_object.peak_area['R']}\n\tG: {mixture_object.peak_area['G']}\n\tB: {mixture_object.peak_area['B']}"
+        if self.dict_stage_summary.get(name):
+            data_mixture += f"\n\n{format_summary(self.dict_stage_summary[name])}"
         self.label_mixture_data.setText(data_mixture)
 
-        plot = mixture_object.plot_intensity
-        if self.v_layout_right.count() != 0:
-            canvas = self.v_layout_right.takeAt(0)
-            canvas.widget().deleteLater()
-        canvas_intensity = FigureCanvasQTAgg(plot)
-        self.v_layout_right.addWidget(canvas_intensity)
-    
-    def __convert_cv2_to_qpixmap(self, cv_image: np.ndarray):
-        rgb_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
-        PIL_image = Image.fromarray(rgb_image).convert('RGB')
-        pix = QPixmap.fromImage(ImageQt(PIL_image))
-        return pix.scaledToWidth(500)
\ No newline at end of file
+        self.canvas_intensity.show_profile(mixture_object.intensity, mixture_object.minima)
@@ -1,25 +1,36 @@
 from PySide6.QtCore import Qt, Signal
-from PySide6.QtGui import QPixmap
 from PySide6.QtWidgets import QWidget, QListWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QAbstractItemView, QDoubleSpinBox
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 
 from package.image_processing.image_processing import read_image
 from package.tlc_class.calibration import Calibration
 from package.tlc_class.mixture import Mixture
 from package.tlc_class.mixture_hack import MixtureHack
+from package.tlc_class import plot
+from package.ui.worker import WorkerBatch
+from package.ui.widget_progress import WidgetProgress
+from package.ui.plot_canvas import IntensityCanvas
 
-from PIL.ImageQt import ImageQt
-from PIL import Image 
-import cv2
 import matplotlib
 matplotlib.use('Qt5Agg')
 
+def solve_mixture(mixture: Mixture, list_calibration: list[Calibration]) -> tuple[MixtureHack, str]:
+    mixture_hack_object = MixtureHack(mixture, list_calibration)
+    log = ''
+    for color in 'RGB':
+        log += f'============ {color} Channel ============\n'
+        log += mixture_hack_object.solve_equation(color=color)
+    log += '============ Uncertainty ============\n'
+    log += mixture_hack_object.estimate_uncertainty()
+    return mixture_hack_object, log
+
 class WidgetMixtureHack(QWidget):
     def __init__(self):
         super().__init__()
         self.dict_calibration_object = {}
         self.dict_mixture_object = {}
         self.mixture_hack_object = None
+        self.batch = None
+        self.list_spinbox = []
         self.init_main_layout()
     
     def init_main_layout(self):
@@ -37,12 +48,15 @@ class WidgetMixtureHack(QWidget):
         ## Button
         button_hack = QPushButton("Calculate Concentration")
         button_hack.clicked.connect(self.calculate_concentration)
+        ## Progress
+        self.widget_progress = WidgetProgress()
         ## Mixture List Widget
         self.list_widget_mixture_object = QListWidget()
         ## Calibration List Widget
         self.list_widget_calibration_object = QListWidget()
         self.list_widget_calibration_object.setSelectionMode(QAbstractItemView.MultiSelection)
         self.v_layout_left.addWidget(button_hack)
+        self.v_layout_left.addWidget(self.widget_progress)
         self.v_layout_left.addWidget(self.list_widget_mixture_object, 1)
         self.v_layout_left.addWidget(self.list_widget_calibration_object, 1)
     
@@ -54,6 +68,8 @@ class WidgetMixtureHack(QWidget):
     def init_right_layout(self):
         self.v_layout_right = QVBoxLayout()
         self.layout_canvas = QVBoxLayout()
+        self.canvas_mixture = IntensityCanvas(grid=False)
+        self.layout_canvas.addWidget(self.canvas_mixture)
         self.layout_spinbox = QHBoxLayout()
         self.v_layout_right.addLayout(self.layout_canvas, 5)
         self.v_layout_right.addLayout(self.layout_spinbox, 1)
@@ -65,41 +81,61 @@ class WidgetMixtureHack(QWidget):
         selected_mixture_object = self.dict_mixture_object[selected_mixture_name]
         list_selected_calibration_object = [self.dict_calibration_object[name] for name in selected_calibration_name]
         
-        self.mixture_hack_object = MixtureHack(selected_mixture_object, list_selected_calibration_object)
-        log = ''
-        for color in 'RGB':
-            log += f'============ {color} Channel ============\n'
-            log += self.mixture_hack_object.solve_equation(color=color)
+        self.batch = WorkerBatch(self)
+        self.batch.result_ready.connect(self.on_solution_ready)
+        self.batch.error.connect(self.on_solution_error)
+        self.batch.submit(selected_mixture_name, solve_mixture, selected_mixture_object, list_selected_calibration_object)
+        self.widget_progress.track(self.batch)
+        self.batch.start()
+    
+    def on_solution_ready(self, name: str, result: tuple[MixtureHack, str]):
+        self.mixture_hack_object, log = result
         self.label_hack_data.setText(log)
         
-        self.mixture_hack_object.plot_answer()
-        plot = self.mixture_hack_object.plot_mixture
-        if self.layout_canvas.count() != 0:
-            canvas = self.layout_canvas.takeAt(0)
-            canvas.widget().deleteLater()
-        canvas_mixture = FigureCanvasQTAgg(plot)
-        self.layout_canvas.addWidget(canvas_mixture)
+        mixture_object = self.mixture_hack_object.mixture_object
+        dict_rectangle = plot.mixture_answer_rectangle(mixture_object.minima, self.mixture_hack_object.list_calibration_object, self.mixture_hack_object.solution, self.mixture_hack_object.dict_selected_peak_index)
+        self.canvas_mixture.show_profile(mixture_object.intensity, mixture_object.minima, dict_rectangle)
         
-        self.list_spinbox = []
-        for calibration in self.dict_calibration_object.keys():
-            label_spinbox_name = QLabel(calibration)
+        # Spinboxes are reused between solutions and hidden when there are fewer calibrations
+        list_variable = self.mixture_hack_object.list_variable
+        while len(self.list_spinbox) < len(list_variable):
+            label_spinbox_name = QLabel()
             spinbox = QDoubleSpinBox(self)
             spinbox.setRange(0, 100)
-            spinbox.setValue(self.mixture_hack_object.solution['R'][calibration])
             self.layout_spinbox.addWidget(label_spinbox_name)
             self.layout_spinbox.addWidget(spinbox)
+            self.list_spinbox.append((label_spinbox_name, spinbox))
+        for i, (label_spinbox_name, spinbox) in enumerate(self.list_spinbox):
+            visible = i < len(list_variable)
+            label_spinbox_name.setVisible(visible)
+            spinbox.setVisible(visible)
+            if visible:
+                label_spinbox_name.setText(list_variable[i])
+                spinbox.setValue(self.mixture_hack_object.solution['R'][list_variable[i]])
+                uncertainty = self.mixture_hack_object.uncertainty.get('R', {}).get(list_variable[i])
+                spinbox.setToolTip(f"{self.mixture_hack_object.confidence:.0%} interval {uncertainty['low']:.3f} to {uncertainty['high']:.3f}" if uncertainty else '')
+    
+    def on_solution_error(self, name: str, message: str):
+        self.label_hack_data.setText(f"Mixture: {name}\nFailed: {message}")
     
     # SIGNAL
     def on_signal_from_calibration(self, dict_calibration_object: dict[str, Calibration]):
         self.label_hack_data.clear()
         self.dict_calibration_object = dict_calibration_object
+        selected_name = [item.text() for item in self.list_widget_calibration_object.selectedItems()]
         self.list_widget_calibration_object.clear()
         for name in self.dict_calibration_object.keys():
             self.list_widget_calibration_object.addItem(name)
+            if name in selected_name:
+                self.list_widget_calibration_object.item(self.list_widget_calibration_object.count()-1).setSelected(True)
     
     def on_signal_from_mixture(self, dict_mixture_object: dict[str, Mixture]):
         self.label_hack_data.clear()
         self.dict_mixture_object = dict_mixture_object
+        current_item = self.list_widget_mixture_object.currentItem()
+        current_name = current_item.text() if current_item is not None else None
         self.list_widget_mixture_object.clear()
         for name in self.dict_mixture_object.keys():
-            self.list_widget_mixture_object.addItem(name)
\ No newline at end of file
+            self.list_widget_mixture_object.addItem(name)
+            if name == current_name:
+                self.list_widget_mixture_object.setCurrentRow(self.list_widget_mixture_object.count()-1)
\ No newline at end of file
@@ -0,0 +1,38 @@
+from PySide6.QtWidgets import QWidget, QHBoxLayout, QProgressBar, QPushButton
+
+from package.ui.worker import WorkerBatch
+
+class WidgetProgress(QWidget):
+    """ Progress bar with a cancel button for the currently tracked WorkerBatch. """
+    def __init__(self):
+        super().__init__()
+        self.batch = None
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setValue(0)
+        self.button_cancel = QPushButton("Cancel")
+        self.button_cancel.setEnabled(False)
+        self.button_cancel.clicked.connect(self.cancel)
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.progress_bar, 1)
+        layout.addWidget(self.button_cancel)
+        self.setLayout(layout)
+
+    def track(self, batch: WorkerBatch):
+        """ Follow a new batch, cancelling the one tracked before it. """
+        self.cancel()
+        self.batch = batch
+        batch.progress.connect(self.update_progress)
+        batch.done.connect(self.finish)
+        self.button_cancel.setEnabled(True)
+
+    def cancel(self):
+        if self.batch is not None:
+            self.batch.cancel()
+
+    def update_progress(self, count_done: int, count_total: int):
+        self.progress_bar.setMaximum(max(count_total, 1))
+        self.progress_bar.setValue(count_done)
+
+    def finish(self):
+        self.button_cancel.setEnabled(False)
@@ -0,0 +1,103 @@
+import threading
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+from package.image_processing.image_processing import PreprocessingContext
+
+_thread_state = threading.local()
+
+def thread_context() -> PreprocessingContext:
+    """ Preprocessing context of the calling pool thread, so the plates it processes one after another share buffers. """
+    if not hasattr(_thread_state, 'context'):
+        _thread_state.context = PreprocessingContext()
+    return _thread_state.context
+
+class WorkerSignals(QObject):
+    finished = Signal(str, object)
+    failed = Signal(str, str)
+
+class Worker(QRunnable):
+    """ Run function(*args) on a pool thread and report the result by name. """
+    def __init__(self, name: str, function, *args):
+        super().__init__()
+        # The batch keeps every worker, so it may call tryTake on one that has already finished
+        self.setAutoDelete(False)
+        self.name = name
+        self.function = function
+        self.args = args
+        self.cancelled = False
+        self.signals = WorkerSignals()
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            result = self.function(*self.args)
+        except Exception as error:
+            if not self.cancelled:
+                self.signals.failed.emit(self.name, repr(error))
+            return
+        if not self.cancelled:
+            self.signals.finished.emit(self.name, result)
+
+class WorkerBatch(QObject):
+    """ A group of workers sharing one progress count and one cancel switch.
+
+    result_ready and error fire on the GUI thread as soon as each task ends, so
+    results can be shown while the rest of the batch is still running.
+    """
+    result_ready = Signal(str, object)
+    error = Signal(str, str)
+    progress = Signal(int, int)
+    done = Signal()
+
+    def __init__(self, parent: QObject = None, thread_pool: QThreadPool = None):
+        super().__init__(parent)
+        self.thread_pool = thread_pool or QThreadPool.globalInstance()
+        self.list_worker = []
+        self.count_done = 0
+        self.cancelled = False
+
+    def submit(self, name: str, function, *args):
+        worker = Worker(name, function, *args)
+        worker.signals.finished.connect(self.__on_finished)
+        worker.signals.failed.connect(self.__on_failed)
+        self.list_worker.append(worker)
+
+    def start(self):
+        self.progress.emit(0, len(self.list_worker))
+        if not self.list_worker:
+            self.done.emit()
+            return
+        for worker in self.list_worker:
+            self.thread_pool.start(worker)
+
+    def cancel(self):
+        """ Drop queued tasks and ignore the results of tasks already running. """
+        if self.cancelled or self.is_done():
+            return
+        self.cancelled = True
+        for worker in self.list_worker:
+            worker.cancelled = True
+            self.thread_pool.tryTake(worker)
+        self.done.emit()
+
+    def is_done(self) -> bool:
+        return self.count_done == len(self.list_worker)
+
+    def __on_finished(self, name: str, result: object):
+        if self.cancelled:
+            return
+        self.result_ready.emit(name, result)
+        self.__advance()
+
+    def __on_failed(self, name: str, message: str):
+        if self.cancelled:
+            return
+        self.error.emit(name, message)
+        self.__advance()
+
+    def __advance(self):
+        self.count_done += 1
+        self.progress.emit(self.count_done, len(self.list_worker))
+        if self.is_done():
+            self.done.emit()
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import Executor
+
+POLL_SECONDS = 1.0
+# A file is taken once its size and modification time have not changed for this long
+SETTLE_SECONDS = 2.0
+
+class FileSettler:
+    """ Polls a directory and reports each new file once it has stopped changing.
+
+    Only the size and modification time of files still in the directory are kept, so
+    memory follows the directory listing, not the number of files ever seen. A file that
+    is rewritten after it was reported is reported again.
+    """
+    def __init__(self, directory: str, extensions: tuple[str], settle_seconds: float = SETTLE_SECONDS, skip: set[str] = None):
+        self.directory = os.path.abspath(directory)
+        self.extensions = extensions
+        self.settle_seconds = settle_seconds
+        self.skip = set(skip or ())
+        # path -> (size, mtime_ns, time the signature was first seen, reported)
+        self.state = {}
+
+    def poll(self) -> list[str]:
+        """ Paths that have been stable for settle_seconds and were not reported yet, oldest first. """
+        now = time.monotonic()
+        state = {}
+        list_ready = []
+        with os.scandir(self.directory) as iterator:
+            for entry in iterator:
+                if not entry.is_file() or not entry.name.lower().endswith(self.extensions):
+                    continue
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                size, mtime_ns, since, reported = self.state.get(entry.path, (None, None, now, entry.path in self.skip))
+                if (size, mtime_ns) != signature:
+                    since, reported = now, reported and size is None
+                state[entry.path] = (*signature, since, reported)
+                if not reported and signature[0] > 0 and now - since >= self.settle_seconds:
+                    list_ready.append((stat.st_mtime_ns, entry.path))
+        self.state = state
+        return [path for _, path in sorted(list_ready)]
+
+    def mark_reported(self, path: str):
+        size, mtime_ns, since, _ = self.state[path]
+        self.state[path] = (size, mtime_ns, since, True)
+
+    @property
+    def pending(self) -> int:
+        """ Non-empty files seen but not reported yet, settled or not; empty files are never reported. """
+        return sum(size > 0 and not reported for size, _, _, reported in self.state.values())
+
+class JsonLinesStore:
+    """ Appends every record as one strict JSON line as soon as it is written, to a file or stdout ('-').
+
+    convert(record) turns a record into plain JSON values, with non-finite floats already replaced.
+    """
+    def __init__(self, output: str, convert=None):
+        self.output = output
+        self.convert = convert
+        self.file = sys.stdout if output == '-' else open(output, 'a')
+
+    def processed_paths(self) -> set[str]:
+        """ Paths already in the output file, so a restarted service skips them. """
+        if self.output == '-' or not os.path.exists(self.output):
+            return set()
+        processed = set()
+        with open(self.output) as file:
+            for line in file:
+                try:
+                    processed.add(json.loads(line)['path'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return processed
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record if self.convert is None else self.convert(record), allow_nan=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+async def ingest(settler: FileSettler, process, store: JsonLinesStore, executor: Executor, concurrency: int, queue_size: int = None, poll_seconds: float = POLL_SECONDS, once: bool = False, stop: asyncio.Event = None) -> int:
+    """ Feed settled files through process(path) -> list[dict] on executor and stream the records to store.
+
+    At most concurrency plates run at once and queue_size (default: concurrency) more wait
+    in memory; when the queue is full the scanner stops polling, so a burst of scans waits
+    on disk instead. once=True returns when every file in the directory has been processed,
+    otherwise polling continues until stop is set; plates already scheduled are finished
+    either way. Returns the number of records with an error.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event() if stop is None else stop
+    queue = asyncio.Queue(maxsize=queue_size or concurrency)
+    error_count = 0
+
+    async def put(path: str) -> bool:
+        """ Queue path, or give up and return False as soon as stop is set while the queue is full. """
+        if not queue.full():
+            queue.put_nowait(path)
+            return True
+        put_task, stop_task = asyncio.ensure_future(queue.put(path)), asyncio.ensure_future(stop.wait())
+        await asyncio.wait({put_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        stop_task.cancel()
+        if put_task.done():
+            return True
+        put_task.cancel()
+        return False
+
+    async def scan():
+        while not stop.is_set():
+            for path in settler.poll():
+                if not await put(path):
+                    return
+                settler.mark_reported(path)
+                # Whatever was not queued yet stays on disk for the next run
+                if stop.is_set():
+                    return
+            if once and settler.pending == 0:
+                return
+            try:
+                await asyncio.wait_for(stop.wait(), poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def work():
+        nonlocal error_count
+        while True:
+            path = await queue.get()
+            try:
+                list_record = await loop.run_in_executor(executor, process, path)
+            except Exception as error:
+                list_record = [{'name': os.path.basename(path), 'path': path, 'error': repr(error)}]
+            for record in list_record:
+                error_count += 'error' in record
+                store.write(record)
+            queue.task_done()
+
+    list_worker = [asyncio.create_task(work()) for _ in range(concurrency)]
+    try:
+        await scan()
+        await queue.join()
+    finally:
+        for worker in list_worker:
+            worker.cancel()
+        await asyncio.gather(*list_worker, return_exceptions=True)
+    return error_count
+
+def run(*args, **kwargs) -> int:
+    """ Run ingest until it returns, or until SIGINT or SIGTERM asks it to finish the scheduled plates and stop. """
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, stop.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows event loops have no signal handlers; Ctrl+C then interrupts at once
+                pass
+        return await ingest(*args, stop=stop, **kwargs)
+    return asyncio.run(main())
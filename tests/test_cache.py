@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+import pytest
+
+from package.image_processing.cache import PreprocessingCache
+
+ARRAYS = {'mask': np.arange(10000, dtype=np.uint8)}
+
+def entry_path(cache: PreprocessingCache, key: str) -> str:
+    return os.path.join(cache.directory, f'{key}.npz')
+
+def test_truncated_entry_is_a_miss_and_is_rewritten(tmp_path):
+    cache = PreprocessingCache(str(tmp_path))
+    cache.put('key', ARRAYS)
+    path = entry_path(cache, 'key')
+    with open(path, 'r+b') as file:
+        file.truncate(os.path.getsize(path) // 2)
+    assert cache.get('key') is None
+    assert not os.path.exists(path)
+    cache.put('key', ARRAYS)
+    assert np.array_equal(cache.get('key')['mask'], ARRAYS['mask'])
+
+def test_failed_put_leaves_no_temporary_file(tmp_path, monkeypatch):
+    def disk_full(file, **arrays):
+        file.write(b'partial')
+        raise OSError(28, 'No space left on device')
+
+    cache = PreprocessingCache(str(tmp_path))
+    monkeypatch.setattr(np, 'savez_compressed', disk_full)
+    with pytest.raises(OSError):
+        cache.put('key', ARRAYS)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,29 @@
+import json
+
+import numpy as np
+
+from package.cli import to_json, write_result
+from package.watch import JsonLinesStore
+
+RECORD = {'r2': {'R': -np.inf, 'G': 0.98}, 'mean_r2': float('nan'), 'area': np.array([np.nan, 2.0]), 'peak': np.float32(np.inf), 'count': np.int64(3)}
+EXPECTED = {'r2': {'R': None, 'G': 0.98}, 'mean_r2': None, 'area': [None, 2.0], 'peak': None, 'count': 3}
+
+def strict_loads(text: str):
+    def reject(constant: str):
+        raise ValueError(f'{constant} is not strict JSON')
+    return json.loads(text, parse_constant=reject)
+
+def test_to_json_maps_non_finite_floats_to_none():
+    assert to_json([RECORD]) == [EXPECTED]
+
+def test_write_result_is_strict_json(tmp_path):
+    path = tmp_path / 'result.json'
+    write_result([RECORD], str(path))
+    assert strict_loads(path.read_text()) == [EXPECTED]
+
+def test_json_lines_store_is_strict_json(tmp_path):
+    path = tmp_path / 'result.jsonl'
+    store = JsonLinesStore(str(path), to_json)
+    store.write(RECORD)
+    store.close()
+    assert [strict_loads(line) for line in path.read_text().splitlines()] == [EXPECTED]
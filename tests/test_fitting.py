@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from package.tlc_class import fitting
+from package.tlc_class import solver
+from package.tlc_class.calibration import PeakInfo
+
+CONCENTRATION = [5.0, 10.0, 20.0, 40.0]
+
+def single_spot_peak(fit: bool = True) -> PeakInfo:
+    return PeakInfo(None, CONCENTRATION, cached={'peak_area': [np.array([1200.0])] * 3}, fit=fit)
+
+def test_single_spot_peak_r2_is_negative_infinity():
+    peak = single_spot_peak()
+    assert all(peak.r2[color] == -np.inf for color in 'RGB')
+
+def test_fit_calibration_single_spot_peak_r2_is_negative_infinity():
+    area = [np.array([100.0, 210.0, 395.0, 810.0])] * 3
+    calibration = SimpleNamespace(concentration=CONCENTRATION, peaks=[PeakInfo(None, CONCENTRATION, cached={'peak_area': area}, fit=False), single_spot_peak(fit=False)])
+    fitting.fit_calibration([calibration])
+    assert all(0.99 < calibration.peaks[0].r2[color] <= 1 for color in 'RGB')
+    assert all(calibration.peaks[1].r2[color] == -np.inf for color in 'RGB')
+
+def test_select_top_peaks_ranks_missing_r2_last():
+    list_r2 = [0.5, np.nan, 0.9, 0.7]
+    calibration = SimpleNamespace(peaks=[SimpleNamespace(r2={'R': r2}) for r2 in list_r2])
+    assert solver.select_top_peaks([calibration] * 4, len(list_r2), 'R') == [3, 4, 1, 2]
+    assert solver.select_top_peaks([calibration] * 2, len(list_r2), 'R') == [3, 4]
@@ -0,0 +1,54 @@
+import threading
+import tracemalloc
+
+import numpy as np
+
+from package.image_processing.instrument import Stage, StageRecorder
+
+ALLOCATION_BYTES = 8_000_000
+
+def allocate():
+    with Stage('allocate'):
+        return np.ones(ALLOCATION_BYTES // 8)
+
+def test_single_recorder_measures_peak():
+    with StageRecorder() as recorder:
+        allocate()
+    assert recorder.report()[0]['peak_bytes'] >= ALLOCATION_BYTES
+    assert not tracemalloc.is_tracing()
+
+def test_two_thread_recorders_share_tracing():
+    first_entered, second_entered, first_exited = threading.Event(), threading.Event(), threading.Event()
+    result = {}
+
+    def first():
+        with StageRecorder() as recorder:
+            first_entered.set()
+            second_entered.wait()
+            allocate()
+        result['first'] = recorder
+        first_exited.set()
+
+    def second():
+        first_entered.wait()
+        with StageRecorder() as recorder:
+            second_entered.set()
+            first_exited.wait()
+            # The first recorder has exited, so tracing must still be on for this one
+            result['tracing_after_first_exit'] = tracemalloc.is_tracing()
+            allocate()
+        result['second'] = recorder
+
+    list_thread = [threading.Thread(target=first), threading.Thread(target=second)]
+    for thread in list_thread:
+        thread.start()
+    for thread in list_thread:
+        thread.join()
+
+    assert result['tracing_after_first_exit']
+    assert not tracemalloc.is_tracing()
+    # Overlapping stages are reported as unmeasured rather than as 0 or another thread's peak
+    assert result['first'].report()[0]['peak_bytes'] is None
+    # The second recorder is alone again once the first exits, so its stage is measured
+    assert result['second'].report()[0]['peak_bytes'] >= ALLOCATION_BYTES
+    assert result['first'].summary()['allocate']['peak_bytes'] is None
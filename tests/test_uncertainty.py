@@ -0,0 +1,21 @@
+import numpy as np
+
+from package.tlc_class import uncertainty
+
+SIGMA = 2.0
+
+def test_interval_of_normal_draws_recovers_sigma():
+    sample = np.random.default_rng(0).normal(5.0, SIGMA, (3, 20000))
+    std, low, high = uncertainty.interval(sample, 0.95)
+    assert np.allclose(std, SIGMA, rtol=0.05)
+    assert np.allclose(low, 5.0 - 1.96 * SIGMA, atol=0.15)
+    assert np.allclose(high, 5.0 + 1.96 * SIGMA, atol=0.15)
+
+def test_interval_std_ignores_near_singular_draws():
+    rng = np.random.default_rng(0)
+    sample = rng.normal(0.0, SIGMA, 2000)
+    # A few draws of a nearly singular system land far away
+    sample[:10] = rng.choice([-1, 1], 10) * 1e5
+    std, _, _ = uncertainty.interval(sample, 0.95)
+    assert sample.std() > 100 * SIGMA
+    assert abs(std - SIGMA) < 0.2 * SIGMA
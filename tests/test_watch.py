@@ -0,0 +1,38 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from package.watch import FileSettler, ingest
+
+class ListStore:
+    def __init__(self):
+        self.list_record = []
+
+    def write(self, record: dict):
+        self.list_record.append(record)
+
+def test_stop_does_not_wait_for_a_full_queue(tmp_path):
+    for name in ('a.png', 'b.png', 'c.png'):
+        (tmp_path / name).write_bytes(b'plate')
+    release = threading.Event()
+
+    def process(path: str) -> list[dict]:
+        release.wait(5)
+        return [{'path': path}]
+
+    async def main(store: ListStore):
+        stop = asyncio.Event()
+        settler = FileSettler(str(tmp_path), ('.png',), settle_seconds=0)
+        with ThreadPoolExecutor(1) as executor:
+            task = asyncio.create_task(ingest(settler, process, store, executor, concurrency=1, queue_size=1, poll_seconds=0.01, stop=stop))
+            # One plate running and one queued, so the scanner waits to queue the third
+            await asyncio.sleep(0.1)
+            stop.set()
+            await asyncio.sleep(0.1)
+            release.set()
+            await asyncio.wait_for(task, 5)
+
+    store = ListStore()
+    asyncio.run(main(store))
+    # The third plate was never queued, so it stays on disk for the next run
+    assert len(store.list_record) == 2
@@ -0,0 +1,37 @@
+import os
+import threading
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide6.QtCore import QCoreApplication, QThreadPool
+
+from package.ui.worker import WorkerBatch
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        QCoreApplication.processEvents()
+        time.sleep(0.01)
+
+def test_cancel_partly_finished_batch_emits_done_once():
+    # Kept referenced so the application lives until the test ends
+    app = QCoreApplication.instance() or QCoreApplication([])
+    thread_pool = QThreadPool()
+    release = threading.Event()
+    batch = WorkerBatch(thread_pool=thread_pool)
+    list_result, list_done = [], []
+    batch.result_ready.connect(lambda name, result: list_result.append(name))
+    batch.done.connect(lambda: list_done.append(True))
+    batch.submit('fast', lambda: 1)
+    batch.submit('slow', release.wait, 5)
+    batch.start()
+    wait_until(lambda: list_result)
+    # Until the fast worker has left the pool, which is when Qt deletes auto-deleted runnables
+    wait_until(lambda: thread_pool.activeThreadCount() == 1, 1.0)
+    batch.cancel()
+    release.set()
+    thread_pool.waitForDone()
+    QCoreApplication.processEvents()
+    assert list_result == ['fast']
+    assert list_done == [True]